@@ -1,4 +1,7 @@
+import os
+import numpy as np
 import pandas as pd
+from typing import List, Optional, Tuple
 from pandas import DataFrame as Df
 
 
@@ -6,18 +9,214 @@ class Constants:
     SCORE_HIDDEN = -0.9
     EXCLUSION_WLIST = 'Analysis/known_spellings.txt'
     CONFIG_FNAME = 'reddit_api_creds.json'
+    CACHE_DIR = '.creddit_cache'
+    PARTISAN_RESOURCE = 'Analysis/partisan_resource.json'
+    DATABASE_FNAME = 'data/creddit.sqlite3'
+    MODEL_DIR = 'data/model'
+    COMMENT_PREFIX = 't1_'
+    POST_PREFIX = 't3_'
 
 
-def get_replies_to(comments_frame: Df, parent_id: str):
-    return comments_frame[comments_frame.parent_id.str.contains(parent_id)]
+class ThreadIndex:
+    """
+    An index over the reply tree of a comment_frame. Build it once per comment_frame and every reply/thread lookup is
+    answered in time proportional to the size of the result instead of a scan of the whole frame.
 
+        keys        comment_id of every row, aligned with the frame
+        children    parent fullname (t1_<comment_id> / t3_<post_id>) -> positions (iloc) of its direct replies
+        roots       comment_id of the top most ancestor present in the frame for every row, aligned with the frame.
+                    For a comment under a top level comment this is the top level comment.
+        root_positions      position of the root of every row, -1 for the rows in a reply cycle
+        parent_positions    position of the parent comment for every row, -1 for roots
+        depths      distance of every row from its root (roots are 0), aligned with the frame
+        order       positions of the rows in breadth first order from the roots, parents always precede children and
+                    depths are non decreasing along it
 
-def get_top_level_comments(comments_frame: Df):
+    Matching is exact on fullnames, so 'ab' never matches the replies to 'xab1'. Use `get_thread_index` to get the
+    index matching the form of a frame, `Analysis.CompactFrame.CompactThreadIndex` indexes compact frames.
+    """
+
+    def __init__(self, comment_frame: Df):
+        self.comment_frame = comment_frame
+        self.keys = comment_frame.comment_id.values
+        self.key_lookup = None
+        self.positions = {comment_id: position for position, comment_id in enumerate(comment_frame.comment_id)}
+        self.children = comment_frame.groupby('parent_id', sort=False).indices if len(comment_frame) > 0 else {}
+        self.roots, self.parent_positions, self.depths, self.order = self.build_roots()
+        self.root_positions = self.get_positions(self.roots)
+
+    def build_roots(self):
+        """
+        Labels every row with the comment_id of its root. A root is a comment whose parent is not a comment in the
+        frame, i.e a top level comment or a comment whose parent is missing from the frame.
+        The traversal is iterative, so arbitrarily deep reply chains don't hit the recursion limit.
+        :return: roots, parent positions and depths aligned with the frame, positions in breadth first order
+        """
+        comment_ids = self.comment_frame.comment_id.values
+        parent_ids = self.comment_frame.parent_id.values
+        roots = np.empty(len(comment_ids), dtype=object)
+        parent_positions = np.full(len(comment_ids), -1, dtype=np.int64)
+        depths = np.full(len(comment_ids), -1, dtype=np.int64)
+        order = []
+        for position, parent_id in enumerate(parent_ids):
+            if not self.is_comment_in_frame(parent_id):
+                roots[position] = comment_ids[position]
+                depths[position] = 0
+                order.append(position)
+        cursor = 0
+        while cursor < len(order):
+            position = order[cursor]
+            for child_position in self.get_child_positions(position):
+                roots[child_position] = roots[position]
+                parent_positions[child_position] = position
+                depths[child_position] = depths[position] + 1
+                order.append(child_position)
+            cursor += 1
+        return roots, parent_positions, depths, np.array(order, dtype=np.int64)
+
+    def get_positions(self, keys) -> np.ndarray:
+        """
+        Vectorized lookup of keys, the positions of the rows with these keys and -1 for the keys not in the frame. If
+        a key is in the frame twice its last row is returned, like `positions` does.
+        """
+        if self.key_lookup is None:
+            is_last = ~pd.Index(self.keys).duplicated(keep='last')
+            self.key_lookup = pd.Index(self.keys[is_last]), np.append(np.flatnonzero(is_last), -1)
+        unique_keys, unique_positions = self.key_lookup
+        return unique_positions[unique_keys.get_indexer(keys)]
+
+    def get_key(self, thing_id: str):
+        return self.get_id(thing_id)
+
+    def get_position(self, thing_id: str) -> int:
+        """
+        Position of the comment thing_id (comment_id or fullname), -1 if it isn't in the frame
+        """
+        return self.positions.get(self.get_key(thing_id), -1)
+
+    def get_child_positions(self, position: int) -> np.ndarray:
+        return self.get_reply_positions(Constants.COMMENT_PREFIX + self.keys[position])
+
+    def is_comment_in_frame(self, fullname) -> bool:
+        return isinstance(fullname, str) and fullname.startswith(Constants.COMMENT_PREFIX) and \
+            fullname[len(Constants.COMMENT_PREFIX):] in self.positions
+
+    def get_fullname(self, thing_id: str) -> str:
+        """
+        Returns the fullname of thing_id. Bare ids are resolved as comments if they are a comment_id in the frame and as
+        posts otherwise.
+        """
+        if thing_id.startswith((Constants.COMMENT_PREFIX, Constants.POST_PREFIX)):
+            return thing_id
+        if thing_id in self.positions:
+            return Constants.COMMENT_PREFIX + thing_id
+        return Constants.POST_PREFIX + thing_id
+
+    def get_reply_positions(self, parent_id: str) -> np.ndarray:
+        return self.children.get(self.get_fullname(parent_id), np.empty(0, dtype=np.int64))
+
+    def get_replies_to(self, parent_id: str) -> Df:
+        return self.comment_frame.iloc[self.get_reply_positions(parent_id)]
+
+    def get_top_level_positions(self, post_id: str = None) -> np.ndarray:
+        if post_id is None:
+            post_id = self.comment_frame.post_id.iloc[0]
+        return self.get_reply_positions(Constants.POST_PREFIX + self.get_id(post_id))
+
+    def get_top_level_comments(self, post_id: str = None) -> Df:
+        return self.comment_frame.iloc[self.get_top_level_positions(post_id)]
+
+    def get_flattened_thread_positions(self, parent_id: str) -> List[int]:
+        to_prune = list(self.get_reply_positions(parent_id))
+        children_positions = []
+        while len(to_prune) > 0:
+            position = to_prune.pop()
+            children_positions.append(position)
+            to_prune += list(self.get_child_positions(position))
+        return children_positions
+
+    def get_flattened_thread_under_parent_id(self, parent_id: str) -> Df:
+        return self.comment_frame.iloc[sorted(self.get_flattened_thread_positions(parent_id))]
+
+    def get_root(self, comment_id: str):
+        position = self.get_position(comment_id)
+        if position < 0:
+            raise KeyError(comment_id)
+        return self.roots[position]
+
+    @classmethod
+    def get_id(cls, fullname: str) -> str:
+        if fullname.startswith((Constants.COMMENT_PREFIX, Constants.POST_PREFIX)):
+            return fullname.split("_", 1)[1]
+        return fullname
+
+
+def get_thread_index(comment_frame: Df) -> ThreadIndex:
+    """
+    The ThreadIndex of comment_frame, a `CompactThreadIndex` if it's in the compact form of `Analysis.CompactFrame`
+    """
+    if 'comment_key' in comment_frame.columns:
+        from Analysis.CompactFrame import CompactThreadIndex
+        return CompactThreadIndex(comment_frame)
+    return ThreadIndex(comment_frame)
+
+
+def get_key_column(frame: Df) -> str:
+    """
+    The column identifying the comments of frame, comment_key in compact frames and comment_id otherwise
+    """
+    return 'comment_key' if 'comment_key' in frame.columns else 'comment_id'
+
+
+def get_comment_keys(frame: Df) -> np.ndarray:
+    return frame[get_key_column(frame)].values
+
+
+def get_row_key(row):
+    """
+    comment_key of a row of a compact frame, comment_id of a row of any other frame
+    """
+    key = getattr(row, 'comment_key', None)
+    return key if key is not None else row.comment_id
+
+
+def factorize(values: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Codes of values (-1 for missing values) and the values they stand for. Categoricals, e.g the authors of a
+    compact frame, are already factorized.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.values.astype(np.int64), values.cat.categories
+    codes, uniques = pd.factorize(values.values)
+    return codes.astype(np.int64), pd.Index(uniques)
+
+
+def get_codes(values: pd.Series, categories: pd.Index) -> np.ndarray:
+    """
+    Positions of values in categories, -1 for the missing values and the ones that aren't in categories. Only the
+    categories of categoricals are looked up.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        category_codes = np.append(categories.get_indexer(values.cat.categories), -1)
+        return category_codes[values.cat.codes.values]
+    return categories.get_indexer(values.values)
+
+
+def get_replies_to(comments_frame: Df, parent_id: str, thread_index: ThreadIndex = None):
+    """
+    Returns the direct replies to parent_id, which can be a comment_id, a post_id or a fullname (t1_/t3_).
+    Pass a prebuilt thread_index when calling this repeatedly on the same frame.
+    """
+    thread_index = thread_index if thread_index is not None else get_thread_index(comments_frame)
+    return thread_index.get_replies_to(parent_id)
+
+
+def get_top_level_comments(comments_frame: Df, thread_index: ThreadIndex = None):
     """
     Returns the top level comments to a post from the comment_frame
     """
-    post_id = comments_frame.iloc[0].post_id
-    return get_replies_to(comments_frame, post_id)
+    thread_index = thread_index if thread_index is not None else get_thread_index(comments_frame)
+    return thread_index.get_top_level_comments()
 
 
 def get_hidden_scores(comments_frame: Df):
@@ -26,42 +225,134 @@ def get_hidden_scores(comments_frame: Df):
     Some comments have their scores hidden by reddit, see
     https://www.reddit.com/r/modnews/comments/1dd0xw/moderators_new_subreddit_feature_comment_scores/
     """
+    if 'score_hidden' in comments_frame.columns:
+        return comments_frame[comments_frame.score_hidden.values]
     return comments_frame[comments_frame.score == Constants.SCORE_HIDDEN]
 
 
+def has_history_cutoff(user_frame: Df, history_before_utc: Optional[float]) -> np.ndarray:
+    """
+    Which rows of user_frame have the histories of their users up to history_before_utc (None for the whole history).
+    User frames without the history_before_utc column were crawled before the cutoff was recorded, none of their rows
+    match, see `featureGenScript.get_shared_user_frame` for how they are reused.
+    """
+    if 'history_before_utc' not in user_frame.columns:
+        return np.zeros(len(user_frame), dtype=bool)
+    cutoffs = user_frame.history_before_utc.astype(float)
+    if history_before_utc is None:
+        return cutoffs.isnull().values
+    return (cutoffs == float(history_before_utc)).values
+
+
 def get_unique_post_subreddits(user_frame: Df):
     """
     This will list all unique subreddits that any user has posted on.
     """
-    all_subreddits = set()
-    for _, row in user_frame.iterrows():
-        all_subreddits = all_subreddits.union(set(row.subreddit_post_count.keys()))
-    return list(all_subreddits)
+    from Analysis.SubredditMatrix import UserSubredditMatrix    # scipy is only needed by the subreddit helpers
+    return UserSubredditMatrix(user_frame, measures=['subreddit_post_count']).get_subreddits('subreddit_post_count')
 
 
 def get_unique_comment_subreddits(user_frame: Df):
     """
     This will list all unique subreddits that any user has commented on.
     """
-    all_subreddits = set()
-    for _, row in user_frame.iterrows():
-        all_subreddits = all_subreddits.union(set(row.subreddit_comment_count.keys()))
-    return list(all_subreddits)
+    from Analysis.SubredditMatrix import UserSubredditMatrix
+    return UserSubredditMatrix(user_frame, measures=['subreddit_comment_count']).get_subreddits(
+        'subreddit_comment_count')
+
+
+def get_frame_path(frame_type: str, post_id: str, extension: str) -> str:
+    """
+    frame_type is one of comment_frame, user_frame, post_feature_frame, dataset
+    """
+    return f'data/{frame_type}/{post_id}_{frame_type}.{extension}'
+
+
+def load_frame(frame_type: str, post_id: str, columns: List[str] = None, filters: List[Tuple] = None,
+               compact: bool = False, history_before_utc: Optional[float] = None) -> Df:
+    """
+    Loads the frame from its parquet file if there is one, from the pickle otherwise. Comment and user frames of posts
+    that only were extracted into the database (see `Ingest.database`) are loaded from it.
+    :param frame_type: comment_frame, user_frame or dataset
+    :param post_id:
+    :param columns: Only load these columns
+    :param filters: (column, op, value) predicates the rows must satisfy, see `Analysis.Storage`
+    :param compact: Convert the ids, authors and scores to the compact form of `Analysis.CompactFrame`
+    :param history_before_utc: The database can hold a user for several history cutoffs, user_frames loaded from it
+    only have the users crawled up to this one (None for the whole histories). Frame files are loaded as they are.
+    :return:
+    """
+    if compact:
+        from Analysis.CompactFrame import compact_comment_frame
+        return compact_comment_frame(load_frame(frame_type, post_id, columns=columns, filters=filters,
+                                                history_before_utc=history_before_utc))
+    parquet_path = get_frame_path(frame_type, post_id, 'parquet')
+    if os.path.exists(parquet_path):
+        from Analysis import Storage    # pyarrow is only needed once frames are stored as parquet
+        return Storage.read_frame(parquet_path, columns=columns, filters=filters)
+    pickle_path = get_frame_path(frame_type, post_id, 'pkl')
+    if not os.path.exists(pickle_path) and is_in_database(frame_type, post_id):
+        frame = load_frame_from_database(frame_type, post_id, history_before_utc=history_before_utc)
+    else:
+        frame = pd.read_pickle(pickle_path)
+    if columns is None and filters is None:
+        return frame
+    from Analysis import Storage
+    return Storage.select(frame, columns=columns, filters=filters)
+
+
+def save_frame(frame: Df, frame_type: str, post_id: str, sort_by: str = None):
+    """
+    Writes the frame to its parquet file, `load_frame` prefers it over the pickle.
+    """
+    from Analysis import Storage
+    path = get_frame_path(frame_type, post_id, 'parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Storage.write_frame(frame, path, sort_by=sort_by)
+
+
+def convert_to_parquet(frame_type: str, post_id: str):
+    save_frame(pd.read_pickle(get_frame_path(frame_type, post_id, 'pkl')), frame_type, post_id,
+               sort_by='post_id' if frame_type == 'dataset' else None)
+
+
+def has_frame(frame_type: str, post_id: str) -> bool:
+    return any(os.path.exists(get_frame_path(frame_type, post_id, extension)) for extension in ['parquet', 'pkl']) \
+        or is_in_database(frame_type, post_id)
+
+
+def is_in_database(frame_type: str, post_id: str) -> bool:
+    if frame_type not in ['comment_frame', 'user_frame'] or not os.path.exists(Constants.DATABASE_FNAME):
+        return False
+    from Ingest.database import Database
+    return Database().has_comments(post_id)
+
+
+def load_frame_from_database(frame_type: str, post_id: str, history_before_utc: Optional[float] = None) -> Df:
+    """
+    The comment_frame of post_id, or the user_frame of the authors who commented in it with their histories up to
+    history_before_utc
+    """
+    from Ingest.database import Database
+    if frame_type == 'comment_frame':
+        return Database().load_comment_frame(post_id)
+    return Database().load_user_frame(post_id=post_id, history_before_utc=history_before_utc)
 
 
-def load_comment_frame(post_id: str):
-    return pd.read_pickle(f'data/comment_frame/{post_id}_comment_frame.pkl')
+def load_comment_frame(post_id: str, columns: List[str] = None, filters: List[Tuple] = None, compact: bool = False):
+    return load_frame('comment_frame', post_id, columns=columns, filters=filters, compact=compact)
 
 
-def load_user_frame(post_id: str):
-    return pd.read_pickle(f'data/user_frame/{post_id}_user_frame.pkl')
+def load_user_frame(post_id: str, columns: List[str] = None, filters: List[Tuple] = None,
+                    history_before_utc: Optional[float] = None):
+    return load_frame('user_frame', post_id, columns=columns, filters=filters, history_before_utc=history_before_utc)
 
 
-def load_dataset_for_post(post_id):
-    return pd.read_pickle(f'data/dataset/{post_id}_dataset.pkl')
+def load_dataset_for_post(post_id, columns: List[str] = None, filters: List[Tuple] = None):
+    return load_frame('dataset', post_id, columns=columns, filters=filters)
 
 
-def get_flattened_thread_under_parent_id(comment_frame: Df, parent_id: str) -> Df:
+def get_flattened_thread_under_parent_id(comment_frame: Df, parent_id: str, thread_index: ThreadIndex = None) -> Df:
     """
     This will return all the comments that are children and grandchildren of parent_id.
     Example:
@@ -79,12 +370,8 @@ def get_flattened_thread_under_parent_id(comment_frame: Df, parent_id: str) -> D
 
     :param comment_frame: Dataframe containing all comments
     :param parent_id:
+    :param thread_index: Prebuilt ThreadIndex of comment_frame, built on the fly if not passed
     :return:
     """
-    to_prune = list(get_replies_to(comment_frame, parent_id).comment_id)
-    children_comment_ids = []
-    while len(to_prune) > 0:
-        new_parent_id = to_prune.pop()
-        children_comment_ids.append(new_parent_id)
-        to_prune += list(get_replies_to(comment_frame, new_parent_id).comment_id)
-    return comment_frame[comment_frame.comment_id.isin(children_comment_ids)]
\ No newline at end of file
+    thread_index = thread_index if thread_index is not None else get_thread_index(comment_frame)
+    return thread_index.get_flattened_thread_under_parent_id(parent_id)
@@ -0,0 +1,241 @@
+"""
+    Compact, typed in-memory form of comment frames (and of any frame with their id columns, e.g datasets).
+
+        comment_id      ->  comment_key     int64, the base36 id decoded
+        parent_id       ->  parent_kind     int8, 1 for a comment (t1_) and 3 for a post (t3_)
+                            parent_key      int64, the decoded id of the parent
+        post_id, author ->  categoricals
+        score           ->  score           int32, hidden scores are 0
+                            score_hidden    bool, the score was Constants.SCORE_HIDDEN
+
+        compact_frame = compact_comment_frame(comment_frame)
+        comment_frame = expand_comment_frame(compact_frame)
+
+    The ids take 8 bytes instead of a python string each and the tree lookups and joins of the FeatureBuilders become
+    integer operations, they take either form (see `Common.get_thread_index`). Frames are stored in the expanded form,
+    `Common.load_frame(..., compact=True)` compacts them while loading.
+"""
+import numpy as np
+import pandas as pd
+from typing import Tuple
+from pandas import DataFrame as Df
+from Analysis.Common import Constants, ThreadIndex
+
+COMMENT_KIND = 1
+POST_KIND = 3
+MAX_ID_LENGTH = 12  # 36 ** 12 < 2 ** 63
+ALPHABET = np.array([ord(char) for char in '0123456789abcdefghijklmnopqrstuvwxyz'], dtype=np.uint32)
+DIGIT_VALUES = np.full(128, -1, dtype=np.int64)     # Code point -> base36 digit, -1 if it isn't one
+DIGIT_VALUES[ALPHABET] = np.arange(36)
+CATEGORICAL_COLUMNS = ['post_id', 'author']
+
+
+def is_compact(frame: Df) -> bool:
+    return 'comment_key' in frame.columns
+
+
+def decode_ids(ids) -> np.ndarray:
+    """
+    Decodes lowercase base36 ids, e.g reddit's comment and post ids, into int64 with a few vectorized passes over a
+    fixed width array of their code points
+    :param ids: Strings, missing ids (None or NaN) are decoded to -1
+    :return: int64 array aligned with ids
+    """
+    ids = pd.Series(ids, dtype=object)
+    is_missing = ids.isnull().values
+    strings = np.array(ids.where(~is_missing, '').values, dtype=str)
+    if len(strings) == 0:
+        return np.empty(0, dtype=np.int64)
+    width = strings.dtype.itemsize // np.dtype('U1').itemsize
+    if width > MAX_ID_LENGTH:
+        raise ValueError(f"Ids longer than {MAX_ID_LENGTH} characters can't be decoded into int64")
+    code_points = strings.view(np.uint32).reshape(len(strings), width)     # Padded with 0 after the end of every id
+    lengths = (code_points != 0).sum(axis=1)
+    digits = DIGIT_VALUES[np.minimum(code_points, len(DIGIT_VALUES) - 1)]
+    in_id = np.arange(width) < lengths[:, None]
+    # Leading zeros wouldn't survive a round trip through `encode_ids`
+    is_invalid = (in_id & (digits < 0)).any(axis=1) | ((lengths > 1) & (code_points[:, 0] == ord('0')))
+    is_invalid |= (lengths == 0) & ~is_missing
+    if is_invalid.any():
+        raise ValueError(f"Not base36 ids: {list(ids[is_invalid][:5])}")
+    keys = np.zeros(len(strings), dtype=np.int64)
+    for column in range(width):
+        keys = np.where(in_id[:, column], keys * 36 + digits[:, column], keys)
+    keys[is_missing] = -1
+    return keys
+
+
+def encode_ids(keys) -> np.ndarray:
+    """
+    Inverse of `decode_ids`
+    :return: object array of the ids, NaN for the keys that are -1
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    is_missing = keys < 0
+    remaining = np.where(is_missing, 0, keys)
+    digits = []     # Least significant first
+    while len(digits) == 0 or remaining.any():
+        digits.append(remaining % 36)
+        remaining = remaining // 36
+    digits = np.stack(digits, axis=1)
+    width = digits.shape[1]
+    lengths = np.maximum(width - np.argmax(digits[:, ::-1] != 0, axis=1), 1)
+    lengths[(digits == 0).all(axis=1)] = 1
+    # The i-th character of an id is its (length - 1 - i)-th digit
+    digit_columns = lengths[:, None] - 1 - np.arange(width)
+    code_points = np.where(digit_columns >= 0,
+                           ALPHABET[np.take_along_axis(digits, np.maximum(digit_columns, 0), axis=1)], 0)
+    ids = np.ascontiguousarray(code_points, dtype=np.uint32).view(f'U{width}').ravel().astype(object)
+    ids[is_missing] = np.nan
+    return ids
+
+
+def split_fullnames(fullnames) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    t1_<comment_id> / t3_<post_id> fullnames to kinds and keys, missing fullnames are kind 0 and key -1
+    """
+    fullnames = pd.Series(fullnames, dtype=object)
+    prefixes = fullnames.str[:len(Constants.COMMENT_PREFIX)]
+    kinds = np.where(prefixes == Constants.COMMENT_PREFIX, COMMENT_KIND,
+                     np.where(prefixes == Constants.POST_PREFIX, POST_KIND, 0)).astype(np.int8)
+    if (kinds == 0).any() and fullnames[kinds == 0].notnull().any():
+        raise ValueError(f"Not fullnames: {list(fullnames[(kinds == 0) & fullnames.notnull().values][:5])}")
+    return kinds, decode_ids(fullnames.str[len(Constants.COMMENT_PREFIX):].where(kinds != 0))
+
+
+def join_fullnames(kinds: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    prefixes = np.where(kinds == COMMENT_KIND, Constants.COMMENT_PREFIX, Constants.POST_PREFIX).astype(object)
+    fullnames = prefixes + encode_ids(np.where(kinds != 0, keys, -1))
+    return np.where(kinds != 0, fullnames, np.nan)
+
+
+def compact_comment_frame(frame: Df) -> Df:
+    """
+    The compact form of frame, see the module. Columns frame doesn't have are skipped, the others are kept as they
+    are and in the same order. Missing scores are treated as hidden.
+    """
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        if column == 'comment_id':
+            columns['comment_key'] = decode_ids(values.values)
+        elif column == 'parent_id':
+            columns['parent_kind'], columns['parent_key'] = split_fullnames(values.values)
+        elif column in CATEGORICAL_COLUMNS:
+            columns[column] = values.astype('category')
+        elif column == 'score' and 'score_hidden' not in frame.columns:
+            is_hidden = (values == Constants.SCORE_HIDDEN).values | values.isnull().values
+            columns['score'] = np.where(is_hidden, 0, values.fillna(0).values).astype(np.int32)
+            columns['score_hidden'] = is_hidden
+        else:
+            columns[column] = values.values
+    return Df(columns, index=frame.index)
+
+
+def expand_comment_frame(frame: Df) -> Df:
+    """
+    Inverse of `compact_comment_frame`, frames that aren't compact are returned as they are
+    """
+    if not is_compact(frame):
+        return frame
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        if column == 'comment_key':
+            columns['comment_id'] = encode_ids(values.values)
+        elif column == 'parent_kind':
+            columns['parent_id'] = join_fullnames(values.values, frame.parent_key.values)
+        elif column in CATEGORICAL_COLUMNS:
+            columns[column] = np.asarray(values.astype(object).values, dtype=object)
+        elif column == 'score' and 'score_hidden' in frame.columns:
+            columns['score'] = np.where(frame.score_hidden.values, Constants.SCORE_HIDDEN,
+                                        values.values.astype(np.float64))
+        elif column not in ('parent_key', 'score_hidden'):
+            columns[column] = values.values
+    return Df(columns, index=frame.index)
+
+
+def get_id_memory_usage(frame: Df) -> int:
+    """
+    Bytes taken by the id, author and score columns of frame, in either form
+    """
+    id_columns = ['comment_id', 'parent_id', 'comment_key', 'parent_kind', 'parent_key', 'score', 'score_hidden'] + \
+        CATEGORICAL_COLUMNS
+    return int(frame[[column for column in id_columns if column in frame.columns]].memory_usage(deep=True).sum())
+
+
+class CompactThreadIndex(ThreadIndex):
+    """
+    ThreadIndex over a compact comment_frame, keys are comment_keys instead of comment_ids and roots are the
+    comment_keys of the roots.
+
+    The parents of all the comments are resolved with one integer lookup, roots and depths by pointer jumping (every
+    comment jumps to its ancestor's ancestor, so reply chains of depth d take log(d) vectorized passes) and the replies
+    of every comment are a slice of an array sorted by parent. There is no python loop over the comments.
+    """
+
+    def __init__(self, comment_frame: Df):
+        self.comment_frame = comment_frame
+        self.keys = comment_frame.comment_key.values
+        self.key_lookup = None
+        self.parent_kinds = comment_frame.parent_kind.values
+        self.parent_keys = comment_frame.parent_key.values
+        self.parent_positions = np.where(self.parent_kinds == COMMENT_KIND, self.get_positions(self.parent_keys), -1)
+        root_positions, self.depths = self.get_roots_and_depths(self.parent_positions)
+        self.roots = np.where(root_positions >= 0, self.keys[np.maximum(root_positions, 0)], -1)
+        self.root_positions = self.get_positions(self.roots)    # Duplicate roots resolve to the same row
+        reachable = np.flatnonzero(self.depths >= 0)
+        self.order = reachable[np.argsort(self.depths[reachable], kind='mergesort')]
+        replies = np.flatnonzero(self.parent_positions >= 0)
+        self.reply_positions = replies[np.argsort(self.parent_positions[replies], kind='mergesort')]
+        self.reply_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.parent_positions[replies],
+                                                                        minlength=len(self.keys)))])
+
+    @classmethod
+    def get_roots_and_depths(cls, parent_positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Position of the root of every comment and its distance to it, -1 for the comments in or under a
+        reply cycle, which have no root
+        """
+        ancestors = np.where(parent_positions >= 0, parent_positions, np.arange(len(parent_positions)))
+        distances = (parent_positions >= 0).astype(np.int64)
+        for _ in range(len(parent_positions).bit_length() + 1):
+            next_ancestors = ancestors[ancestors]
+            if np.array_equal(next_ancestors, ancestors):
+                break
+            distances = distances + distances[ancestors]
+            ancestors = next_ancestors
+        has_root = parent_positions[ancestors] < 0 if len(ancestors) > 0 else np.empty(0, dtype=bool)
+        return np.where(has_root, ancestors, -1), np.where(has_root, distances, -1)
+
+    def get_child_positions(self, position: int) -> np.ndarray:
+        return self.reply_positions[self.reply_offsets[position]:self.reply_offsets[position + 1]]
+
+    def get_key(self, thing_id) -> int:
+        """
+        :param thing_id: comment_key, id or fullname
+        """
+        if isinstance(thing_id, (int, np.integer)):
+            return int(thing_id)
+        return int(self.get_id(thing_id), 36)
+
+    def get_position(self, thing_id: str) -> int:
+        return int(self.get_positions([self.get_key(thing_id)])[0])
+
+    def is_comment_in_frame(self, fullname) -> bool:
+        return isinstance(fullname, str) and fullname.startswith(Constants.COMMENT_PREFIX) and \
+            self.get_position(fullname) >= 0
+
+    def get_fullname(self, thing_id) -> str:
+        if isinstance(thing_id, (int, np.integer)):
+            thing_id = encode_ids([thing_id])[0]
+        if thing_id.startswith((Constants.COMMENT_PREFIX, Constants.POST_PREFIX)):
+            return thing_id
+        return (Constants.COMMENT_PREFIX if self.get_position(thing_id) >= 0 else Constants.POST_PREFIX) + thing_id
+
+    def get_reply_positions(self, parent_id: str) -> np.ndarray:
+        fullname = self.get_fullname(parent_id)
+        if fullname.startswith(Constants.POST_PREFIX):
+            return np.flatnonzero((self.parent_kinds == POST_KIND) & (self.parent_keys == self.get_key(fullname)))
+        position = self.get_position(fullname)
+        return self.get_child_positions(position) if position >= 0 else np.empty(0, dtype=np.int64)
@@ -1,15 +1,16 @@
+import os
 import json
-import re
+import numpy as np
 import pandas as pd
 from datetime import datetime
-import profanity_check
-from textblob import TextBlob
-from typing import Dict, List
-from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Tuple
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pandas import DataFrame as Df
-from spellchecker import SpellChecker
-from Ingest.Reddit import get_reddit_instance
+from functools import lru_cache
+from Ingest.instrumentation import get_instrumentation
 from Analysis import Common
+from Analysis.Spelling import SpellingEngine, URL_PATTERN
 
 
 class CaseInsensitiveDefaultDict(defaultdict):
@@ -52,32 +53,57 @@ class UserFeatureBuilder:
             "author": user_frame_row.author
         }
 
+    def get_features_for_frame(self, user_frame: Df) -> Df:
+        """
+        Batch version of `get_features_for_row`, the subreddit features of all users come from sparse matmuls.
+        :return: Frame with a row per user of user_frame, same columns as `get_features_for_row`
+        """
+        with get_instrumentation().timer('features.subreddit'):
+            features = SubredditFeatureBuilder.get_features_for_frame(user_frame)
+        user_creation_post_creation_timedelta = self.post_creation_time - user_frame.user_account_creation_utc
+        features["user_account_age_seconds"] = user_creation_post_creation_timedelta.dt.total_seconds().values
+        features["author"] = user_frame.author.values
+        return features
+
 
 class PostFeatureBuilder:
     """
         This will get all the features from
             1. PostUserFeatureBuilder,
             2. CommentNetworkFeatureBuilder
-            3. CommentTextFeatureBuilder
+            3. ReplyGraphFeatureBuilder
+            4. CommentTextFeatureBuilder
 
         It will also add:
             post_comment_timedelta_seconds:The number of seconds between when the post was made and the comment was made
 
     """
-    def __init__(self, comment_frame: Df):
+    def __init__(self, comment_frame: Df, post_timestamp: datetime = None):
         """
         This needs the comment frame because it needs access to children of top level comments for analysis
+        :param comment_frame: In either form, compact frames (see `Analysis.CompactFrame`) are indexed by comment_key
+        :param post_timestamp: Creation time of the post, fetched from reddit if not passed
         """
+        instrumentation = get_instrumentation()
         self.comment_frame = comment_frame
-        self.postUserFBuilder = PostUserFeatureBuilder(comment_frame)
-        self.commentNetworkFBuilder = CommentNetworkFeatureBuilder(comment_frame)
+        with instrumentation.timer('features.thread_index'):
+            self.thread_index = Common.get_thread_index(comment_frame)
+        with instrumentation.timer('features.post_user.index'):
+            self.postUserFBuilder = PostUserFeatureBuilder(comment_frame, thread_index=self.thread_index)
+        with instrumentation.timer('features.network.index'):
+            self.commentNetworkFBuilder = CommentNetworkFeatureBuilder(comment_frame, thread_index=self.thread_index)
+        with instrumentation.timer('features.reply_graph.index'):
+            self.replyGraphFBuilder = ReplyGraphFeatureBuilder(comment_frame, thread_index=self.thread_index)
         self.commentTextFeatureBuilder = CommentTextFeatureBuilder(
             exclusion_wordlist_fname=Common.Constants.EXCLUSION_WLIST
         )
         self.post_id = comment_frame.post_id.iloc[0]
-        reddit = get_reddit_instance()
-        submission = reddit.submission(id=self.post_id)
-        self.post_timestamp = pd.to_datetime(submission.created_utc, unit='s')
+        if post_timestamp is None:
+            from Ingest.Reddit import get_reddit_instance   # praw is only needed to look the post up
+            reddit = get_reddit_instance()
+            submission = reddit.submission(id=self.post_id)
+            post_timestamp = pd.to_datetime(submission.created_utc, unit='s')
+        self.post_timestamp = post_timestamp
 
     def get_features_for_row(self, top_level_comment_row):
         """
@@ -87,11 +113,250 @@ class PostFeatureBuilder:
         return {
             **self.postUserFBuilder.get_features_for_row(top_level_comment_row),
             **self.commentNetworkFBuilder.get_features_for_row(top_level_comment_row),
+            **self.replyGraphFBuilder.get_features_for_row(top_level_comment_row),
             **self.commentTextFeatureBuilder.get_features_for_row(top_level_comment_row),
-            "comment_id": top_level_comment_row.comment_id,
+            Common.get_key_column(self.comment_frame): Common.get_row_key(top_level_comment_row),
             "post_comment_timedelta_seconds": time_between_post_comment.total_seconds()
         }
 
+    def get_features_for_frame(self, top_level_frame: Df, workers: int = None) -> Df:
+        """
+        Batch version of `get_features_for_row`, every sub builder computes its features for the whole
+        top_level_frame at once.
+        :param workers: Processes used for the sentiment features, see `CommentTextFeatureBuilder`
+        :return: Frame with the same columns as `get_features_for_row`, aligned with top_level_frame
+        """
+        instrumentation = get_instrumentation()
+        key_column = Common.get_key_column(top_level_frame)
+        time_between_post_comment = top_level_frame.comment_created_utc - self.post_timestamp
+        with instrumentation.timer('features.post_user'):
+            post_user_features = self.postUserFBuilder.get_features_for_frame(top_level_frame)
+        with instrumentation.timer('features.network'):
+            network_features = self.commentNetworkFBuilder.get_features_for_frame(top_level_frame)
+        with instrumentation.timer('features.reply_graph'):
+            reply_graph_features = self.replyGraphFBuilder.get_features_for_frame(top_level_frame)
+        with instrumentation.timer('features.text'):
+            text_features = self.commentTextFeatureBuilder.get_features_for_bodies(top_level_frame.body,
+                                                                                   workers=workers)
+        features = pd.concat([post_user_features.drop(columns=[key_column]), network_features, reply_graph_features,
+                              text_features], axis=1)
+        features[key_column] = top_level_frame[key_column].values
+        features["post_comment_timedelta_seconds"] = time_between_post_comment.dt.total_seconds().values
+        return features
+
+
+class IncrementalPostFeatureBuilder:
+    """
+        Refreshes a post_feature_frame (the top level comments of a post with the PostFeatureBuilder features) after a
+        delta of new or changed comments arrived, without rebuilding the features of the whole post.
+
+        The delta affects
+            1. the threads its comments are in, their network_comment_thread_* and network_user_thread_* features change
+            2. its authors (and the previous authors of changed comments), their network_user_* counts change
+            3. its top level comments, whose text features are (re)computed
+        Only the top level comments affected by 1. or 2. are recomputed, from the comments of the affected threads and
+        authors. Every other row and feature is taken from the previous post_feature_frame. Roots of comments are found
+        by walking up the parent ids, so no index over the whole post is built and the cost of a refresh follows the
+        size of the delta and of the threads it touches. The exception are the network_user_reply_* features: the reply
+        counts and comment counts of the authors are kept up to date from the replies the delta adds or removes, and
+        the reply graph is built from them with `UserReplyGraph.from_reply_counts`. Its PageRank is still iterated over
+        every author of the post, as a single reply can move the rank of all of them, but its cost follows the number
+        of authors and reply pairs rather than the number of comments.
+        The builder moves on to the updated comment_frame, the next delta can be passed to the same builder.
+        It works on comment_frames in the string form only.
+    """
+
+    def __init__(self, comment_frame: Df, post_timestamp: datetime):
+        """
+        :param comment_frame: The comment_frame the previous post_feature_frame was built from
+        """
+        self.comment_frame = comment_frame.reset_index(drop=True)
+        self.post_timestamp = post_timestamp
+        self.reply_counts = self.get_reply_counts(self.comment_frame)
+        self.author_comment_counts = Counter(self.comment_frame.author.dropna())
+        self.commentTextFeatureBuilder = CommentTextFeatureBuilder(
+            exclusion_wordlist_fname=Common.Constants.EXCLUSION_WLIST
+        )
+
+    def update(self, post_feature_frame: Df, delta_frame: Df, workers: int = None) -> Tuple[Df, Df]:
+        """
+        :param post_feature_frame: Features built from self.comment_frame, e.g by `PostFeatureBuilder`
+        :param delta_frame: New or changed comments, in the format of the comment_frame
+        :param workers: Processes used for the text features of the delta
+        :return: The updated comment_frame and post_feature_frame, as if they were built from scratch
+        """
+        comment_frame = self.merge_delta(self.comment_frame, delta_frame)
+        post_fullname = Common.Constants.POST_PREFIX + comment_frame.post_id.iloc[0]
+        top_level_frame = comment_frame[comment_frame.parent_id == post_fullname].reset_index(drop=True)
+        parent_ids = pd.Series(comment_frame.parent_id.values, index=comment_frame.comment_id.values)
+
+        # Top level comments missing from the previous frame are treated as part of the delta
+        unknown_frame = top_level_frame[~top_level_frame.comment_id.isin(post_feature_frame.comment_id)]
+        changed_frame = self.comment_frame[self.comment_frame.comment_id.isin(delta_frame.comment_id)]
+        affected_authors = set(pd.concat([delta_frame.author, changed_frame.author, unknown_frame.author]).dropna())
+        delta_roots, _ = self.get_roots(parent_ids, delta_frame.comment_id.values)
+        affected_roots = set(delta_roots) | set(unknown_frame.comment_id)
+
+        thread_positions = self.get_thread_positions(comment_frame, affected_roots)
+        author_positions = np.flatnonzero(comment_frame.author.isin(affected_authors).values)
+        affected_frame = comment_frame.iloc[np.union1d(thread_positions, author_positions)]
+        affected_frame = affected_frame.assign(**dict(zip(
+            ["root", "depth"], self.get_roots(parent_ids, affected_frame.comment_id.values)
+        )))
+
+        is_recomputed = top_level_frame.comment_id.isin(affected_roots) | top_level_frame.author.isin(affected_authors)
+        recomputed_frame = top_level_frame[is_recomputed]
+        features = post_feature_frame.set_index('comment_id').reindex(recomputed_frame.comment_id)
+        features.index = recomputed_frame.index
+        features = features[[column for column in post_feature_frame.columns if column not in top_level_frame.columns]]
+
+        thread_index = Common.ThreadIndex(comment_frame.iloc[thread_positions])
+        thread_metrics = CommentNetworkFeatureBuilder.get_thread_metrics_frame(thread_index)
+        in_affected_thread = recomputed_frame.comment_id.isin(affected_roots).values
+        for column in thread_metrics.columns:
+            features.loc[in_affected_thread, column] = \
+                thread_metrics[column].reindex(recomputed_frame.comment_id[in_affected_thread]).fillna(0).values
+
+        author_features = self.get_author_features(affected_frame, recomputed_frame, affected_authors, post_fullname)
+        for column in author_features.columns:
+            is_updated = author_features[column].notnull().values
+            features.loc[is_updated, column] = author_features.loc[is_updated, column].values
+
+        is_in_delta = recomputed_frame.comment_id.isin(delta_frame.comment_id).values | \
+            recomputed_frame.comment_id.isin(unknown_frame.comment_id).values
+        text_features = self.commentTextFeatureBuilder.get_features_for_bodies(
+            recomputed_frame.body[is_in_delta], workers=workers
+        )
+        for column in text_features.columns:
+            features.loc[is_in_delta, column] = text_features[column].values
+
+        time_between_post_comment = recomputed_frame.comment_created_utc - self.post_timestamp
+        features["post_comment_timedelta_seconds"] = time_between_post_comment.dt.total_seconds().values
+        recomputed_rows = pd.concat([recomputed_frame, features], axis=1)
+        kept_rows = post_feature_frame[~post_feature_frame.comment_id.isin(recomputed_frame.comment_id)
+                                       & post_feature_frame.comment_id.isin(top_level_frame.comment_id)]
+        updated_frame = pd.concat([kept_rows, recomputed_rows[post_feature_frame.columns]], sort=False)
+        updated_frame = updated_frame.set_index('comment_id').loc[top_level_frame.comment_id].reset_index()
+        # Any reply can move the PageRank of every author, the reply graph features of all the rows are recomputed
+        self.update_reply_counts(comment_frame, changed_frame, delta_frame)
+        reply_graph_features = ReplyGraphFeatureBuilder.from_reply_counts(
+            self.reply_counts, self.author_comment_counts.keys()
+        ).get_features_for_frame(top_level_frame)
+        for column in reply_graph_features.columns.intersection(updated_frame.columns):
+            updated_frame[column] = reply_graph_features[column].values
+        updated_frame = updated_frame[post_feature_frame.columns].astype(post_feature_frame.dtypes.to_dict())
+        self.comment_frame = comment_frame
+        return comment_frame, updated_frame
+
+    def update_reply_counts(self, comment_frame: Df, changed_frame: Df, delta_frame: Df):
+        """
+        Moves self.reply_counts and self.author_comment_counts from self.comment_frame to comment_frame. Only the
+        replies of the delta and the replies to it can change: their (replier, replied to) pairs in self.comment_frame
+        are removed and the ones in comment_frame are added.
+        :param changed_frame: The previous version of the comments of the delta
+        """
+        delta_fullnames = Common.Constants.COMMENT_PREFIX + delta_frame.comment_id.astype(str)
+        reply_ids = set(delta_frame.comment_id) | set(comment_frame.comment_id[comment_frame.parent_id.isin(
+            delta_fullnames)])
+        self.reply_counts -= self.get_reply_counts(self.comment_frame, reply_ids)
+        self.reply_counts += self.get_reply_counts(comment_frame, reply_ids)
+        self.author_comment_counts -= Counter(changed_frame.author.dropna())
+        self.author_comment_counts += Counter(delta_frame.author.dropna())
+
+    @classmethod
+    def get_reply_counts(cls, comment_frame: Df, comment_ids: set = None) -> Counter:
+        """
+        (replier, replied to) -> number of replies of the comments of comment_frame, like the edges of
+        `UserReplyGraph`. Self replies and replies with a missing author or parent are left out.
+        :param comment_ids: Only count the replies of these comments, None for all of them
+        """
+        replies = comment_frame if comment_ids is None else comment_frame[comment_frame.comment_id.isin(comment_ids)]
+        parent_ids = pd.Series(replies.parent_id.values, dtype=object)
+        is_comment = parent_ids.str.startswith(Common.Constants.COMMENT_PREFIX).fillna(False).values.astype(bool)
+        parent_comment_ids = parent_ids.str[len(Common.Constants.COMMENT_PREFIX):].values
+        parents = comment_frame[comment_frame.comment_id.isin(parent_comment_ids[is_comment])] \
+            .drop_duplicates(subset='comment_id', keep='last')    # Like UserReplyGraph, the last row of an id wins
+        parent_authors = pd.Series(parents.author.values, index=parents.comment_id.values)
+        replied_to = parent_authors.reindex(parent_comment_ids).values
+        repliers = replies.author.values
+        is_reply = is_comment & pd.notnull(repliers) & pd.notnull(replied_to)
+        is_reply[is_reply] = repliers[is_reply] != replied_to[is_reply]
+        return Counter(zip(repliers[is_reply], replied_to[is_reply]))
+
+    @classmethod
+    def merge_delta(cls, comment_frame: Df, delta_frame: Df) -> Df:
+        """
+        Replaces the changed comments of comment_frame in place and appends the new ones
+        """
+        combined = pd.concat([comment_frame, delta_frame], ignore_index=True, sort=False)
+        combined = combined.drop_duplicates(subset='comment_id', keep='last')
+        previous_positions = pd.Index(comment_frame.comment_id).get_indexer(combined.comment_id)
+        order = np.where(previous_positions >= 0, previous_positions, combined.index.values)
+        return combined.iloc[np.argsort(order, kind='mergesort')].reset_index(drop=True)
+
+    @classmethod
+    def get_roots(cls, parent_ids: pd.Series, comment_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Walks up from comment_ids, one vectorized lookup per level, until reaching comments whose parent isn't a
+        comment in the frame. Same roots and depths as `Common.ThreadIndex`.
+        :param parent_ids: parent_id of every comment of the frame, indexed by comment_id
+        :return: roots and depths aligned with comment_ids
+        """
+        roots = np.array(comment_ids, dtype=object)
+        depths = np.zeros(len(roots), dtype=np.int64)
+        climbing = np.arange(len(roots))
+        while len(climbing) > 0:
+            parents = pd.Series(parent_ids.reindex(roots[climbing]).values, dtype=object)
+            is_comment = parents.str.startswith(Common.Constants.COMMENT_PREFIX).fillna(False).values.astype(bool)
+            parent_comment_ids = parents.str[len(Common.Constants.COMMENT_PREFIX):].values
+            # The hash table of the index is built once and reused at every level
+            is_comment &= parent_ids.index.get_indexer(parent_comment_ids) >= 0
+            climbing = climbing[is_comment]
+            roots[climbing] = parent_comment_ids[is_comment]
+            depths[climbing] += 1
+        return roots, depths
+
+    @classmethod
+    def get_thread_positions(cls, comment_frame: Df, root_ids: set) -> np.ndarray:
+        """
+        Returns the positions of the roots and of all the comments under them, one hashed lookup per level
+        """
+        if len(root_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        parent_index = pd.Index(comment_frame.parent_id.values)
+        positions = [np.flatnonzero(comment_frame.comment_id.isin(root_ids).values)]
+        frontier = positions[0]
+        while len(frontier) > 0:
+            fullnames = Common.Constants.COMMENT_PREFIX + comment_frame.comment_id.values[frontier].astype(object)
+            children, _ = parent_index.get_indexer_non_unique(fullnames)
+            frontier = np.unique(children[children >= 0])
+            positions.append(frontier)
+        return np.unique(np.concatenate(positions))
+
+    @classmethod
+    def get_author_features(cls, affected_frame: Df, recomputed_frame: Df, affected_authors: set,
+                            post_fullname: str) -> Df:
+        """
+        The PostUserFeatureBuilder features of recomputed_frame from the comments of the affected threads and
+        authors. Counts over the whole post are only complete for affected authors, they are NaN for the others.
+        Comments without author have no counts.
+        """
+        by_affected_author = affected_frame[affected_frame.author.isin(affected_authors)]
+        top_level_comment_counts = by_affected_author[by_affected_author.parent_id == post_fullname].author.value_counts()
+        total_comment_counts = by_affected_author.author.value_counts()
+        replies = affected_frame[affected_frame.depth > 0]
+        thread_comment_counts = replies.groupby(['root', 'author']).size()
+        thread_keys = pd.MultiIndex.from_arrays([recomputed_frame.comment_id.values, recomputed_frame.author.values])
+        is_affected_author = recomputed_frame.author.isin(affected_authors).values | recomputed_frame.author.isnull().values
+        return Df({
+            "network_user_top_level_comment_count": np.where(
+                is_affected_author, recomputed_frame.author.map(top_level_comment_counts).fillna(0).values, np.nan),
+            "network_user_thread_comment_count":
+                thread_comment_counts.reindex(thread_keys).fillna(0).values,
+            "network_user_total_comment_count": np.where(
+                is_affected_author, recomputed_frame.author.map(total_comment_counts).fillna(0).values, np.nan),
+        }, index=recomputed_frame.index)
+
 
 class PostUserFeatureBuilder:
     """
@@ -99,10 +364,26 @@ class PostUserFeatureBuilder:
             1.  network_user_top_level_comment_count    The number of top level comments by user in the post
             2.  network_user_thread_comment_count       The number of comments by user under the same thread
             3.  network_user_total_comment_count        The number of comments by the user under the entire post
+
+        Every comment is labelled with its top level root by the ThreadIndex and the counts are aggregated once over
+        the integer codes of the authors (the categorical codes of compact frames) when the builder is created. The
+        thread counts are kept as sorted (root position, author code) pairs. Use `get_features_for_frame` to get the
+        features for all the top level comments in one call.
     """
-    def __init__(self, comment_frame: Df):
+    def __init__(self, comment_frame: Df, thread_index: Common.ThreadIndex = None):
         self.post_id = comment_frame.post_id.iloc[0]
         self.comment_frame = comment_frame
+        self.thread_index = thread_index if thread_index is not None else Common.get_thread_index(comment_frame)
+        author_codes, self.authors = Common.factorize(comment_frame.author)
+        top_level_codes = author_codes[self.thread_index.get_top_level_positions(self.post_id)]
+        self.top_level_comment_counts = pd.Series(
+            np.bincount(top_level_codes[top_level_codes >= 0], minlength=len(self.authors)), index=self.authors)
+        self.total_comment_counts = pd.Series(
+            np.bincount(author_codes[author_codes >= 0], minlength=len(self.authors)), index=self.authors)
+        is_counted_reply = (self.thread_index.depths > 0) & (author_codes >= 0)
+        self.thread_pairs, self.thread_pair_counts = np.unique(
+            self.get_thread_pairs(self.thread_index.root_positions[is_counted_reply], author_codes[is_counted_reply]),
+            return_counts=True)
 
     def get_features_for_row(self, top_level_comment_row):
         return {
@@ -111,20 +392,56 @@ class PostUserFeatureBuilder:
             "network_user_thread_comment_count":
                 self.get_flattened_level_comment_count_under_thread(
                     top_level_comment_row.author,
-                    top_level_comment_row.comment_id
+                    Common.get_row_key(top_level_comment_row)
                 ),
             "network_user_total_comment_count":
                 self.get_total_comment_count_by_author(top_level_comment_row.author)
         }
 
+    def get_features_for_frame(self, top_level_frame: Df) -> Df:
+        """
+        Batch version of `get_features_for_row`, returns the features for every row of top_level_frame.
+        :param top_level_frame: Frame of top level comments of the post
+        :return: Frame with comment_id (comment_key for compact frames) and the network_user_* features, aligned with
+        top_level_frame
+        """
+        key_column = Common.get_key_column(top_level_frame)
+        author_codes = Common.get_codes(top_level_frame.author, self.authors)
+        root_positions = self.thread_index.get_positions(top_level_frame[key_column].values)
+        is_counted = (author_codes >= 0) & (root_positions >= 0)
+        thread_comment_counts = np.zeros(len(top_level_frame), dtype=np.int64)
+        thread_comment_counts[is_counted] = self.get_thread_comment_counts(root_positions[is_counted],
+                                                                           author_codes[is_counted])
+        return Df({
+            key_column: top_level_frame[key_column].values,
+            # Code -1 (no author, or one that isn't in the comment_frame) picks the appended 0
+            "network_user_top_level_comment_count":
+                np.append(self.top_level_comment_counts.values, 0)[author_codes].astype(np.int64),
+            "network_user_thread_comment_count": thread_comment_counts,
+            "network_user_total_comment_count":
+                np.append(self.total_comment_counts.values, 0)[author_codes].astype(np.int64)
+        }, index=top_level_frame.index)
+
+    def get_thread_pairs(self, root_positions: np.ndarray, author_codes: np.ndarray) -> np.ndarray:
+        return root_positions.astype(np.int64) * max(len(self.authors), 1) + author_codes
+
+    def get_thread_comment_counts(self, root_positions: np.ndarray, author_codes: np.ndarray) -> np.ndarray:
+        """
+        Number of replies by every author under every root, one binary search per (root position, author code) pair
+        """
+        pairs = self.get_thread_pairs(root_positions, author_codes)
+        if len(self.thread_pairs) == 0:
+            return np.zeros(len(pairs), dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.thread_pairs, pairs), len(self.thread_pairs) - 1)
+        return np.where(self.thread_pairs[found] == pairs, self.thread_pair_counts[found], 0)
+
     def get_top_level_comment_count(self, author: str) -> int:
         """
         Returns the number of top level comments by author.
         :param author: author by whom comments are selected
         :return:
         """
-        top_level_comments = Common.get_replies_to(self.comment_frame, self.post_id)
-        return len(top_level_comments[top_level_comments.author == author])
+        return int(self.top_level_comment_counts.get(author, 0))
 
     def get_flattened_level_comment_count_under_thread(self, author: str, parent_id: str) -> int:
         """
@@ -134,14 +451,20 @@ class PostUserFeatureBuilder:
         :param parent_id: comment_id of the thread.
         :return:
         """
-        flattened_thread_under_parent = Common.get_flattened_thread_under_parent_id(self.comment_frame, parent_id)
+        position = self.thread_index.get_position(parent_id)
+        author_code = self.authors.get_indexer([author])[0]
+        if position >= 0 and self.thread_index.root_positions[position] == position:
+            if author_code < 0:
+                return 0
+            return int(self.get_thread_comment_counts(np.array([position]), np.array([author_code]))[0])
+        flattened_thread_under_parent = self.thread_index.get_flattened_thread_under_parent_id(parent_id)
         return len(flattened_thread_under_parent[flattened_thread_under_parent.author == author])
 
     def get_total_comment_count_by_author(self, author) -> int:
         """
         Returns the number of comments by the author in the entire post.
         """
-        return len(self.comment_frame[self.comment_frame.author == author])
+        return int(self.total_comment_counts.get(author, 0))
 
 
 class CommentNetworkFeatureBuilder:
@@ -150,30 +473,81 @@ class CommentNetworkFeatureBuilder:
             1. network_comment_thread_top_level_count   The number of top level comments that are children to the thread
             2. network_comment_thread_max_depth         The height of the tallest tree in the thread
             3. network_comment_thread_size              The total number of children in the thread
+
+        The three metrics are computed for every comment of the frame at once by `get_thread_metrics_frame`, the per
+        row methods are lookups into it.
     """
 
-    def __init__(self, comment_frame: Df):
+    def __init__(self, comment_frame: Df, thread_index: Common.ThreadIndex = None):
         self.comment_frame = comment_frame
+        self.thread_index = thread_index if thread_index is not None else Common.get_thread_index(comment_frame)
+        self.thread_metrics = self.get_thread_metrics_frame(self.thread_index)
 
     def get_features_for_row(self, top_level_comment_row):
+        comment_key = Common.get_row_key(top_level_comment_row)
         return {
             "network_comment_thread_top_level_count":
-                self.get_top_level_comment_count_under_thread(top_level_comment_row.comment_id),
+                self.get_top_level_comment_count_under_thread(comment_key),
             "network_comment_thread_max_depth":
                 self.get_max_depth_under_thread(
-                    top_level_comment_row.comment_id,
+                    comment_key,
                 ),
             "network_comment_thread_size":
-                self.get_thread_size(top_level_comment_row.comment_id),
+                self.get_thread_size(comment_key),
         }
 
+    def get_features_for_frame(self, top_level_frame: Df) -> Df:
+        """
+        Batch version of `get_features_for_row`, a reindex of the thread metrics by the comment_ids (or comment_keys) of
+        top_level_frame
+        """
+        features = self.thread_metrics.reindex(Common.get_comment_keys(top_level_frame)).fillna(0).astype(np.int64)
+        features.index = top_level_frame.index
+        return features
+
+    @classmethod
+    def get_thread_metrics_frame(cls, thread_index: Common.ThreadIndex) -> Df:
+        """
+        Computes the network features for every comment in one bottom up pass over the reply forest. The rows of the
+        index's breadth first order are grouped by depth and every level is folded into its parents with vectorized
+        scatter operations, starting from the deepest level. There is no recursion, so deep reply chains are fine.
+        :param thread_index: ThreadIndex of the comment_frame
+        :return: Frame indexed by the keys of the index (comment_ids, or comment_keys for compact frames) with the
+        network_comment_thread_* features as columns
+        """
+        comment_count = len(thread_index.comment_frame)
+        max_depth = np.zeros(comment_count, dtype=np.int64)
+        thread_size = np.zeros(comment_count, dtype=np.int64)
+        child_count = np.zeros(comment_count, dtype=np.int64)
+        order = thread_index.order
+        order_depths = thread_index.depths[order]
+        deepest_level = order_depths[-1] if len(order) > 0 else 0
+        for level in range(deepest_level, 0, -1):
+            positions = order[np.searchsorted(order_depths, level, side='left'):
+                              np.searchsorted(order_depths, level, side='right')]
+            parent_positions = thread_index.parent_positions[positions]
+            np.maximum.at(max_depth, parent_positions, max_depth[positions] + 1)
+            np.add.at(thread_size, parent_positions, thread_size[positions] + 1)
+            np.add.at(child_count, parent_positions, 1)
+        return Df({
+            "network_comment_thread_top_level_count": child_count,
+            "network_comment_thread_max_depth": max_depth,
+            "network_comment_thread_size": thread_size
+        }, index=thread_index.keys)
+
+    def get_thread_metric(self, parent_id: str, metric: str) -> int:
+        comment_key = self.thread_index.get_key(parent_id)
+        if comment_key not in self.thread_metrics.index:
+            return 0
+        return int(self.thread_metrics.at[comment_key, metric])
+
     def get_top_level_comment_count_under_thread(self, parent_id: str) -> int:
         """
         Gets the number of top level comments under a given parent_id
         :param parent_id:
         :return:
         """
-        return len(Common.get_replies_to(self.comment_frame, parent_id))
+        return self.get_thread_metric(parent_id, "network_comment_thread_top_level_count")
 
     def get_max_depth_under_thread(self, parent_id: str, curr_depth = 0) -> int:
         """
@@ -182,20 +556,103 @@ class CommentNetworkFeatureBuilder:
         :param curr_depth: Depth of parent, if parent is a top level comment depth is 0 and is default behavior.
         :return: Height of tallest tree
         """
-        max_depth = curr_depth
-        children_ids = list(Common.get_replies_to(self.comment_frame, parent_id).comment_id)
-        for child_comment_id in children_ids:
-            max_depth = max(max_depth, self.get_max_depth_under_thread(child_comment_id, curr_depth + 1))
-        return max_depth
+        return curr_depth + self.get_thread_metric(parent_id, "network_comment_thread_max_depth")
 
     def get_thread_size(self, parent_id: str) -> int:
-        return len(Common.get_flattened_thread_under_parent_id(self.comment_frame, parent_id))
+        return self.get_thread_metric(parent_id, "network_comment_thread_size")
+
+
+class ReplyGraphFeatureBuilder:
+    """
+        Generates the features of the author of a comment in the reply graph of the post (see
+        `Analysis.ReplyGraph.UserReplyGraph`)
+            1. network_user_reply_in_degree     The number of users who replied to the user
+            2. network_user_reply_out_degree    The number of users the user replied to
+            3. network_user_reply_reciprocity   The share of the users the user replied to who replied back
+            4. network_user_reply_pagerank      The PageRank of the user in the reply graph, 1 for an average user
+
+        The graph and the metrics of every author are computed once when the builder is created, the features of a
+        comment are a lookup by its author. Comments without author, or by one that isn't in the comment_frame, get 0.
+    """
+
+    def __init__(self, comment_frame: Df, thread_index: Common.ThreadIndex = None):
+        from Analysis.ReplyGraph import UserReplyGraph  # scipy is only needed once the graph is built
+        self.reply_graph = UserReplyGraph(comment_frame, thread_index=thread_index)
+        self.user_metrics = self.reply_graph.get_user_metrics_frame()
+
+    @classmethod
+    def from_reply_counts(cls, reply_counts: Mapping[Tuple[str, str], int],
+                          authors: Iterable[str]) -> 'ReplyGraphFeatureBuilder':
+        """
+        Builder over the graph of `UserReplyGraph.from_reply_counts`, for reply counts that are kept up to date
+        elsewhere
+        """
+        from Analysis.ReplyGraph import UserReplyGraph  # scipy is only needed once the graph is built
+        builder = cls.__new__(cls)
+        builder.reply_graph = UserReplyGraph.from_reply_counts(reply_counts, authors)
+        builder.user_metrics = builder.reply_graph.get_user_metrics_frame()
+        return builder
+
+    def get_features_for_row(self, top_level_comment_row):
+        return {
+            column: self.user_metrics[column].get(top_level_comment_row.author, 0)
+            for column in self.user_metrics.columns
+        }
+
+    def get_features_for_frame(self, top_level_frame: Df) -> Df:
+        """
+        Batch version of `get_features_for_row`, one lookup of the author codes of top_level_frame
+        """
+        author_codes = Common.get_codes(top_level_frame.author, self.user_metrics.index)
+        # Code -1 (no author, or one that isn't in the comment_frame) picks the appended 0
+        return Df({
+            column: np.append(values, 0)[author_codes].astype(values.dtype)
+            for column, values in self.user_metrics.items()
+        }, index=top_level_frame.index)
+
+
+def get_sentiment_features_for_bodies(comment_bodies: List[str]) -> List[tuple]:
+    """
+    Returns the (polarity, subjectivity) of every comment body. Module level so that it can run in a worker process.
+    """
+    from textblob import TextBlob   # Imported by the first sentiment computed in the process, not by every worker
+    sentiments = [TextBlob(comment_body).sentiment for comment_body in comment_bodies]
+    return [(sentiment.polarity, sentiment.subjectivity) for sentiment in sentiments]
+
+
+def predict_profanity(comment_bodies: List[str]) -> np.ndarray:
+    """
+    profanity_check unpickles its sklearn model when it's imported, it's only imported by the first prediction
+    """
+    import profanity_check
+    return profanity_check.predict(comment_bodies)
 
 
 class CommentTextFeatureBuilder:
+    """
+        Generates the comment_text_* features, the spelling features and the url, citation and user reference features
+        of a comment body.
+
+        `get_features_for_row` works on a single comment. `get_features_for_bodies` works on a whole Series of bodies
+        and gives the same output:
+            1. profanity is predicted with one call over all the bodies
+            2. url, citation, user reference and character counts are vectorized pandas str operations
+            3. spelling goes through the batched SpellingEngine
+            4. sentiment is computed in chunks of SENTIMENT_CHUNK_SIZE bodies spread over a process pool
+
+        The models behind them (textblob, profanity_check and the spell checker's dictionary) are loaded on first use,
+        once per process.
+    """
+    SENTIMENT_CHUNK_SIZE = 500
+
     def __init__(self, exclusion_wordlist_fname: str):
-        self.spell_check = SpellChecker()
-        self.excluded_wordlist = self.load_excluded_words(exclusion_wordlist_fname)
+        # The engine, its dictionary and its memo of verdicts are shared by every builder in the process
+        self.spelling_engine = SpellingEngine.get_shared(exclusion_wordlist_fname)
+        self.excluded_wordlist = self.spelling_engine.excluded_words
+
+    @property
+    def spell_check(self):
+        return self.spelling_engine.spell_check
 
     def get_features_for_row(self, top_level_comment_row):
         body = top_level_comment_row.body
@@ -204,13 +661,18 @@ class CommentTextFeatureBuilder:
                 **CommentTextFeatureBuilder.get_sentiment_features(body),
                 **self.get_spelling_features(comment_body=body),
                 **CommentTextFeatureBuilder.get_url_features(body),
-                "comment_text_profanity": profanity_check.predict([body])[0],       # Profanity_check.predict takes an iterable
+                "comment_text_profanity": predict_profanity([body])[0],       # Profanity_check.predict takes an iterable
                 "comment_has_citation":  ">" in body,     # Markdown citation
                 "comment_has_user_ref": " u/" in body,
                 "comment_char_count": len(body)
             }
         except Exception as e:
-            print(e, top_level_comment_row.comment_id)
+            instrumentation = get_instrumentation()
+            if instrumentation.counters['features.comment_text.failures'] == 0:
+                print(f"Couldn't build the text features of {Common.get_row_key(top_level_comment_row)}: {e!r}, the "
+                      f"following failures are only counted in features.comment_text.failures")
+            instrumentation.count('features.comment_text.failures')
+            return {}
 
     def get_spelling_features(self, comment_body: str) -> Dict:
         """
@@ -219,27 +681,84 @@ class CommentTextFeatureBuilder:
         :param comment_body:
         :return:
         """
-        comment_body = str.lstrip(comment_body)
-        comment_body = str.rstrip(comment_body)
-        comment_body = CommentTextFeatureBuilder.remove_urls(comment_body)
-        comment_body = ''.join(list(map(lambda char: char if char.isalpha() else " ", list(comment_body))))
-        uncorrected_words = comment_body.split(' ')
-        mistakes_count, mistaken_words = 0, []
-        for uncorrected_word in uncorrected_words:
-            if len(uncorrected_word) > 0 and not self.is_word_spelled_correctly(uncorrected_word):
-                mistakes_count += 1
-                mistaken_words.append(uncorrected_word)
-        return {
-            "comment_spelling_error_count": mistakes_count,
-            "meta_comment_spelling_errors": mistaken_words
-        }
+        return self.spelling_engine.get_spelling_features([comment_body])[0]
+
+    def get_spelling_features_for_bodies(self, comment_bodies: List[str]) -> List[Dict]:
+        """
+        Batch version of `get_spelling_features`, the new words of all comment_bodies are looked up in one call.
+        """
+        return self.spelling_engine.get_spelling_features(comment_bodies)
+
+    def get_features_for_bodies(self, comment_bodies: pd.Series, workers: int = None) -> Df:
+        """
+        Batch version of `get_features_for_row`.
+        :param comment_bodies: Series of comment bodies, e.g top_level_frame.body
+        :param workers: Processes used for the sentiment features, defaults to the number of cores. 1 runs in process.
+        :return: Frame with the same columns as `get_features_for_row`, aligned with comment_bodies
+        """
+        instrumentation = get_instrumentation()
+        bodies = list(comment_bodies)
+        with instrumentation.timer('features.text.sentiment'):
+            sentiments = self.get_sentiment_features_for_bodies(bodies, workers=workers)
+        with instrumentation.timer('features.text.spelling'):
+            spelling_features = self.get_spelling_features_for_bodies(bodies)
+        with instrumentation.timer('features.text.profanity'):
+            profanity = predict_profanity(bodies) if len(bodies) > 0 else np.array([], dtype=np.int64)
+        features = Df({
+            "comment_text_polarity": [polarity for polarity, _ in sentiments],
+            "comment_text_subjectivity": [subjectivity for _, subjectivity in sentiments],
+            "comment_spelling_error_count":
+                [spelling["comment_spelling_error_count"] for spelling in spelling_features],
+            "meta_comment_spelling_errors":
+                [spelling["meta_comment_spelling_errors"] for spelling in spelling_features],
+            "comment_url_refer_count": self.get_url_refer_counts(comment_bodies).values,
+            "comment_text_profanity": profanity,
+            "comment_has_citation": comment_bodies.str.contains(">", regex=False).values,
+            "comment_has_user_ref": comment_bodies.str.contains(" u/", regex=False).values,
+            "comment_char_count": comment_bodies.str.len().values
+        }, columns=[
+            "comment_text_polarity", "comment_text_subjectivity", "comment_spelling_error_count",
+            "meta_comment_spelling_errors", "comment_url_refer_count", "comment_text_profanity",
+            "comment_has_citation", "comment_has_user_ref", "comment_char_count"
+        ])
+        features.index = comment_bodies.index
+        return features
+
+    @classmethod
+    def get_sentiment_features_for_bodies(cls, comment_bodies: List[str], workers: int = None) -> List[tuple]:
+        """
+        Returns the (polarity, subjectivity) of every body, chunks of bodies are scored in parallel processes.
+        """
+        workers = workers if workers is not None else os.cpu_count() or 1
+        chunks = [comment_bodies[start:start + cls.SENTIMENT_CHUNK_SIZE]
+                  for start in range(0, len(comment_bodies), cls.SENTIMENT_CHUNK_SIZE)]
+        if workers <= 1 or len(chunks) <= 1:
+            return get_sentiment_features_for_bodies(comment_bodies)
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            return [sentiment for chunk in executor.map(get_sentiment_features_for_bodies, chunks)
+                    for sentiment in chunk]
+
+    @classmethod
+    def get_url_refer_counts(cls, comment_bodies: pd.Series) -> pd.Series:
+        """
+        Vectorized `get_url_features`, returns the number of space separated words containing a URL in every body
+        """
+        words = comment_bodies.str.split(' ')
+        word_counts = words.str.len().values.astype(np.int64)
+        if word_counts.sum() == 0:
+            return pd.Series(np.zeros(len(comment_bodies), dtype=np.int64), index=comment_bodies.index)
+        flat_words = pd.Series(np.concatenate([np.asarray(body_words, dtype=object) for body_words in words]))
+        is_url = flat_words.str.contains(URL_PATTERN).values.astype(np.int64)
+        body_positions = np.repeat(np.arange(len(comment_bodies)), word_counts)
+        counts = np.bincount(body_positions, weights=is_url, minlength=len(comment_bodies)).astype(np.int64)
+        return pd.Series(counts, index=comment_bodies.index)
 
     @classmethod
     def get_sentiment_features(cls, comment_body: str):
-        blob = TextBlob(comment_body)
+        (polarity, subjectivity), = get_sentiment_features_for_bodies([comment_body])
         return {
-            "comment_text_polarity": blob.sentiment.polarity,
-            "comment_text_subjectivity": blob.sentiment.subjectivity
+            "comment_text_polarity": polarity,
+            "comment_text_subjectivity": subjectivity
         }
 
     @classmethod
@@ -262,18 +781,14 @@ class CommentTextFeatureBuilder:
         :param exclusion_wordlist_fname:
         :return:
         """
-        fd = open(exclusion_wordlist_fname, 'rt')
-        excluded_words = fd.read()
-        fd.close()
-        return excluded_words.split('\n')
+        return SpellingEngine.load_excluded_words(exclusion_wordlist_fname)
 
     @classmethod
     def is_word_a_url(cls, word: str) -> bool:
         """
         Returns true if there is a url contained in the word
         """
-        url = re.findall('http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+] |[!*\(\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', word)
-        return len(url) > 0
+        return URL_PATTERN.search(word) is not None
 
     @classmethod
     def remove_urls(cls, text: str) -> str:
@@ -289,21 +804,57 @@ class CommentTextFeatureBuilder:
         return text
 
     def is_excluded(self, word) -> bool:
-        for excluded_word in self.excluded_wordlist:
-            if excluded_word in word:
-                return True
-        return False
+        return self.spelling_engine.is_excluded(word)
 
     def is_word_spelled_correctly(self, word: str) -> bool:
         """
         Returns true if word is spelled correctly
         """
-        wrong_words = self.spell_check.unknown([word])
-        wrong_words = list(filter(lambda word: not self.is_excluded(word), wrong_words))
-        return len(wrong_words) == 0
+        word = word.lower()
+        self.spelling_engine.learn_tokens([word])
+        return self.spelling_engine.is_spelled_correctly(word)
 
 
 class SubredditFeatureBuilder:
+    """
+        Aggregates the subreddit activity of users over the partisan categories of `Analysis/partisan_resource.json`
+        and the r/politics and r/news subreddits.
+
+        `get_features` works on the dicts of a single user, `get_features_for_frame` on a whole user_frame at once.
+    """
+    CATEGORIES = [("left", "left_leaning"), ("right", "right_leaning"), ("center", "centrist")]
+    SPECIFIC_SUBREDDITS = ["politics", "news"]
+
+    @classmethod
+    def get_features_for_frame(cls, user_frame: Df) -> Df:
+        """
+        Builds the users x subreddits matrices of the user_frame and the subreddits x categories indicator matrix, all
+        the features are then one sparse matmul per measure.
+        :return: Frame with a row per user of user_frame, same columns as `get_features`
+        """
+        from Analysis.SubredditMatrix import UserSubredditMatrix    # scipy is only needed by the user features
+        user_subreddit_matrix = UserSubredditMatrix(user_frame)
+        categories = {
+            **{prefix: cls.get_subreddits_in_category(category) for prefix, category in cls.CATEGORIES},
+            **{subreddit: [subreddit] for subreddit in cls.SPECIFIC_SUBREDDITS}
+        }
+        category_matrix = user_subreddit_matrix.get_category_matrix(categories)
+        aggregates = {
+            measure: user_subreddit_matrix.aggregate(f"subreddit_{measure}", category_matrix)
+            for measure in ["post_count", "post_karma", "comment_count", "comment_karma"]
+        }
+        features = {}
+        prefixes = list(categories.keys())
+        for prefix, _ in cls.CATEGORIES:    # Same column order as get_partisan_features
+            for measure in ["post_count", "post_karma"]:
+                features[f"{prefix}_subreddit_{measure}"] = aggregates[measure][:, prefixes.index(prefix)]
+        for prefix, _ in cls.CATEGORIES:
+            for measure in ["comment_count", "comment_karma"]:
+                features[f"{prefix}_subreddit_{measure}"] = aggregates[measure][:, prefixes.index(prefix)]
+        for subreddit in cls.SPECIFIC_SUBREDDITS:
+            for measure in ["post_count", "post_karma", "comment_count", "comment_karma"]:
+                features[f"{subreddit}_subreddit_{measure}"] = aggregates[measure][:, prefixes.index(subreddit)]
+        return Df(features, index=user_frame.index)
 
     @classmethod
     def get_features(cls, **args):
@@ -369,8 +920,13 @@ class SubredditFeatureBuilder:
 
     @staticmethod
     def get_subreddits_in_category(partisan_leaning) -> List[str]:
-        with open('Analysis/partisan_resource.json') as json_data:
+        return SubredditFeatureBuilder.load_partisan_resource()[partisan_leaning]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def load_partisan_resource() -> Dict[str, List[str]]:
+        with open(Common.Constants.PARTISAN_RESOURCE) as json_data:
             partisan_json = json.load(json_data)
             json_data.close()
-        return partisan_json[partisan_leaning]
+        return partisan_json
 
@@ -0,0 +1,211 @@
+"""
+    Trains, persists and applies the misinformation classifier of Model.ipynb outside the notebook.
+
+        python -m Analysis.Model combined --estimator xgboost --name misinformation
+
+    trains on the dataset saved under `combined` (see featureGenScript) and writes the artifact to
+    data/model/misinformation/v{n}.pkl, n being one more than the latest version. Scoring only needs the artifact
+        model = Model.load_latest('misinformation')
+        probabilities = model.predict(dataset)
+"""
+import os
+import re
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from pandas import DataFrame as Df
+from Analysis import Common
+from Analysis.Common import Constants
+
+# Ordered, the columns of the matrices the scaler and the estimator are fit on
+TRAINING_DATA_FEATURES = [
+    'golds', 'comment_char_count', 'comment_text_polarity', 'network_comment_thread_max_depth',
+    'network_user_total_comment_count', 'news_subreddit_comment_karma', 'politics_subreddit_post_karma',
+    'left_subreddit_comment_count', 'news_subreddit_comment_count', 'comment_has_user_ref', 'user_email_verified',
+    'user_total_comment_count', 'comment_spelling_error_count', 'right_subreddit_comment_count',
+    'network_user_thread_comment_count', 'user_account_age_seconds', 'center_subreddit_comment_karma',
+    'post_comment_timedelta_seconds', 'right_subreddit_post_karma', 'comment_url_refer_count',
+    'center_subreddit_comment_count', 'comment_has_citation', 'center_subreddit_post_karma',
+    'politics_subreddit_comment_count', 'politics_subreddit_post_count', 'user_total_post_karma',
+    'politics_subreddit_comment_karma', 'left_subreddit_comment_karma', 'user_total_post_count',
+    'comment_text_profanity', 'network_comment_thread_size', 'user_total_comment_karma',
+    'network_comment_thread_top_level_count', 'network_user_top_level_comment_count', 'left_subreddit_post_count',
+    'news_subreddit_post_count', 'right_subreddit_comment_karma', 'left_subreddit_post_karma',
+    'comment_text_subjectivity', 'right_subreddit_post_count', 'center_subreddit_post_count',
+    'news_subreddit_post_karma'
+]
+MISINFORMATION_SCORE = -10  # Comments scored below are labelled misinformation
+CREDIBLE_SCORE = 30         # Comments scored above are labelled credible
+ESTIMATORS = ['xgboost', 'random_forest']
+ARTIFACT_FORMAT = 1         # Bumped whenever the layout of the pickled artifact changes
+
+
+def gen_model_for(dataset: Df) -> Df:
+    """
+    Labels the comments of dataset, the ones scored below MISINFORMATION_SCORE are misinformation (1) and the ones
+    scored above CREDIBLE_SCORE are not (0). The others are dropped.
+    """
+    dataset = dataset.sort_values(by=['score'])
+    top = dataset[dataset.score < MISINFORMATION_SCORE].assign(misinformation=1)
+    bottom = dataset[dataset.score > CREDIBLE_SCORE].assign(misinformation=0)
+    return pd.concat([top, bottom]).reset_index(drop=True)[
+        ['comment_id', 'post_id'] + TRAINING_DATA_FEATURES + ['misinformation']
+    ]
+
+
+def get_estimator(name: str):
+    """
+    The tuned estimators of Model.ipynb
+    """
+    if name == 'xgboost':
+        from xgboost import XGBClassifier   # Only needed to train, or load, xgboost models
+        return XGBClassifier(learning_rate=0.21, max_depth=4, n_estimators=138)
+    if name == 'random_forest':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_estimators=47, criterion='entropy', random_state=0)
+    raise ValueError(f"Unknown estimator {name}, expected one of {ESTIMATORS}")
+
+
+def get_model_path(name: str, version: int) -> str:
+    return f'{Constants.MODEL_DIR}/{name}/v{version}.pkl'
+
+
+class Model:
+    """
+        The fitted StandardScaler and estimator of the classifier together with the ordered training_data_features
+        they were fit on. Features are selected by name, so any frame holding them (e.g a dataset of featureGenScript)
+        can be scored in one vectorized call.
+
+        An artifact is a pickled dict of the format, version, features, scaler, estimator and training metadata.
+        Load it once and keep the Model around, `predict` doesn't touch the disk.
+    """
+
+    def __init__(self, scaler, estimator, training_data_features: List[str], metadata: Dict = None,
+                 version: int = None):
+        self.scaler = scaler
+        self.estimator = estimator
+        self.training_data_features = list(training_data_features)
+        self.metadata = metadata if metadata is not None else {}
+        self.version = version
+
+    @classmethod
+    def train(cls, dataset: Df, estimator: str = 'xgboost', test_size: float = 0.2, random_state: int = 0) -> 'Model':
+        """
+        Fits the scaler and the estimator on the labelled comments of dataset, see `gen_model_for`. test_size of them
+        are held out to evaluate the model, the confusion matrix is kept in the metadata.
+        """
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import confusion_matrix
+        labelled = gen_model_for(dataset)
+        X = cls.to_matrix(labelled, TRAINING_DATA_FEATURES)
+        y = labelled.misinformation.values
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+        scaler = StandardScaler()
+        classifier = get_estimator(estimator)
+        classifier.fit(scaler.fit_transform(X_train), y_train)
+        predicted = classifier.predict(scaler.transform(X_test))
+        metadata = {
+            "estimator": estimator,
+            "trained_utc": time.time(),
+            "training_rows": len(X_train),
+            "test_rows": len(X_test),
+            "test_accuracy": float(np.mean(predicted == y_test)),
+            "test_confusion_matrix": confusion_matrix(y_test, predicted, labels=[0, 1]).tolist()
+        }
+        print(f"Trained {estimator} on {len(X_train)} comments, test accuracy {metadata['test_accuracy']:.3f}")
+        return cls(scaler, classifier, TRAINING_DATA_FEATURES, metadata=metadata)
+
+    @classmethod
+    def train_from_file(cls, dataset_name: str, estimator: str = 'xgboost', **kwargs) -> 'Model':
+        """
+        :param dataset_name: Name the dataset was saved under, e.g `combined` or a post_id
+        """
+        dataset = Common.load_dataset_for_post(
+            dataset_name, columns=['comment_id', 'post_id', 'score'] + TRAINING_DATA_FEATURES
+        )
+        model = cls.train(dataset, estimator=estimator, **kwargs)
+        model.metadata['dataset'] = dataset_name
+        return model
+
+    @classmethod
+    def to_matrix(cls, frame: Df, features: List[str]) -> np.ndarray:
+        missing_features = [feature for feature in features if feature not in frame.columns]
+        if len(missing_features) > 0:
+            raise KeyError(f"Frame is missing the features {missing_features}")
+        return frame[features].to_numpy(dtype=np.float64)
+
+    def predict(self, frame: Df) -> np.ndarray:
+        """
+        :return: The probability that each comment of frame is misinformation
+        """
+        return self.predict_matrix(self.to_matrix(frame, self.training_data_features))
+
+    def predict_matrix(self, X: np.ndarray) -> np.ndarray:
+        """
+        predict for rows whose columns are already ordered like training_data_features
+        """
+        if len(X) == 0:
+            return np.empty(0, dtype=np.float64)
+        return self.estimator.predict_proba(self.scaler.transform(X))[:, 1]
+
+    def save(self, name: str = 'misinformation') -> str:
+        """
+        Writes the model as the next version of name
+        :return: Path of the artifact
+        """
+        versions = self.get_versions(name)
+        self.version = versions[-1] + 1 if len(versions) > 0 else 1
+        path = get_model_path(name, self.version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as artifact_file:
+            pickle.dump({
+                "format": ARTIFACT_FORMAT,
+                "version": self.version,
+                "training_data_features": self.training_data_features,
+                "scaler": self.scaler,
+                "estimator": self.estimator,
+                "metadata": self.metadata
+            }, artifact_file)
+        print(f"Saved {name} v{self.version} to {path}")
+        return path
+
+    @classmethod
+    def load(cls, fname: str) -> 'Model':
+        with open(fname, 'rb') as artifact_file:
+            artifact = pickle.load(artifact_file)
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"{fname} has format {artifact.get('format')}, expected {ARTIFACT_FORMAT}")
+        return cls(artifact["scaler"], artifact["estimator"], artifact["training_data_features"],
+                   metadata=artifact["metadata"], version=artifact["version"])
+
+    @classmethod
+    def load_latest(cls, name: str = 'misinformation') -> 'Model':
+        versions = cls.get_versions(name)
+        if len(versions) == 0:
+            raise FileNotFoundError(f"No model saved under {Constants.MODEL_DIR}/{name}")
+        return cls.load(get_model_path(name, versions[-1]))
+
+    @classmethod
+    def get_versions(cls, name: str) -> List[int]:
+        directory = f'{Constants.MODEL_DIR}/{name}'
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(re.compile(r'v(\d+)\.pkl$').match, os.listdir(directory))
+                      if match is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains the misinformation classifier and saves it as an artifact")
+    parser.add_argument('dataset', help="Name the dataset was saved under, e.g combined")
+    parser.add_argument('--estimator', default='xgboost', choices=ESTIMATORS)
+    parser.add_argument('--name', default='misinformation', help="The artifact is saved under data/model/{name}")
+    args = parser.parse_args()
+    Model.train_from_file(args.dataset, estimator=args.estimator).save(args.name)
+
+
+if __name__ == '__main__':
+    main()
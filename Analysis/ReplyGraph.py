@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from typing import Iterable, Mapping, Tuple
+from pandas import DataFrame as Df
+from Analysis import Common
+
+
+class UserReplyGraph:
+    """
+        Who replies to whom in a comment_frame, as a sparse authors x authors CSR matrix. Entry (i, j) is the number of
+        replies by author i to comments of author j. Self replies and comments without author are left out.
+
+        The edges come from one vectorized pass over the reply tree: the parent of every comment is resolved to a
+        position, and the author codes of the comments and of their parents are the rows and columns of the matrix.
+        The frame may hold the comments of several posts (e.g a combined comment_frame), in either form.
+        `from_reply_counts` builds the same graph from reply counts that are kept up to date elsewhere, e.g by the
+        stream.
+
+            in_degree       Number of authors who replied to the author
+            out_degree      Number of authors the author replied to
+            reciprocity     Share of the authors the author replied to who replied back, 0 without out_degree
+            pagerank        PageRank over the replies weighted by their count, scaled so that the average author is 1
+    """
+    DAMPING = 0.85
+    MAX_ITERATIONS = 100
+    TOLERANCE = 1e-10
+
+    def __init__(self, comment_frame: Df, thread_index: Common.ThreadIndex = None):
+        """
+        :param thread_index: ThreadIndex of comment_frame, its parent positions are used if it's passed
+        """
+        if thread_index is not None:
+            parent_positions = thread_index.parent_positions
+        else:
+            parent_positions = self.get_parent_positions(comment_frame)
+        author_codes, authors = Common.factorize(comment_frame.author)
+        replies = np.flatnonzero(parent_positions >= 0)
+        repliers = author_codes[replies]
+        replied_to = author_codes[parent_positions[replies]]
+        is_edge = (repliers >= 0) & (replied_to >= 0) & (repliers != replied_to)
+        self.set_replies(authors, repliers[is_edge], replied_to[is_edge], np.ones(is_edge.sum(), dtype=np.int64))
+
+    @classmethod
+    def from_reply_counts(cls, reply_counts: Mapping[Tuple[str, str], int], authors: Iterable[str]) -> 'UserReplyGraph':
+        """
+        :param reply_counts: (replier, replied to) -> number of replies, without self replies
+        :param authors: Every author of the comments, including the ones in no reply
+        """
+        reply_graph = cls.__new__(cls)
+        authors = pd.Index(list(authors))
+        pairs = list(reply_counts.keys())
+        repliers = authors.get_indexer([replier for replier, _ in pairs])
+        replied_to = authors.get_indexer([replied for _, replied in pairs])
+        counts = np.array(list(reply_counts.values()), dtype=np.int64)
+        reply_graph.set_replies(authors, repliers, replied_to, counts)
+        return reply_graph
+
+    def set_replies(self, authors: pd.Index, repliers: np.ndarray, replied_to: np.ndarray, counts: np.ndarray):
+        """
+        :param repliers: Author codes (positions in authors) of the replies, one entry per reply or per pair
+        """
+        self.authors = authors
+        author_count = len(authors)
+        # Duplicate (replier, replied to) pairs are summed into the reply count
+        self.reply_matrix = sp.coo_matrix(
+            (counts, (repliers, replied_to)), shape=(author_count, author_count)
+        ).tocsr()
+        self.adjacency = self.reply_matrix.copy()
+        self.adjacency.data = np.ones(len(self.adjacency.data), dtype=np.int64)
+
+    @classmethod
+    def get_parent_positions(cls, comment_frame: Df) -> np.ndarray:
+        """
+        Position of the parent comment of every row, -1 for the top level comments and the ones whose parent isn't in
+        the frame. Frames in the string form take one hashed lookup of all the parent ids, no ThreadIndex is built.
+        """
+        if 'comment_key' in comment_frame.columns:
+            return Common.get_thread_index(comment_frame).parent_positions
+        comment_ids = pd.Index(comment_frame.comment_id.values)
+        is_last = ~comment_ids.duplicated(keep='last')     # Like ThreadIndex, the last row of a duplicate id wins
+        parent_ids = pd.Series(comment_frame.parent_id.values, dtype=object)
+        is_comment = parent_ids.str.startswith(Common.Constants.COMMENT_PREFIX).fillna(False).values.astype(bool)
+        parent_comment_ids = parent_ids.str[len(Common.Constants.COMMENT_PREFIX):].values
+        positions = np.append(np.flatnonzero(is_last), -1)[comment_ids[is_last].get_indexer(parent_comment_ids)]
+        return np.where(is_comment, positions, -1)
+
+    def __len__(self):
+        return len(self.authors)
+
+    def get_out_degrees(self) -> np.ndarray:
+        return np.diff(self.adjacency.indptr)
+
+    def get_in_degrees(self) -> np.ndarray:
+        return np.diff(self.adjacency.tocsc().indptr)
+
+    def get_reciprocities(self) -> np.ndarray:
+        mutual_counts = np.diff(self.adjacency.multiply(self.adjacency.T).tocsr().indptr)
+        out_degrees = self.get_out_degrees()
+        return np.where(out_degrees > 0, mutual_counts / np.maximum(out_degrees, 1), 0.0)
+
+    def get_pageranks(self, damping: float = DAMPING, max_iterations: int = MAX_ITERATIONS,
+                      tolerance: float = TOLERANCE) -> np.ndarray:
+        """
+        Power iteration, every step is one sparse matrix vector product. The rank of the authors who replied to nobody
+        is spread evenly over all the authors.
+        :param tolerance: Stops once the ranks (summing up to 1) change by less in L1 norm
+        :return: PageRank of every author times the number of authors
+        """
+        author_count = len(self.authors)
+        if author_count == 0:
+            return np.empty(0, dtype=np.float64)
+        out_weights = np.asarray(self.reply_matrix.sum(axis=1)).ravel().astype(np.float64)
+        is_dangling = out_weights == 0
+        transitions = sp.diags(np.where(is_dangling, 0.0, 1.0 / np.maximum(out_weights, 1))) @ self.reply_matrix
+        transitions = transitions.T.tocsr()     # Column j holds the share of the replies of author j to every author
+        ranks = np.full(author_count, 1.0 / author_count)
+        for _ in range(max_iterations):
+            next_ranks = damping * (transitions @ ranks) + \
+                (damping * ranks[is_dangling].sum() + 1 - damping) / author_count
+            converged = np.abs(next_ranks - ranks).sum() < tolerance
+            ranks = next_ranks
+            if converged:
+                break
+        return ranks * author_count
+
+    def get_user_metrics_frame(self) -> Df:
+        """
+        :return: Frame indexed by the authors with the network_user_reply_* features as columns
+        """
+        return Df({
+            "network_user_reply_in_degree": self.get_in_degrees().astype(np.int64),
+            "network_user_reply_out_degree": self.get_out_degrees().astype(np.int64),
+            "network_user_reply_reciprocity": self.get_reciprocities(),
+            "network_user_reply_pagerank": self.get_pageranks()
+        }, index=self.authors)
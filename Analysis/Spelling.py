@@ -0,0 +1,168 @@
+import re
+from collections import OrderedDict, deque
+from typing import Dict, List, Iterable
+
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+] |[!*\(\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+TOKEN_PATTERN = re.compile(r'[^\W\d_]+')   # Runs of letters
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used key once it holds maxsize keys
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a list of patterns, `contains_any` tells whether any pattern is a substring of a text
+    in a single pass over the text, however many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.terminal = [False]
+        for pattern in patterns:
+            self.add(pattern)
+        self.build_fail_links()
+
+    def add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.terminal.append(False)
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.terminal[node] = True
+
+    def build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while len(queue) > 0:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.terminal[child] = self.terminal[child] or self.terminal[self.fail[child]]
+                queue.append(child)
+
+    def contains_any(self, text: str) -> bool:
+        if self.terminal[0]:    # The empty pattern is in every text
+            return True
+        node = 0
+        for char in text:
+            while node != 0 and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.terminal[node]:
+                return True
+        return False
+
+
+class SpellingEngine:
+    """
+        Counts spelling mistakes in comment bodies.
+
+        1. Bodies are lowercased, words containing URLs are dropped and the rest is tokenized into runs of letters with
+           one compiled regex.
+        2. The unique tokens of a whole batch of bodies that haven't been seen before are looked up with a single
+           `SpellChecker.unknown` call.
+        3. A token is a mistake if it's unknown and doesn't contain a word of the exclusion list (e.g "mueller" also
+           excludes "muellers"). The exclusion list is compiled into an Aho-Corasick automaton.
+        4. Verdicts are memoized in a bounded LRU. Use `get_shared` to share one engine, and its memo, across all the
+           comments and posts processed by a process.
+        5. The dictionary of the spell checker is loaded on the first lookup and shared by all the engines of a process.
+    """
+    _shared_engines = {}
+    _spell_checker = None
+
+    def __init__(self, exclusion_wordlist_fname: str, memo_size: int = 100000):
+        self.excluded_words = self.load_excluded_words(exclusion_wordlist_fname)
+        self.exclusion_matcher = AhoCorasick(self.excluded_words)
+        self.verdicts = LRUCache(memo_size)
+
+    @classmethod
+    def get_shared(cls, exclusion_wordlist_fname: str) -> 'SpellingEngine':
+        if exclusion_wordlist_fname not in cls._shared_engines:
+            cls._shared_engines[exclusion_wordlist_fname] = cls(exclusion_wordlist_fname)
+        return cls._shared_engines[exclusion_wordlist_fname]
+
+    @property
+    def spell_check(self):
+        if SpellingEngine._spell_checker is None:
+            from spellchecker import SpellChecker   # Loading its dictionary takes about a second
+            SpellingEngine._spell_checker = SpellChecker()
+        return SpellingEngine._spell_checker
+
+    @classmethod
+    def load_excluded_words(cls, exclusion_wordlist_fname: str) -> List[str]:
+        with open(exclusion_wordlist_fname, 'rt') as fd:
+            return fd.read().split('\n')
+
+    @classmethod
+    def tokenize(cls, comment_body: str) -> List[str]:
+        return [
+            token
+            for word in comment_body.lower().split(' ') if URL_PATTERN.search(word) is None
+            for token in TOKEN_PATTERN.findall(word)
+        ]
+
+    def get_spelling_features(self, comment_bodies: List[str]) -> List[Dict]:
+        """
+        For every comment body, returns the number of spelling mistakes and the list of misspelled words.
+        """
+        tokenized_bodies = [self.tokenize(comment_body) for comment_body in comment_bodies]
+        self.learn_tokens({token for tokens in tokenized_bodies for token in tokens})
+        features = []
+        for tokens in tokenized_bodies:
+            mistaken_words = [token for token in tokens if not self.is_spelled_correctly(token)]
+            features.append({
+                "comment_spelling_error_count": len(mistaken_words),
+                "meta_comment_spelling_errors": mistaken_words
+            })
+        return features
+
+    def learn_tokens(self, tokens: Iterable[str]):
+        """
+        Looks up the verdicts of all tokens that aren't memoized yet in one call to the spell checker
+        """
+        new_tokens = [token for token in tokens if token not in self.verdicts]
+        if len(new_tokens) == 0:
+            return
+        unknown_tokens = self.spell_check.unknown(new_tokens)
+        for token in new_tokens:
+            self.verdicts.put(token, token not in unknown_tokens or self.is_excluded(token))
+
+    def is_spelled_correctly(self, token: str) -> bool:
+        verdict = self.verdicts.get(token)
+        if verdict is None:     # Evicted since learn_tokens
+            verdict = len(self.spell_check.unknown([token])) == 0 or self.is_excluded(token)
+        return verdict
+
+    def is_excluded(self, word: str) -> bool:
+        return self.exclusion_matcher.contains_any(word)
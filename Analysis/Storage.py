@@ -0,0 +1,268 @@
+"""
+    Parquet backed storage for the comment, user and dataset frames.
+
+    Compared to the pickles, a frame written here can be read
+        1. partially, only the requested columns are decoded (column projection)
+        2. selectively, row groups whose statistics can't match the filters are never read (predicate pushdown)
+        3. memory mapped, pages are mapped from the file instead of being copied into memory
+
+    Dict valued columns (the subreddit_* aggregations of the user frame) are stored sparsely in a sidecar file
+    `{fname}.dicts.parquet` with one (row, column, key, value) entry per non zero key, and are only rebuilt when they
+    are requested. The entries are sorted by row, so only the sidecar row groups of the rows that were read are read.
+
+    The API used is the one of pyarrow 0.13, the version in requirements.txt.
+
+    Filters are a list of (column, op, value) tuples that must all hold, op is one of ==, !=, <, <=, >, >=, in.
+    Example:
+        read_frame('data/dataset/combined_dataset.parquet', columns=['comment_id', 'score'],
+                   filters=[('post_id', '==', 'b4agza'), ('score', '<', -10)])
+"""
+import os
+import json
+import operator
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import List, Tuple, Any
+from pandas import DataFrame as Df
+
+ROW_GROUP_SIZE = 10000
+ROW_COLUMN = '__row'
+COLUMNS_METADATA_KEY = b'creddit.columns'    # Column order of the frame, dict columns included
+DICT_COLUMNS_METADATA_KEY = b'creddit.dict_columns'  # Dict columns, including those without any entry in the sidecar
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def get_dict_columns(frame: Df) -> List[str]:
+    """
+    Returns the object columns whose values are dicts
+    """
+    dict_columns = []
+    for column in frame.columns:
+        if frame[column].dtype != object:
+            continue
+        values = frame[column].dropna()
+        if len(values) > 0 and isinstance(values.iloc[0], dict):
+            dict_columns.append(column)
+    return dict_columns
+
+
+def get_sidecar_path(path: str) -> str:
+    return f'{path}.dicts.parquet'
+
+
+def write_frame(frame: Df, path: str, sort_by: str = None, row_group_size: int = ROW_GROUP_SIZE):
+    """
+    Writes frame to path. Sorting by a column that is filtered on often (e.g post_id) makes its row groups prunable.
+    """
+    if sort_by is not None:
+        frame = frame.sort_values(by=sort_by, kind='mergesort')
+    frame = frame.reset_index(drop=True)
+    dict_columns = get_dict_columns(frame)
+    flat_frame = frame.drop(columns=dict_columns)
+    flat_frame[ROW_COLUMN] = range(len(flat_frame))
+    table = pa.Table.from_pandas(flat_frame, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        COLUMNS_METADATA_KEY: json.dumps([str(column) for column in frame.columns]).encode('utf-8'),
+        DICT_COLUMNS_METADATA_KEY: json.dumps([str(column) for column in dict_columns]).encode('utf-8')
+    })
+    pq.write_table(table, path, row_group_size=row_group_size)
+    sidecar_path = get_sidecar_path(path)
+    if len(dict_columns) == 0:
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        return
+    entries = Df([
+        (row, column, key, value)
+        for row, values in enumerate(zip(*[frame[column] for column in dict_columns]))
+        for column, column_values in zip(dict_columns, values)
+        if isinstance(column_values, dict)
+        for key, value in column_values.items()
+    ], columns=[ROW_COLUMN, 'column', 'key', 'value'])
+    entries['column'] = entries['column'].astype('category')
+    pq.write_table(pa.Table.from_pandas(entries, preserve_index=False), sidecar_path, row_group_size=row_group_size)
+
+
+def read_frame(path: str, columns: List[str] = None, filters: List[Tuple[str, str, Any]] = None,
+               memory_map: bool = True) -> Df:
+    """
+    Reads the frame written by `write_frame`.
+    :param path:
+    :param columns: Columns to return, all of them by default
+    :param filters: (column, op, value) predicates, row groups that can't satisfy them are skipped
+    :param memory_map: Map the file instead of reading it into memory
+    :return:
+    """
+    filters = filters if filters is not None else []
+    source = pa.memory_map(path, 'r') if memory_map else path
+    parquet_file = pq.ParquetFile(source)
+    # The arrow schema has one name per column, the parquet schema one per leaf (e.g the items of a list column)
+    flat_columns = [name for name in parquet_file.schema.to_arrow_schema().names if name != ROW_COLUMN]
+    sidecar_path = get_sidecar_path(path)
+    dict_columns = get_dict_columns_of_file(parquet_file, sidecar_path, memory_map)
+    requested = columns if columns is not None else get_stored_columns(parquet_file, flat_columns + dict_columns)
+    filter_columns = {column for column, _, _ in filters}
+    read_columns = [column for column in flat_columns
+                    if column in requested or column in filter_columns] + [ROW_COLUMN]
+    row_groups = [index for index in range(parquet_file.num_row_groups)
+                  if may_row_group_match(parquet_file, index, filters)]
+    tables = [parquet_file.read_row_group(index, columns=read_columns) for index in row_groups]
+    if len(tables) == 0:    # Keep the schema of the empty result
+        schema = parquet_file.schema.to_arrow_schema()
+        tables = [pa.schema([schema.field_by_name(column) for column in read_columns],
+                            metadata=schema.metadata).empty_table()]
+    frame = pa.concat_tables(tables).to_pandas()
+    frame = apply_filters(frame, filters)
+    requested_dict_columns = [column for column in requested if column in dict_columns]
+    if len(requested_dict_columns) > 0:
+        frame = attach_dict_columns(frame, sidecar_path, requested_dict_columns, memory_map)
+    frame.reset_index(drop=True, inplace=True)
+    return frame[[column for column in requested if column in frame.columns]]
+
+
+def get_stored_columns(parquet_file: pq.ParquetFile, default: List[str]) -> List[str]:
+    metadata = parquet_file.metadata.metadata or {}
+    if COLUMNS_METADATA_KEY not in metadata:
+        return default
+    return json.loads(metadata[COLUMNS_METADATA_KEY].decode('utf-8'))
+
+
+def get_dict_columns_of_file(parquet_file: pq.ParquetFile, sidecar_path: str, memory_map: bool) -> List[str]:
+    """
+    The dict columns recorded in the metadata of the file, files written before they were recorded fall back to the
+    columns that have entries in the sidecar
+    """
+    metadata = parquet_file.metadata.metadata or {}
+    if DICT_COLUMNS_METADATA_KEY in metadata:
+        return json.loads(metadata[DICT_COLUMNS_METADATA_KEY].decode('utf-8'))
+    return get_sidecar_columns(sidecar_path, memory_map)
+
+
+def get_sidecar_columns(sidecar_path: str, memory_map: bool) -> List[str]:
+    if not os.path.exists(sidecar_path):
+        return []
+    source = pa.memory_map(sidecar_path, 'r') if memory_map else sidecar_path
+    columns = pq.read_table(source, columns=['column']).column('column').to_pandas()
+    return sorted(columns.astype(str).unique())
+
+
+def attach_dict_columns(frame: Df, sidecar_path: str, dict_columns: List[str], memory_map: bool) -> Df:
+    """
+    Rebuilds the requested dict columns for the rows in frame from the sparse sidecar entries. Only the row groups of
+    the sidecar whose row range holds a row of frame are read.
+    """
+    source = pa.memory_map(sidecar_path, 'r') if memory_map else sidecar_path
+    sidecar_file = pq.ParquetFile(source)
+    rows = np.sort(frame[ROW_COLUMN].values)
+    tables = [sidecar_file.read_row_group(index) for index in range(sidecar_file.num_row_groups)
+              if may_hold_rows(sidecar_file, index, rows)]
+    if len(tables) > 0:
+        entries = pa.concat_tables(tables).to_pandas()
+    else:
+        entries = Df({ROW_COLUMN: np.empty(0, dtype=np.int64), 'column': [], 'key': [], 'value': []})
+    entries['column'] = entries['column'].astype(str)
+    entries = entries[entries['column'].isin(dict_columns) & entries[ROW_COLUMN].isin(rows)]
+    for column in dict_columns:
+        column_entries = entries[entries['column'] == column].sort_values(by=ROW_COLUMN, kind='mergesort')
+        entry_rows, starts = np.unique(column_entries[ROW_COLUMN].values, return_index=True)
+        boundaries = np.append(starts, len(column_entries))
+        keys, values = column_entries.key.tolist(), column_entries.value.tolist()
+        dicts = [dict(zip(keys[start:end], values[start:end])) for start, end in zip(boundaries[:-1], boundaries[1:])]
+        # Rows without entries have an empty dict of their own
+        positions = pd.Index(entry_rows).get_indexer(frame[ROW_COLUMN].values)
+        frame[column] = [dicts[position] if position >= 0 else {} for position in positions]
+    return frame
+
+
+def may_hold_rows(sidecar_file: pq.ParquetFile, row_group_index: int, rows: np.ndarray) -> bool:
+    """
+    Returns False only if the min/max statistics of the row column of the sidecar row group prove that none of the
+    sorted rows are in it
+    """
+    row_group = sidecar_file.metadata.row_group(row_group_index)
+    for column_index in range(row_group.num_columns):
+        column_chunk = row_group.column(column_index)
+        if column_chunk.path_in_schema != ROW_COLUMN:
+            continue
+        statistics = column_chunk.statistics
+        if statistics is None or not statistics.has_min_max:
+            return True
+        return bool(np.searchsorted(rows, statistics.min) < np.searchsorted(rows, statistics.max, side='right'))
+    return True
+
+
+def may_row_group_match(parquet_file: pq.ParquetFile, row_group_index: int,
+                        filters: List[Tuple[str, str, Any]]) -> bool:
+    """
+    Returns False only if the min/max statistics of the row group prove that no row satisfies the filters
+    """
+    row_group = parquet_file.metadata.row_group(row_group_index)
+    column_statistics = {}
+    for column_index in range(row_group.num_columns):
+        column_chunk = row_group.column(column_index)
+        column_statistics[column_chunk.path_in_schema] = column_chunk.statistics
+    for column, op, value in filters:
+        statistics = column_statistics.get(column)
+        if statistics is None or not statistics.has_min_max:
+            continue
+        try:
+            if not may_range_match(decode_statistic(statistics.min), decode_statistic(statistics.max), op, value):
+                return False
+        except TypeError:   # Statistics and value aren't comparable, e.g timestamps
+            continue
+    return True
+
+
+def may_range_match(minimum, maximum, op: str, value) -> bool:
+    if op == '==':
+        return minimum <= value <= maximum
+    if op == '!=':
+        return not (minimum == maximum == value)
+    if op == '<':
+        return minimum < value
+    if op == '<=':
+        return minimum <= value
+    if op == '>':
+        return maximum > value
+    if op == '>=':
+        return maximum >= value
+    if op == 'in':
+        return any(minimum <= item <= maximum for item in value)
+    raise ValueError(f"Unsupported filter operator {op}")
+
+
+def decode_statistic(statistic):
+    return statistic.decode('utf-8') if isinstance(statistic, bytes) else statistic
+
+
+def apply_filters(frame: Df, filters: List[Tuple[str, str, Any]]) -> Df:
+    """
+    Applies the filters exactly, row by row
+    """
+    for column, op, value in filters:
+        if op == 'in':
+            frame = frame[frame[column].isin(list(value))]
+        elif op in OPERATORS:
+            frame = frame[OPERATORS[op](frame[column], value)]
+        else:
+            raise ValueError(f"Unsupported filter operator {op}")
+    return frame
+
+
+def select(frame: Df, columns: List[str] = None, filters: List[Tuple[str, str, Any]] = None) -> Df:
+    """
+    The same projection and filtering as `read_frame`, for frames that are already in memory
+    """
+    frame = apply_filters(frame, filters if filters is not None else [])
+    if columns is not None:
+        frame = frame[columns]
+    return frame.reset_index(drop=True)
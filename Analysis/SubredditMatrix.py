@@ -0,0 +1,99 @@
+import numpy as np
+import scipy.sparse as sp
+from typing import Dict, List
+from pandas import DataFrame as Df
+
+MEASURES = ['subreddit_post_count', 'subreddit_post_karma', 'subreddit_comment_count', 'subreddit_comment_karma']
+
+
+class SubredditVocabulary:
+    """
+    Maps subreddit names to column indices. Names are normalized to lowercase, the first spelling seen is kept for
+    display.
+    """
+
+    def __init__(self):
+        self.indices = {}
+        self.display_names = []
+
+    def __len__(self):
+        return len(self.display_names)
+
+    def add(self, subreddit: str) -> int:
+        key = subreddit.lower()
+        index = self.indices.get(key)
+        if index is None:
+            index = len(self.display_names)
+            self.indices[key] = index
+            self.display_names.append(subreddit)
+        return index
+
+    def get(self, subreddit: str) -> int:
+        """
+        Returns the column of subreddit, -1 if no user has activity in it
+        """
+        return self.indices.get(subreddit.lower(), -1)
+
+
+class UserSubredditMatrix:
+    """
+        The subreddit_* dict columns of a user_frame as sparse users x subreddits CSR matrices, one per measure.
+
+        Row i is user_frame.iloc[i], columns come from a shared lowercase SubredditVocabulary. Aggregating over groups
+        of subreddits is a sparse matmul with a subreddits x groups indicator matrix, see `get_category_matrix`.
+
+        Case variants of a subreddit in the dict of a user (e.g 'politics' and 'Politics') share a column, their values
+        are summed. Matching a category on the exact spelling would only count one of them.
+    """
+
+    def __init__(self, user_frame: Df, measures: List[str] = MEASURES):
+        self.authors = user_frame.author.values
+        self.vocabulary = SubredditVocabulary()
+        self.matrices = {measure: self.build_matrix(user_frame[measure]) for measure in measures}
+        for measure in measures:    # The vocabulary may have grown after the first matrices were built
+            self.matrices[measure].resize((len(self.authors), len(self.vocabulary)))
+
+    def build_matrix(self, subreddit_dicts) -> sp.csr_matrix:
+        rows, columns, values = [], [], []
+        for row, subreddit_dict in enumerate(subreddit_dicts):
+            if not isinstance(subreddit_dict, dict):
+                continue
+            for subreddit, value in subreddit_dict.items():
+                rows.append(row)
+                columns.append(self.vocabulary.add(subreddit))
+                values.append(value)
+        # Duplicate (row, column) pairs, i.e the same subreddit spelled differently, are summed
+        return sp.coo_matrix(
+            (np.array(values, dtype=np.int64), (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+            shape=(len(subreddit_dicts), len(self.vocabulary))
+        ).tocsr()
+
+    def get_category_matrix(self, categories: Dict[str, List[str]]) -> sp.csr_matrix:
+        """
+        Compiles categories (name -> subreddits) into a subreddits x categories indicator matrix, columns follow the
+        order of categories. A subreddit listed twice in a category counts twice. Subreddits nobody is active in are
+        left out.
+        """
+        rows, columns = [], []
+        for column, subreddits in enumerate(categories.values()):
+            for subreddit in subreddits:
+                row = self.vocabulary.get(subreddit)
+                if row >= 0:
+                    rows.append(row)
+                    columns.append(column)
+        return sp.coo_matrix(
+            (np.ones(len(rows), dtype=np.int64), (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+            shape=(len(self.vocabulary), len(categories))
+        ).tocsr()
+
+    def aggregate(self, measure: str, category_matrix: sp.csr_matrix) -> np.ndarray:
+        """
+        Returns the users x categories totals of measure, case variants of a subreddit are summed
+        """
+        return (self.matrices[measure] @ category_matrix).toarray()
+
+    def get_subreddits(self, measure: str) -> List[str]:
+        """
+        Returns the subreddits any user has a non empty entry for in measure, O(nnz)
+        """
+        return [self.vocabulary.display_names[column] for column in np.unique(self.matrices[measure].indices)]
@@ -5,62 +5,293 @@
 
     It then generates all the features for the dataset and outputs it to a pickle. The size of this dataset is less
     than equal to the number of top level comments.
+
+    The stages are importable, `generate_dataset` runs all of them for frames that are already in memory
+        from Analysis.featureGenScript import generate_dataset
+        dataset = generate_dataset(comment_frame, user_frame, post_creation_time)
+
+    As a script it generates the dataset of every post passed, each in its own worker process, writes them as
+    partitions to data/dataset/{post_id}_dataset.parquet and combines them into data/dataset/combined_dataset.parquet
+        python -m Analysis.featureGenScript b4agza bempai avdne2 --workers 3
+
+    --report writes the timers and counters of the run (merged over the worker processes) as JSON, --profile adds the
+    hottest functions of the parent process, see `Ingest.instrumentation`
+        python -m Analysis.featureGenScript b4agza --report data/report.json --profile
 """
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from Analysis.FeatureBuilder import *
 from Analysis import Common
-from tqdm import tqdm
-tqdm.pandas()
+from Analysis.CompactFrame import expand_comment_frame
+from Ingest.cache import enable_cache
+from Ingest.instrumentation import get_instrumentation, reset_instrumentation, enable_instrumentation
+from Ingest.ratelimit import enable_scheduler, get_scheduler, set_scheduler
+from typing import Dict, List, Set, Tuple
 
-post_id = 'b4agza'
-reddit = get_reddit_instance()
-post_creation_time = pd.to_datetime(reddit.submission(post_id).created_utc, unit='s')
-user_frame = pd.read_pickle(f'{post_id}_user_frame.pkl')
-comment_frame = pd.read_pickle(f'{post_id}_comment_frame.pkl')
-top_level_frame = Common.get_replies_to(comment_frame, post_id)
-user_frame.reset_index(drop=True, inplace=True)
-top_level_frame.reset_index(drop=True, inplace=True)
 
-
-def check_merged_succesfully(pre_merge, post_merge):
+def check_merged_succesfully(pre_merge: Df, post_merge: Df):
     """
     Sanity checks to ensure the merge hasn't lead to duplicate columns or new rows
 
     """
-    if len(pre_merge) != len(post_merge):
-        print(f"Error while merging frames")
-        exit(-1)
-    if len(set(post_merge.columns)) != len(post_merge.columns):  # Sanity check for duplicate columns
-        print(f"Error while merging, one of the columns is duplicate")
-        exit(-1)
+    assert len(pre_merge) == len(post_merge), \
+        f"Error while merging frames, {len(pre_merge)} rows before and {len(post_merge)} after"
+    assert len(set(post_merge.columns)) == len(post_merge.columns), \
+        f"Error while merging, one of the columns is duplicate"   # Sanity check for duplicate columns
+
+
+def build_user_feature_frame(user_frame: Df, post_creation_time: datetime) -> Df:
+    """
+    user_feature_frame has UserExtractorFeatures (in user_frame) and UserFeatureBuilder
+    it's length is the size of the user_frame
+    """
+    # The cutoff of the histories is a property of the crawl, not a feature
+    user_frame = user_frame.drop(columns=['history_before_utc'], errors='ignore').reset_index(drop=True)
+    with get_instrumentation().timer('dataset.user_features'):
+        user_features = UserFeatureBuilder(post_creation_time).get_features_for_frame(user_frame)
+        user_feature_frame = user_frame.merge(user_features, on='author')
+    check_merged_succesfully(user_frame, user_feature_frame)
+    return user_feature_frame
+
+
+def build_post_feature_frame(comment_frame: Df, post_creation_time: datetime, workers: int = None) -> Df:
+    """
+    post_feature_frame has CommentExtractor features (in comment_frame) and PostFeatureBuilder
+    it's length is the size of the top_level_frame. It's in the form of the comment_frame, see `Analysis.CompactFrame`
+    """
+    with get_instrumentation().timer('dataset.post_features'):
+        postFeatureBuilder = PostFeatureBuilder(comment_frame, post_timestamp=post_creation_time)
+        top_level_frame = postFeatureBuilder.thread_index.get_top_level_comments().reset_index(drop=True)
+        post_features = postFeatureBuilder.get_features_for_frame(top_level_frame, workers=workers)
+        post_feature_frame = top_level_frame.merge(post_features, on=Common.get_key_column(comment_frame))
+    check_merged_succesfully(top_level_frame, post_feature_frame)
+    return post_feature_frame
+
+
+def join_user_features(post_feature_frame: Df, user_feature_frame: Df) -> Tuple[Df, Set[str]]:
+    """
+    Left joins every top level comment of post_feature_frame with the user features of its author. Every comment is
+    mapped to the position of its author's row in user_feature_frame once (only the categories are looked up when the
+    authors are categorical, as in compact frames) and the user features are gathered by position.
+    Comments whose author isn't in user_feature_frame are dropped, their accounts might have been deleted or banned.
+    :return: user_post_feature_frame with a row per kept comment, and the authors that were missing
+    """
+    # If an author was extracted twice, the first row wins
+    user_feature_frame = user_feature_frame.drop_duplicates(subset='author').reset_index(drop=True)
+    user_positions = Common.get_codes(post_feature_frame.author, pd.Index(user_feature_frame.author))
+    has_user_features = user_positions >= 0
+    missing_users = set(post_feature_frame.author[~has_user_features].unique())
+    # Dropped before the join, so that no column is upcast to hold NaNs
+    post_feature_frame = post_feature_frame[has_user_features].reset_index(drop=True)
+    user_features = user_feature_frame.drop(columns=['author']).iloc[user_positions[has_user_features]]
+    user_post_feature_frame = pd.concat([post_feature_frame, user_features.reset_index(drop=True)], axis=1)
+    check_merged_succesfully(post_feature_frame, user_post_feature_frame)
+    key_column = Common.get_key_column(user_post_feature_frame)
+    assert user_post_feature_frame[key_column].is_unique, f"Error while merging, {key_column}s are duplicate"
+    return user_post_feature_frame, missing_users
+
+
+def generate_dataset(comment_frame: Df, user_frame: Df, post_creation_time: datetime, workers: int = None) -> Df:
+    """
+    Runs all the stages for one post
+    :param workers: Processes used for the text features, defaults to the number of cores
+    :return: user_post_feature_frame, a row per top level comment with all the features in user_feature_frame and
+    post_feature_frame
+    """
+    post_feature_frame = build_post_feature_frame(comment_frame, post_creation_time, workers=workers)
+    return assemble_dataset(post_feature_frame, user_frame, post_creation_time)
+
+
+def assemble_dataset(post_feature_frame: Df, user_frame: Df, post_creation_time: datetime) -> Df:
+    """
+    Joins the post_feature_frame with the user features of the user_frame
+    """
+    user_feature_frame = build_user_feature_frame(user_frame, post_creation_time)
+    with get_instrumentation().timer('dataset.join'):
+        user_post_feature_frame, missing_users = join_user_features(post_feature_frame, user_feature_frame)
+    get_instrumentation().count('dataset.missing_users', len(missing_users))
+    print(f"Couldn't find {len(missing_users)} users in user_frame. Their accounts might have been deleted or banned.")
+    return user_post_feature_frame
+
+
+def get_post_creation_time(post_id: str) -> datetime:
+    from Ingest.Reddit import get_reddit_instance
+    return pd.to_datetime(get_reddit_instance().submission(post_id).created_utc, unit='s')
+
+
+def get_shared_user_frame(post_authors: Dict[str, Set[str]], name: str, extract_missing_users: bool = False,
+                          user_workers: int = 1, history_before: datetime = None) -> Df:
+    """
+    Builds one user_frame for all the posts in which every author appears once, so that the history of a user who
+    commented in several posts is only fetched once. The rows of the user_frames of the posts and of a previous run
+    (saved under name) whose histories stop at history_before are reused, the authors that are in none of them are
+    crawled by a single UserExtractor if extract_missing_users is set, and are skipped otherwise.
+    Rows crawled up to another cutoff, or before the cutoff was recorded, are crawled again if extract_missing_users is
+    set. Otherwise they are reused with a warning, as they are the only histories there are for their authors.
+    :param post_authors: post_id -> authors of its comments
+    :param history_before: The histories of the users stop there, e.g at the creation of the earliest post. None for
+    the whole histories
+    """
+    history_before_utc = history_before.timestamp() if history_before is not None else None
+    user_frames = [Common.load_user_frame(frame_id, history_before_utc=history_before_utc)
+                   for frame_id in [name] + list(post_authors.keys()) if Common.has_frame('user_frame', frame_id)]
+    if len(user_frames) == 0:
+        user_frames = [Df(columns=['author', 'history_before_utc'])]
+    user_frame = pd.concat(user_frames, ignore_index=True, sort=False)
+    # The rows with the cutoff come first so they win over the stale rows of the same authors
+    has_cutoff = Common.has_history_cutoff(user_frame, history_before_utc)
+    user_frame = pd.concat([user_frame[has_cutoff], user_frame[~has_cutoff]], ignore_index=True, sort=False) \
+        .drop_duplicates(subset='author').reset_index(drop=True)
+    is_stale = ~Common.has_history_cutoff(user_frame, history_before_utc)
+    if is_stale.any():
+        if extract_missing_users:
+            print(f"Crawling the {int(is_stale.sum())} users again whose histories weren't crawled up to "
+                  f"{history_before}")
+            user_frame = user_frame[~is_stale].reset_index(drop=True)
+        else:
+            print(f"Warning: Reusing {int(is_stale.sum())} user rows whose histories weren't crawled up to "
+                  f"{history_before}, set --extract-missing-users to crawl them again")
+    authors = set().union(*post_authors.values())
+    missing_authors = sorted(authors.difference(user_frame.author))
+    print(f"{len(authors)} authors over {len(post_authors)} posts, {len(missing_authors)} are in none of the user_frames")
+    if extract_missing_users and len(missing_authors) > 0:
+        from Ingest.extractors import UserExtractor     # praw is only needed when users are crawled
+        extracted_frame = UserExtractor(workers=user_workers, history_before_utc=history_before_utc) \
+            .get_frame_for_authors(missing_authors)
+        user_frame = pd.concat([user_frame, extracted_frame], ignore_index=True, sort=False)
+        Common.save_frame(user_frame, 'user_frame', name)
+    elif len(authors) > 0 and len(missing_authors) == len(authors):
+        raise ValueError(f"None of the {len(authors)} authors of {name} has a user_frame row, set "
+                         f"--extract-missing-users to crawl their histories")
+    return user_frame
+
 
+def generate_partition(post_id: str, user_frame: Df, post_creation_time: datetime, workers: int = None) -> str:
+    """
+    Generates the dataset of a single post and writes it as a partition, runs in a worker process. The
+    post_feature_frame is kept as well, `refresh_partition` updates it when new comments arrive.
+    The comment_frame is compacted while it's loaded, the frames are expanded again before they are written so the
+    stored schema doesn't change.
+    :return: post_id
+    """
+    comment_frame = Common.load_comment_frame(post_id, compact=True)
+    post_feature_frame = build_post_feature_frame(comment_frame, post_creation_time, workers=workers)
+    dataset = assemble_dataset(post_feature_frame, user_frame, post_creation_time)
+    Common.save_frame(expand_comment_frame(post_feature_frame), 'post_feature_frame', post_id)
+    Common.save_frame(expand_comment_frame(dataset), 'dataset', post_id)
+    return post_id
 
-#  user_feature_frame  has UserExtractorFeatures (in user_frame) and UserFeatureBuilder
-# it's length is the size of the user_frame
-userFeatureBuilder = UserFeatureBuilder(post_creation_time)
-user_features = Df(list(user_frame.progress_apply(userFeatureBuilder.get_features_for_row, axis=1)))
-user_feature_frame = user_frame.merge(user_features, on='author')
-check_merged_succesfully(user_frame, user_feature_frame)
 
-# post_feature_frame has CommentExtractor features (in comment_frame) and PostFeatureBuilder
-# it's length is the size of the top_level_frame
-postFeatureBuilder = PostFeatureBuilder(comment_frame)
-post_features = Df(list(top_level_frame.progress_apply(postFeatureBuilder.get_features_for_row, axis=1)))
-post_feature_frame = top_level_frame.merge(post_features, on='comment_id')
-check_merged_succesfully(top_level_frame, post_feature_frame)
+def generate_instrumented_partition(*args, **kwargs) -> Tuple[str, Dict]:
+    """
+    `generate_partition` in a worker process
+    :return: post_id and the state of the worker's instrumentation, to merge into the parent's
+    """
+    instrumentation = reset_instrumentation()   # Forked workers inherit the parent's timers
+    return generate_partition(*args, **kwargs), instrumentation.get_state()
 
-missing_users = set(post_feature_frame.author.unique()).difference(set(user_feature_frame.author.unique()))
-print(f"Couldn't find {len(missing_users)} users in user_frame. Their accounts might have been deleted or banned.")
-post_feature_frame = post_feature_frame[~post_feature_frame.author.isin(list(missing_users))]
+
+def refresh_partition(post_id: str, delta_frame: Df, user_frame: Df, post_creation_time: datetime,
+                      workers: int = None) -> Df:
+    """
+    Incremental version of `generate_partition` for a post that keeps growing. Merges the delta_frame of new or
+    changed comments into the stored comment_frame and only recomputes the rows of the post_feature_frame the delta
+    affects, see `IncrementalPostFeatureBuilder`.
+    :param user_frame: Users of the post, it must include the authors of the delta to keep their comments
+    :return: The refreshed dataset of the post
+    """
+    comment_frame = Common.load_comment_frame(post_id)
+    post_feature_frame = Common.load_frame('post_feature_frame', post_id)
+    incrementalBuilder = IncrementalPostFeatureBuilder(comment_frame, post_creation_time)
+    comment_frame, post_feature_frame = incrementalBuilder.update(post_feature_frame, delta_frame, workers=workers)
+    dataset = assemble_dataset(post_feature_frame, user_frame, post_creation_time)
+    Common.save_frame(comment_frame, 'comment_frame', post_id)
+    Common.save_frame(post_feature_frame, 'post_feature_frame', post_id)
+    Common.save_frame(dataset, 'dataset', post_id)
+    return dataset
+
+
+def combine_partitions(post_ids: List[str], name: str) -> Df:
+    """
+    Concatenates the partitions of post_ids into the dataset saved under name, e.g `combined`
+    """
+    combined = pd.concat([Common.load_dataset_for_post(post_id) for post_id in post_ids], ignore_index=True, sort=False)
+    Common.save_frame(combined, 'dataset', name, sort_by='post_id')
+    return combined
+
+
+def generate_datasets(post_ids: List[str], name: str = 'combined', workers: int = None,
+                      extract_missing_users: bool = False, user_workers: int = 1) -> Df:
+    """
+    Generates the partition of every post, one post per worker process, and combines them.
+    :param post_ids: Posts whose comment_frames are in data/comment_frame
+    :param name: The combined dataset is written to data/dataset/{name}_dataset.parquet
+    :param workers: Number of worker processes, defaults to the number of cores
+    :param extract_missing_users: Crawl the authors that aren't in any user_frame, see `get_shared_user_frame`
+    :param user_workers: Threads used to crawl the missing authors
+    :return: The combined dataset
+    """
+    workers = workers if workers is not None else os.cpu_count() or 1
+    post_authors = {
+        post_id: set(Common.load_comment_frame(post_id, columns=['author']).author.dropna()) for post_id in post_ids
+    }
+    post_creation_times = {post_id: get_post_creation_time(post_id) for post_id in post_ids}
+    # The users are shared by the posts, their histories stop at the earliest one so that no post sees the future
+    user_frame = get_shared_user_frame(post_authors, name, extract_missing_users, user_workers,
+                                       history_before=min(post_creation_times.values()))
+    post_user_frames = {post_id: user_frame[user_frame.author.isin(authors)] for post_id, authors in post_authors.items()}
+    generated_post_ids, failed_post_ids = [], []
+    if workers <= 1 or len(post_ids) == 1:   # The text features of a single post use all the cores instead
+        for post_id in post_ids:
+            generated_post_ids.append(generate_partition(post_id, post_user_frames[post_id],
+                                                         post_creation_times[post_id], workers=workers))
+    else:
+        processes = min(workers, len(post_ids))
+        # Every worker has its own request budgets, they split the rates of this process between them
+        with ProcessPoolExecutor(max_workers=processes, initializer=set_scheduler,
+                                 initargs=(get_scheduler().get_share(processes),)) as executor:
+            partitions = {
+                executor.submit(generate_instrumented_partition, post_id, post_user_frames[post_id],
+                                post_creation_times[post_id], 1): post_id
+                for post_id in post_ids
+            }
+            for partition in as_completed(partitions):
+                try:
+                    post_id, instrumentation_state = partition.result()
+                    get_instrumentation().merge(instrumentation_state)
+                    generated_post_ids.append(post_id)
+                    print(f"Generated {partitions[partition]} ({len(generated_post_ids)}/{len(post_ids)})")
+                except Exception as e:
+                    print(f"Couldn't generate {partitions[partition]}: {repr(e)}")
+                    failed_post_ids.append(partitions[partition])
+    if len(failed_post_ids) > 0:
+        print(f"{name} is missing the posts {failed_post_ids}")
+    return combine_partitions([post_id for post_id in post_ids if post_id in generated_post_ids], name)
 
 
-def user_patch(author: str) -> Dict:
-    return user_feature_frame[user_feature_frame.author == author].iloc[0].to_dict()
+def main():
+    parser = argparse.ArgumentParser(description="Generates the dataset of every post and combines them")
+    parser.add_argument('post_ids', nargs='+', help="Posts whose comment_frames are in data/comment_frame")
+    parser.add_argument('--name', default='combined', help="Name of the combined dataset")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to the number of cores")
+    parser.add_argument('--extract-missing-users', action='store_true',
+                        help="Crawl the authors that aren't in any user_frame")
+    parser.add_argument('--user-workers', type=int, default=1, help="Threads used to crawl the missing authors")
+    parser.add_argument('--offline', action='store_true', help="Only serve reddit requests from the response cache")
+    parser.add_argument('--report', default=None, help="Write the timers and counters of the run to this JSON file")
+    parser.add_argument('--profile', action='store_true', help="Add a sampling profile to the report")
+    parser.add_argument('--reddit-requests-per-second', type=float, default=1.0,
+                        help="Initial reddit request rate, it then follows the rate limit headers")
+    parser.add_argument('--pushshift-requests-per-second', type=float, default=1.0)
+    args = parser.parse_args()
+    enable_cache(offline=args.offline)  # Reruns are served from the response cache
+    enable_scheduler(reddit_requests_per_second=args.reddit_requests_per_second,
+                     pushshift_requests_per_second=args.pushshift_requests_per_second)
+    enable_instrumentation(report_fname=args.report, profile=args.profile)
+    generate_datasets(args.post_ids, name=args.name, workers=args.workers,
+                      extract_missing_users=args.extract_missing_users, user_workers=args.user_workers)
 
-# user_post_feature_frame has all the features in user_feature_frame and post_feature_frame
-user_post_features = Df(list(post_feature_frame.author.progress_apply(user_patch)))
-user_post_feature_frame = post_feature_frame.merge(user_post_features)
-user_post_feature_frame.drop_duplicates(subset='comment_id', inplace=True)
-user_post_feature_frame.reset_index(drop=True, inplace=True)
-check_merged_succesfully(user_post_features, user_post_feature_frame)
 
-user_post_feature_frame.to_pickle(f'{post_id}_dataset.pkl')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
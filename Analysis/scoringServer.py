@@ -0,0 +1,179 @@
+"""
+    Local HTTP scoring service for a persisted `Model`, over TCP or a unix socket.
+
+        python -m Analysis.scoringServer data/model/misinformation/v1.pkl --port 8050
+        python -m Analysis.scoringServer data/model/misinformation/v1.pkl --unix-socket /tmp/creddit.sock
+
+        POST /predict   {"rows": [{"golds": 0, "comment_char_count": 134, ...}, ...]}
+                        or {"columns": ["golds", ...], "data": [[0, 134, ...], ...]}
+                    ->  {"probabilities": [0.03, ...], "model_version": 1}
+        GET /health ->  {"status": "ok", "model_version": 1, "training_data_features": [...]}
+
+    Rows must have every feature of model.training_data_features, other keys are ignored. The model is loaded once.
+    Requests only parse their rows into a matrix, a single batching task stacks the matrices of the requests that
+    arrived within max_wait_seconds of each other and scores them with one predict call. Connections are kept alive.
+"""
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from typing import Dict, List, Tuple
+from Analysis.Model import Model
+
+STATUS_LINES = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+async def get_batch(queue: asyncio.Queue, max_size: int, max_wait_seconds: float) -> List:
+    """
+    Waits for an item of queue, then collects up to max_size items for at most max_wait_seconds
+    """
+    batch = [await queue.get()]
+    deadline = time.monotonic() + max_wait_seconds
+    while len(batch) < max_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class ScoringServer:
+
+    def __init__(self, model: Model, max_batch_requests: int = 256, max_wait_seconds: float = 0.005):
+        """
+        :param max_batch_requests: Maximum number of requests scored by one predict call
+        :param max_wait_seconds: Maximum time a request waits for others to join its batch
+        """
+        self.model = model
+        self.max_batch_requests = max_batch_requests
+        self.max_wait_seconds = max_wait_seconds
+        self.feature_positions = {feature: i for i, feature in enumerate(model.training_data_features)}
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8050, unix_socket: str = None):
+        self.pending = asyncio.Queue()     # (matrix, future) of the requests waiting to be scored
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        print(f"Serving model v{self.model.version} on {unix_socket if unix_socket is not None else f'{host}:{port}'}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run_batches())
+
+    async def run_batches(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await get_batch(self.pending, self.max_batch_requests, self.max_wait_seconds)
+            matrices = [matrix for matrix, _ in batch]
+            try:
+                probabilities = await loop.run_in_executor(None, self.model.predict_matrix, np.vstack(matrices))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            offsets = np.cumsum([len(matrix) for matrix in matrices])[:-1]
+            for (_, future), request_probabilities in zip(batch, np.split(probabilities, offsets)):
+                if not future.done():   # The client may have disconnected
+                    future.set_result(request_probabilities)
+
+    async def score(self, matrix: np.ndarray) -> np.ndarray:
+        future = asyncio.get_event_loop().create_future()
+        await self.pending.put((matrix, future))
+        return await future
+
+    def to_matrix(self, payload: Dict) -> np.ndarray:
+        """
+        Rows of the payload as a matrix whose columns are ordered like model.training_data_features
+        """
+        features = self.model.training_data_features
+        if 'data' in payload:
+            columns = list(payload['columns'])
+            missing_features = [feature for feature in features if feature not in columns]
+            if len(missing_features) > 0:
+                raise KeyError(f"Missing the features {missing_features}")
+            data = np.array(payload['data'], dtype=np.float64).reshape(-1, len(columns))
+            return data[:, [columns.index(feature) for feature in features]]
+        return np.array([[row[feature] for feature in features] for row in payload['rows']], dtype=np.float64) \
+            .reshape(-1, len(features))
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if method == 'GET' and path == '/health':
+            return 200, {
+                "status": "ok",
+                "model_version": self.model.version,
+                "training_data_features": self.model.training_data_features
+            }
+        if method != 'POST' or path != '/predict':
+            return 404, {"error": f"No route for {method} {path}"}
+        try:
+            matrix = self.to_matrix(json.loads(body))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": repr(e)}
+        if len(matrix) == 0:
+            return 200, {"probabilities": [], "model_version": self.model.version}
+        try:
+            probabilities = await self.score(matrix)
+        except Exception as e:
+            return 500, {"error": repr(e)}
+        return 200, {"probabilities": probabilities.tolist(), "model_version": self.model.version}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if len(request_line) == 0:   # Closed by the client
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, response = await self.route(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self.write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @classmethod
+    def write_response(cls, writer: asyncio.StreamWriter, status: int, response: Dict, keep_alive: bool):
+        body = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_LINES[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the predictions of a persisted model")
+    parser.add_argument('model', help="Path of the artifact, e.g data/model/misinformation/v1.pkl")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--unix-socket', default=None, help="Listen on this unix socket instead of host:port")
+    parser.add_argument('--max-batch-requests', type=int, default=256, help="Requests scored by one predict call")
+    parser.add_argument('--max-wait-ms', type=float, default=5, help="Time a request waits for others to batch with")
+    args = parser.parse_args()
+    server = ScoringServer(Model.load(args.model), max_batch_requests=args.max_batch_requests,
+                           max_wait_seconds=args.max_wait_ms / 1000)
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port, unix_socket=args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+"""
+    Streams the new comments of live submissions and scores their top level comments while the thread is running.
+
+        poll  ->  enrich  ->  state  ->  features  ->  score
+                                              |
+                                         crawl users
+
+    1. poll       new comments of the subreddits of the submissions, filtered to the submissions
+    2. enrich     turns them into comment_frame rows with the `CommentExtractor` merge and upserts them into the database
+    3. state      adds them to the in memory reply tree and per author counts of their submission (`LiveThreadState`)
+    4. features   builds the PostFeatureBuilder and user features of the new top level comments. Authors whose user
+                  row is neither in memory nor in the database are handed to the crawl stage, their comments are
+                  scored with the features of `get_default_user_row` until their history arrives
+    5. score      scores them with the persisted model and appends the scores to the output file
+
+    Every stage runs as its own task and hands its output to the next one through a bounded asyncio queue, a slow stage
+    blocks the stages before it instead of letting the backlog grow in memory. Stages after enrich work on micro
+    batches of up to batch_size comments, collected for at most batch_wait_seconds. The user crawl is off the scoring
+    path, new authors that don't fit in its queue are skipped and handed to it again the next time they comment.
+
+        python -m Analysis.streamScript b4agza --model data/model/misinformation/v1.pkl --output b4agza_scores.jsonl
+
+    The model is an artifact saved by `Analysis.Model`, loaded once at startup.
+"""
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from pandas import DataFrame as Df
+from Analysis import Common
+from Analysis.FeatureBuilder import CommentTextFeatureBuilder
+from Analysis.Model import Model
+from Analysis.Spelling import LRUCache
+from Analysis.featureGenScript import build_user_feature_frame, join_user_features
+from Analysis.scoringServer import get_batch
+from Ingest.extractors import CommentExtractor, UserExtractor
+from Ingest.instrumentation import get_instrumentation
+from Ingest.ratelimit import get_scheduler
+
+
+def subtract_counts(counter: Counter, counts: Counter):
+    """
+    counter -= counts, in the time of counts rather than of counter. The keys left at 0 are removed.
+    """
+    for key, count in counts.items():
+        remaining = counter[key] - count
+        if remaining > 0:
+            counter[key] = remaining
+        else:
+            del counter[key]
+
+
+def get_default_user_row(author: str, history_before_utc: float) -> Dict:
+    """
+    User row standing in for an author whose history isn't crawled yet: an account created at the history cutoff
+    without karma or activity
+    """
+    return {
+        "author": author,
+        "user_total_comment_karma": 0,
+        "user_total_post_karma": 0,
+        "user_email_verified": False,
+        "user_account_creation_utc": pd.to_datetime(history_before_utc, unit='s'),
+        "user_total_post_count": 0,
+        "user_total_comment_count": 0,
+        "subreddit_post_count": {},
+        "subreddit_post_karma": {},
+        "subreddit_comment_count": {},
+        "subreddit_comment_karma": {},
+        "history_before_utc": history_before_utc
+    }
+
+
+class ThreadState:
+    """
+    Running network metrics of one thread (a root comment and all the comments under it)
+    """
+    __slots__ = ['comment_ids', 'size', 'max_depth', 'top_level_count', 'reply_author_counts', 'reply_counts',
+                 'author_counts', 'top_level_author']
+
+    def __init__(self):
+        self.comment_ids = []
+        self.size = 0
+        self.max_depth = 0
+        self.top_level_count = 0
+        self.reply_author_counts = Counter()
+        self.reply_counts = Counter()     # (replier, replied to) -> replies inside the thread
+        self.author_counts = Counter()    # The comments of the thread in the total_comment_counts of the post
+        self.top_level_author = None      # Author of the root if it's a top level comment of the post
+
+
+class LiveThreadState:
+    """
+        In memory reply tree and per author counts of a live submission, updated one comment at a time. The features
+        of a top level comment are the same as the ones `PostFeatureBuilder` would compute on a comment_frame holding
+        the comments seen so far.
+
+        Memory is bounded by max_comments. Once more comments are tracked, the threads that have been inactive the
+        longest are evicted, a later reply to an evicted thread starts a new thread, like a comment whose parent is
+        missing from a comment_frame. The comments of an evicted thread leave the per author counts and the reply
+        graph as well, so authors that are only in evicted threads aren't kept. Bodies aren't kept.
+    """
+
+    def __init__(self, post_id: str, max_comments: int = 500000):
+        self.post_fullname = Common.Constants.POST_PREFIX + post_id
+        self.max_comments = max_comments
+        self.comment_roots = {}         # comment_id -> (root comment_id, depth, author)
+        self.threads = OrderedDict()    # root comment_id -> ThreadState, least recently active first
+        self.top_level_comment_counts = Counter()
+        self.total_comment_counts = Counter()
+        self.reply_counts = Counter()   # (replier, replied to) -> replies, the edges of the UserReplyGraph
+        self.reply_metrics = None       # network_user_reply_* of every author, until the next comment is added
+
+    def __len__(self):
+        return len(self.comment_roots)
+
+    def add(self, row: Dict):
+        comment_id, parent_id, author = row['comment_id'], row['parent_id'], row['author']
+        if comment_id in self.comment_roots:    # Already seen, e.g replayed by the stream
+            return
+        parent = None
+        if isinstance(parent_id, str) and parent_id.startswith(Common.Constants.COMMENT_PREFIX):
+            parent = self.comment_roots.get(Common.ThreadIndex.get_id(parent_id))
+        if parent is None:
+            root, depth = comment_id, 0
+            self.threads[root] = ThreadState()
+        else:
+            root, depth = parent[0], parent[1] + 1
+        self.comment_roots[comment_id] = (root, depth, author)
+        thread = self.threads[root]
+        self.threads.move_to_end(root)
+        thread.comment_ids.append(comment_id)
+        has_author = isinstance(author, str)    # Comments without author aren't counted, like in value_counts
+        if depth > 0:
+            thread.size += 1
+            thread.max_depth = max(thread.max_depth, depth)
+            thread.top_level_count += depth == 1
+            if has_author:
+                thread.reply_author_counts[author] += 1
+            replied_to = parent[2]
+            if has_author and isinstance(replied_to, str) and replied_to != author:
+                thread.reply_counts[(author, replied_to)] += 1
+                self.reply_counts[(author, replied_to)] += 1
+        if has_author:
+            self.total_comment_counts[author] += 1
+            thread.author_counts[author] += 1
+            if parent_id == self.post_fullname:
+                self.top_level_comment_counts[author] += 1
+                thread.top_level_author = author
+        self.reply_metrics = None
+        self.evict_if_needed()
+
+    def evict_if_needed(self):
+        while len(self.comment_roots) > self.max_comments and len(self.threads) > 1:
+            _, thread = self.threads.popitem(last=False)
+            for comment_id in thread.comment_ids:
+                self.comment_roots.pop(comment_id, None)
+            # Drops the pairs left without replies and the authors left without comments
+            subtract_counts(self.reply_counts, thread.reply_counts)
+            subtract_counts(self.total_comment_counts, thread.author_counts)
+            if thread.top_level_author is not None:
+                subtract_counts(self.top_level_comment_counts, Counter([thread.top_level_author]))
+
+    def get_reply_metrics(self) -> Df:
+        """
+        The network_user_reply_* features of every author, the graph is rebuilt once per batch of comments
+        """
+        if self.reply_metrics is None:
+            from Analysis.ReplyGraph import UserReplyGraph  # scipy is only needed once the first batch is scored
+            reply_graph = UserReplyGraph.from_reply_counts(self.reply_counts, self.total_comment_counts.keys())
+            self.reply_metrics = reply_graph.get_user_metrics_frame()
+        return self.reply_metrics
+
+    def get_features(self, top_level_row: Dict) -> Dict:
+        """
+        The CommentNetworkFeatureBuilder, PostUserFeatureBuilder and ReplyGraphFeatureBuilder features of a top level
+        comment
+        """
+        thread = self.threads.get(top_level_row['comment_id'], ThreadState())
+        author = top_level_row['author']
+        has_author = isinstance(author, str)
+        reply_metrics = self.get_reply_metrics()
+        return {
+            "network_user_top_level_comment_count": self.top_level_comment_counts[author] if has_author else 0,
+            "network_user_thread_comment_count": thread.reply_author_counts[author] if has_author else 0,
+            "network_user_total_comment_count": self.total_comment_counts[author] if has_author else 0,
+            "network_comment_thread_top_level_count": thread.top_level_count,
+            "network_comment_thread_max_depth": thread.max_depth,
+            "network_comment_thread_size": thread.size,
+            **{column: reply_metrics[column].get(author, 0) if has_author else 0 for column in reply_metrics.columns}
+        }
+
+
+class LiveScorer:
+    """
+        Runs the streaming pipeline described above for a list of submissions, see `run`.
+    """
+
+    def __init__(self, post_ids: List[str], model: Model, output_fname: Optional[str] = None, queue_size: int = 100,
+                 batch_size: int = 100, batch_wait_seconds: float = 1.0, max_comments: int = 500000,
+                 max_users: int = 100000, user_workers: int = 4, poll_interval: float = 1.0):
+        """
+        :param model: e.g `Model.load(fname)`
+        :param output_fname: JSON lines file the scores are appended to, printed only if None
+        :param queue_size: Capacity of every queue between two stages
+        :param batch_size: Maximum size of a micro batch
+        :param batch_wait_seconds: Maximum time spent collecting a micro batch
+        :param max_comments: Comments tracked per submission, see `LiveThreadState`
+        :param max_users: User rows kept in memory
+        :param user_workers: Threads crawling the history of new authors, the crawl stage queues up to
+        queue_size * batch_size of them
+        :param poll_interval: Seconds between two polls when there are no new comments
+        """
+        self.post_ids = post_ids
+        self.model = model
+        self.output_fname = output_fname
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait_seconds = batch_wait_seconds
+        self.poll_interval = poll_interval
+        # Not through the response cache, the idle polls of the stream repeat the same request and would be answered
+        # from it. User histories are reused across restarts through the database instead.
+        reddit_kwargs = {"requestor_kwargs": {"budget": get_scheduler().get_budget('reddit'), "cache": None}}
+        self.commentExtractor = CommentExtractor(no_caching=True, reddit_kwargs=reddit_kwargs)
+        self.commentTextFeatureBuilder = CommentTextFeatureBuilder(
+            exclusion_wordlist_fname=Common.Constants.EXCLUSION_WLIST
+        )
+        self.submissions = {post_id: self.commentExtractor.reddit.submission(id=post_id) for post_id in post_ids}
+        self.post_creation_times = {
+            post_id: pd.to_datetime(submission.created_utc, unit='s') for post_id, submission in self.submissions.items()
+        }
+        # Like featureGenScript, the histories of the users shared by the submissions stop at the earliest one
+        self.history_before_utc = min(self.post_creation_times.values()).timestamp()
+        self.userExtractor = UserExtractor(workers=user_workers, no_caching=True, reddit_kwargs=reddit_kwargs,
+                                           history_before_utc=self.history_before_utc)
+        self.user_executor = ThreadPoolExecutor(max_workers=user_workers)
+        self.states = {post_id: LiveThreadState(post_id, max_comments=max_comments) for post_id in post_ids}
+        self.user_rows = LRUCache(max_users)    # author -> user row, None if the account is deleted or suspended
+        self.pending_authors = set()            # Authors queued or being crawled by the crawl stage
+        self.scored_count = 0
+
+    def bootstrap(self):
+        """
+        Adds the comments that were extracted before the stream started to the states
+        """
+        for post_id, state in self.states.items():
+            if not Common.has_frame('comment_frame', post_id):
+                continue
+            comment_frame = Common.load_comment_frame(post_id, columns=['comment_id', 'parent_id', 'author',
+                                                                         'comment_created_utc'])
+            for row in comment_frame.sort_values(by='comment_created_utc').to_dict('records'):
+                state.add(row)
+            print(f"Bootstrapped {post_id} with {len(state)} comments")
+
+    async def run(self):
+        """
+        Runs until cancelled
+        """
+        self.bootstrap()
+        self.comment_queue = asyncio.Queue(maxsize=self.queue_size * self.batch_size)
+        self.row_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.top_level_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.feature_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.user_queue = asyncio.Queue(maxsize=self.queue_size * self.batch_size)
+        stages = [self.poll(), self.enrich(), self.update_states(), self.build_features(), self.score(),
+                  self.crawl_users()]
+        await asyncio.gather(*stages)
+
+    async def poll(self):
+        loop = asyncio.get_event_loop()
+        subreddits = '+'.join({submission.subreddit.display_name for submission in self.submissions.values()})
+        stream = self.commentExtractor.reddit.subreddit(subreddits).stream.comments(pause_after=0, skip_existing=True)
+        link_ids = {Common.Constants.POST_PREFIX + post_id for post_id in self.post_ids}
+        while True:
+            comment = await loop.run_in_executor(None, next, stream)
+            if comment is None:     # No new comments in the last request
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if comment.link_id in link_ids:
+                await self.comment_queue.put(comment)
+
+    async def enrich(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            comments = await get_batch(self.comment_queue, self.batch_size, self.batch_wait_seconds)
+            rows = await loop.run_in_executor(None, self.get_rows, comments)
+            if len(rows) > 0:
+                await self.row_queue.put(rows)
+
+    def get_rows(self, praw_comments) -> List[Dict]:
+        """
+        comment_frame rows of praw_comments, with the same merge as the CommentExtractor
+        """
+        pshift_comments = [{
+            "id": praw_comment.id,
+            "body": praw_comment.body,
+            "author": praw_comment.author.name if praw_comment.author is not None else np.nan,
+            "link_id": praw_comment.link_id
+        } for praw_comment in praw_comments]
+        praw_attributes = {
+            praw_comment.id: CommentExtractor.get_praw_attributes(praw_comment) for praw_comment in praw_comments
+        }
+        rows = CommentExtractor.merge_praw_attributes(pshift_comments, praw_attributes)
+        for row in rows:
+            submission_author = self.submissions[row['post_id']].author
+            row['is_submitter'] = submission_author is not None and row['author'] == submission_author.name
+        if self.commentExtractor.database is not None and len(rows) > 0:
+            self.commentExtractor.database.upsert_comments(Df(rows))
+        return rows
+
+    async def update_states(self):
+        while True:
+            rows = await self.row_queue.get()
+            top_level_rows = []
+            for row in rows:
+                state = self.states[row['post_id']]
+                state.add(row)
+                if row['parent_id'] == state.post_fullname:
+                    top_level_rows.append(row)
+            if len(top_level_rows) > 0:
+                await self.top_level_queue.put(top_level_rows)
+
+    async def build_features(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            top_level_rows = []
+            for rows in await get_batch(self.top_level_queue, self.batch_size, self.batch_wait_seconds):
+                top_level_rows += rows
+            # The network features are read now, on the loop, so that the states aren't read while they're updated
+            network_features = [self.states[row['post_id']].get_features(row) for row in top_level_rows]
+            user_rows = await self.get_user_rows(list({row['author'] for row in top_level_rows}))
+            datasets = await loop.run_in_executor(
+                None, self.get_datasets, Df(top_level_rows), Df(network_features), user_rows
+            )
+            for dataset in datasets:
+                await self.feature_queue.put(dataset)
+
+    async def get_user_rows(self, authors: List[str]) -> List[Dict]:
+        """
+        User rows of authors from memory or from the database. The other authors are queued for the crawl stage and get
+        a `get_default_user_row` meanwhile, authors whose account is deleted or suspended are left out.
+        """
+        loop = asyncio.get_event_loop()
+        missing_authors = [author for author in authors if isinstance(author, str) and author not in self.user_rows]
+        database = self.userExtractor.database
+        if database is not None and len(missing_authors) > 0:
+            for row in await loop.run_in_executor(None, database.get_user_rows, missing_authors,
+                                                  self.history_before_utc):
+                self.user_rows.put(row['author'], row)
+            missing_authors = [author for author in missing_authors if author not in self.user_rows]
+        for author in missing_authors:
+            if author in self.pending_authors:
+                continue
+            try:
+                self.user_queue.put_nowait(author)
+            except asyncio.QueueFull:   # Queued again the next time the author comments
+                get_instrumentation().count('stream.skipped_user_crawls')
+                continue
+            self.pending_authors.add(author)
+        rows = [self.user_rows.get(author, get_default_user_row(author, self.history_before_utc))
+                for author in authors if isinstance(author, str)]
+        return [row for row in rows if row is not None]
+
+    async def crawl_users(self):
+        """
+        Crawls the histories of the queued authors, user_workers at a time. Authors that can't be crawled are left
+        out, the ones that failed for another reason than a deleted or suspended account are queued again the next
+        time they comment.
+        """
+        loop = asyncio.get_event_loop()
+        database = self.userExtractor.database
+        while True:
+            authors = await get_batch(self.user_queue, self.batch_size, self.batch_wait_seconds)
+            crawls = [loop.run_in_executor(self.user_executor, self.userExtractor.get_user_predictors_for_author,
+                                           author) for author in authors]
+            for author, (row, failure) in zip(authors, await asyncio.gather(*crawls)):
+                self.pending_authors.discard(author)
+                if row is None:
+                    self.userExtractor.record_failure(failure)
+                    if failure['status'] in UserExtractor.PERMANENT_FAILURES:
+                        self.user_rows.put(author, None)
+                    continue
+                self.user_rows.put(author, row)
+                if database is not None:
+                    await loop.run_in_executor(None, database.upsert_users, [row])
+
+    def get_datasets(self, top_level_frame: Df, network_features: Df, user_rows: List[Dict]) -> List[Df]:
+        """
+        Same columns as the datasets of featureGenScript, one per submission. Runs in an executor thread.
+        """
+        text_features = self.commentTextFeatureBuilder.get_features_for_bodies(top_level_frame.body, workers=1)
+        post_feature_frame = pd.concat([top_level_frame, network_features, text_features], axis=1)
+        user_frame = Df(user_rows)
+        datasets = []
+        for post_id, post_frame in post_feature_frame.groupby('post_id', sort=False):
+            post_creation_time = self.post_creation_times[post_id]
+            post_frame = post_frame.assign(post_comment_timedelta_seconds=(
+                post_frame.comment_created_utc - post_creation_time).dt.total_seconds()).reset_index(drop=True)
+            if len(user_frame) == 0:
+                continue
+            post_users = user_frame[user_frame.author.isin(post_frame.author)]
+            dataset, _ = join_user_features(post_frame, build_user_feature_frame(post_users, post_creation_time))
+            if len(dataset) > 0:
+                datasets.append(dataset)
+        return datasets
+
+    async def score(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            dataset = await self.feature_queue.get()
+            probabilities = await loop.run_in_executor(None, self.model.predict, dataset)
+            self.write_scores(dataset, probabilities)
+
+    def write_scores(self, dataset: Df, probabilities: np.ndarray):
+        scored_utc = time.time()
+        scores = [{
+            "comment_id": comment_id,
+            "post_id": post_id,
+            "author": author,
+            "misinformation_probability": float(probability),
+            "latency_seconds": scored_utc - created_utc.timestamp()
+        } for comment_id, post_id, author, created_utc, probability in zip(
+            dataset.comment_id, dataset.post_id, dataset.author, dataset.comment_created_utc, probabilities
+        )]
+        self.scored_count += len(scores)
+        print(f"Scored {len(scores)} comments ({self.scored_count} total), latency "
+              f"{max(score['latency_seconds'] for score in scores):.1f}s")
+        if self.output_fname is not None:
+            with open(self.output_fname, 'a') as output_file:
+                output_file.writelines(json.dumps(score) + '\n' for score in scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scores the new top level comments of live submissions")
+    parser.add_argument('post_ids', nargs='+', help="Submissions to follow")
+    parser.add_argument('--model', required=True, help="Path of the model artifact, see Analysis.Model")
+    parser.add_argument('--output', default=None, help="JSON lines file the scores are appended to")
+    parser.add_argument('--batch-size', type=int, default=100, help="Maximum size of a micro batch")
+    parser.add_argument('--max-comments', type=int, default=500000, help="Comments tracked per submission")
+    args = parser.parse_args()
+    scorer = LiveScorer(args.post_ids, Model.load(args.model), output_fname=args.output, batch_size=args.batch_size,
+                        max_comments=args.max_comments)
+    try:
+        asyncio.run(scorer.run())
+    except KeyboardInterrupt:
+        print(f"Stopped after scoring {scorer.scored_count} comments")
+
+
+if __name__ == '__main__':
+    main()
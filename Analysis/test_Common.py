@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis import Common
+from Analysis.CompactFrame import compact_comment_frame, expand_comment_frame
+
+
+def get_comment_frame() -> pd.DataFrame:
+    """
+    p
+    ├── a
+    │   ├── b
+    │   │   └── d
+    │   └── c
+    ├── e
+    └── xab1        (shares a suffix with ab)
+    f, whose parent xx is missing from the frame, is a root of its own
+    """
+    return pd.DataFrame({
+        'comment_id': ['a', 'b', 'c', 'd', 'e', 'f', 'xab1', 'ab'],
+        'parent_id': ['t3_p', 't1_a', 't1_a', 't1_b', 't3_p', 't1_xx', 't3_p', 't1_f'],
+        'post_id': 'p',
+        'author': ['u1', 'u2', 'u1', np.nan, 'u3', 'u2', 'u4', 'u1'],
+    })
+
+
+@pytest.fixture(params=['string', 'compact'])
+def comment_frame(request) -> pd.DataFrame:
+    frame = get_comment_frame()
+    return frame if request.param == 'string' else compact_comment_frame(frame)
+
+
+def get_ids(frame: pd.DataFrame) -> list:
+    return sorted(expand_comment_frame(frame).comment_id)
+
+
+def test_top_level_comments(comment_frame):
+    thread_index = Common.get_thread_index(comment_frame)
+    assert get_ids(thread_index.get_top_level_comments()) == ['a', 'e', 'xab1']
+
+
+def test_roots_and_depths(comment_frame):
+    thread_index = Common.get_thread_index(comment_frame)
+    roots = get_ids(comment_frame.iloc[thread_index.root_positions])
+    assert roots == ['a', 'a', 'a', 'a', 'e', 'f', 'f', 'xab1']
+    assert thread_index.depths.tolist() == [0, 1, 1, 2, 0, 0, 0, 1]
+    assert thread_index.parent_positions.tolist() == [-1, 0, 0, 1, -1, -1, -1, 5]
+
+
+def test_order_puts_parents_first(comment_frame):
+    thread_index = Common.get_thread_index(comment_frame)
+    seen = set()
+    for position in thread_index.order:
+        parent_position = thread_index.parent_positions[position]
+        assert parent_position < 0 or parent_position in seen
+        seen.add(position)
+    assert len(seen) == len(comment_frame)
+    assert (np.diff(thread_index.depths[thread_index.order]) >= 0).all()
+
+
+def test_flattened_thread():
+    thread_index = Common.ThreadIndex(get_comment_frame())
+    assert sorted(thread_index.get_flattened_thread_under_parent_id('t1_a').comment_id) == ['b', 'c', 'd']
+    assert sorted(thread_index.get_flattened_thread_under_parent_id('a').comment_id) == ['b', 'c', 'd']
+    assert len(thread_index.get_flattened_thread_under_parent_id('t1_e')) == 0
+
+
+def test_replies_match_exact_fullnames():
+    thread_index = Common.ThreadIndex(get_comment_frame())
+    assert thread_index.get_replies_to('t1_ab').comment_id.tolist() == []
+    assert thread_index.get_replies_to('t1_f').comment_id.tolist() == ['ab']
+    assert thread_index.get_position('xab1') == 6
+    assert thread_index.get_position('t1_missing') == -1
+    with pytest.raises(KeyError):
+        thread_index.get_root('missing')
+
+
+def test_positions_of_duplicate_ids_are_the_last_row():
+    frame = pd.DataFrame({'comment_id': ['a', 'b', 'a'], 'parent_id': ['t3_p', 't1_a', 't3_p'], 'post_id': 'p'})
+    thread_index = Common.ThreadIndex(frame)
+    assert thread_index.get_positions(['a', 'b', 'zz']).tolist() == [2, 1, -1]
+
+
+def test_reply_cycle_has_no_root():
+    frame = pd.DataFrame({'comment_id': ['a', 'b', 'c'], 'parent_id': ['t1_b', 't1_a', 't3_p'], 'post_id': 'p'})
+    thread_index = Common.ThreadIndex(frame)
+    assert thread_index.root_positions.tolist() == [-1, -1, 2]
+    assert thread_index.order.tolist() == [2]
+
+
+def test_deep_reply_chain():
+    depth = 5000
+    frame = pd.DataFrame({
+        'comment_id': [f'c{i}' for i in range(depth)],
+        'parent_id': ['t3_p'] + [f't1_c{i}' for i in range(depth - 1)],
+        'post_id': 'p'
+    })
+    thread_index = Common.ThreadIndex(frame)
+    assert thread_index.depths.tolist() == list(range(depth))
+    assert (thread_index.root_positions == 0).all()
+    assert len(thread_index.get_flattened_thread_positions('t3_p')) == depth
+
+
+def test_has_history_cutoff():
+    user_frame = pd.DataFrame({'author': ['a', 'b', 'c'], 'history_before_utc': [1.5, np.nan, 2.0]})
+    assert Common.has_history_cutoff(user_frame, 1.5).tolist() == [True, False, False]
+    assert Common.has_history_cutoff(user_frame, None).tolist() == [False, True, False]
+    assert Common.has_history_cutoff(user_frame.drop(columns=['history_before_utc']), 1.5).tolist() == [False] * 3
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis import Common
+from Analysis.CompactFrame import compact_comment_frame, expand_comment_frame, decode_ids, encode_ids, \
+    split_fullnames, is_compact
+from Analysis.FeatureBuilder import PostUserFeatureBuilder, CommentNetworkFeatureBuilder, ReplyGraphFeatureBuilder
+from Benchmarks.synthetic import generate_comment_frame
+
+
+def test_ids_round_trip():
+    ids = ['0', '1', 'z', '10', 'b4agza', 'ejpgq2e', 'zzzzzzzzzzzz', None, np.nan]
+    keys = decode_ids(ids)
+    assert keys[:4].tolist() == [0, 1, 35, 36]
+    assert keys[-2:].tolist() == [-1, -1]
+    assert encode_ids(keys)[:-2].tolist() == ids[:-2]
+    assert pd.isnull(encode_ids(keys)[-2:]).all()
+    assert len(decode_ids([])) == 0
+
+
+@pytest.mark.parametrize('ids', [['Abc'], ['a-b'], ['01'], [''], ['1234567890abc']])
+def test_invalid_ids(ids):
+    with pytest.raises(ValueError):
+        decode_ids(ids)
+
+
+def test_split_fullnames():
+    kinds, keys = split_fullnames(['t1_a', 't3_b4agza', None])
+    assert kinds.tolist() == [1, 3, 0]
+    assert keys.tolist() == [10, decode_ids(['b4agza'])[0], -1]
+    with pytest.raises(ValueError):
+        split_fullnames(['t2_a'])
+
+
+def test_frame_round_trip():
+    comment_frame = generate_comment_frame(500, seed=1)
+    comment_frame.loc[::7, 'score'] = Common.Constants.SCORE_HIDDEN
+    compact_frame = compact_comment_frame(comment_frame)
+    assert is_compact(compact_frame)
+    assert compact_frame.comment_key.dtype == np.int64
+    assert compact_frame.author.dtype.name == 'category'
+    assert compact_frame.score_hidden.tolist() == (comment_frame.score == Common.Constants.SCORE_HIDDEN).tolist()
+    expanded = expand_comment_frame(compact_frame)
+    assert list(expanded.columns) == list(comment_frame.columns)
+    pd.testing.assert_frame_equal(expanded, comment_frame, check_dtype=False)
+    assert expand_comment_frame(comment_frame) is comment_frame
+
+
+def test_thread_index_matches():
+    comment_frame = generate_comment_frame(2000, seed=2)
+    thread_index = Common.get_thread_index(comment_frame)
+    compact_index = Common.get_thread_index(compact_comment_frame(comment_frame))
+    assert compact_index.root_positions.tolist() == thread_index.root_positions.tolist()
+    assert compact_index.parent_positions.tolist() == thread_index.parent_positions.tolist()
+    assert compact_index.depths.tolist() == thread_index.depths.tolist()
+    assert sorted(compact_index.get_top_level_positions()) == sorted(thread_index.get_top_level_positions())
+
+
+@pytest.mark.parametrize('builder_class', [PostUserFeatureBuilder, CommentNetworkFeatureBuilder,
+                                           ReplyGraphFeatureBuilder])
+def test_features_match(builder_class):
+    comment_frame = generate_comment_frame(2000, seed=3)
+    compact_frame = compact_comment_frame(comment_frame)
+    features = []
+    for frame in [comment_frame, compact_frame]:
+        thread_index = Common.get_thread_index(frame)
+        top_level_frame = thread_index.get_top_level_comments().reset_index(drop=True)
+        builder = builder_class(frame, thread_index=thread_index)
+        features.append(builder.get_features_for_frame(top_level_frame).drop(
+            columns=[Common.get_key_column(frame)], errors='ignore'))
+    pd.testing.assert_frame_equal(features[1], features[0])
@@ -0,0 +1,247 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis import Common, FeatureBuilder
+from Analysis.FeatureBuilder import IncrementalPostFeatureBuilder, PostFeatureBuilder, PostUserFeatureBuilder, \
+    CommentNetworkFeatureBuilder, CommentTextFeatureBuilder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POST_CREATION_TIME = pd.Timestamp('2019-03-22 21:00:00')
+AUTHORS = np.array(['u0', 'u1', 'u2', 'u3', 'u4', 'u5', 'u6', 'u7', None], dtype=object)
+BODIES = ['the report is out', 'teh goverment said so', '>quoted u/spez', 'see http://www.example.com/news',
+          'definately not what they said', '']
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    monkeypatch.chdir(ROOT)     # Constants.EXCLUSION_WLIST is relative to the root
+
+
+def skip_without_text_models():
+    for module in ['textblob', 'profanity_check', 'spellchecker']:
+        pytest.importorskip(module)
+
+
+@pytest.fixture
+def requested_bodies(monkeypatch) -> list:
+    """
+    Replaces the CommentTextFeatureBuilder of the PostFeatureBuilders by a stub whose features only depend on the body
+    :return: The bodies the stub is asked for
+    """
+    requested_bodies = []
+
+    class StubTextFeatureBuilder:
+
+        def __init__(self, exclusion_wordlist_fname: str):
+            pass
+
+        def get_features_for_bodies(self, comment_bodies: pd.Series, workers: int = None) -> pd.DataFrame:
+            requested_bodies.extend(comment_bodies)
+            return pd.DataFrame({
+                "comment_text_polarity": comment_bodies.str.len().values / 100,
+                "comment_char_count": comment_bodies.str.len().values.astype(np.int64)
+            }, index=comment_bodies.index)
+
+    monkeypatch.setattr(FeatureBuilder, 'CommentTextFeatureBuilder', StubTextFeatureBuilder)
+    return requested_bodies
+
+
+def generate_comment_frame(num_comments: int, seed: int) -> pd.DataFrame:
+    """
+    Random reply forest of post p in creation order. About a third of the comments are top level, the others reply to
+    an earlier comment, the last one replies to a comment missing from the frame. Some comments have no author.
+    """
+    rng = np.random.RandomState(seed)
+    comment_ids = np.array([f'c{position}' for position in range(num_comments)], dtype=object)
+    parent_ids = np.full(num_comments, 't3_p', dtype=object)
+    for position in range(1, num_comments):
+        if rng.rand() < 0.7:
+            parent_ids[position] = 't1_' + comment_ids[rng.randint(position)]
+    if num_comments > 1:
+        parent_ids[-1] = 't1_missing'
+    return pd.DataFrame({
+        'comment_id': comment_ids,
+        'parent_id': parent_ids,
+        'post_id': 'p',
+        'author': AUTHORS[rng.randint(len(AUTHORS), size=num_comments)],
+        'body': [f'{BODIES[index]} {comment_id}' for index, comment_id in
+                 zip(rng.randint(len(BODIES), size=num_comments), comment_ids)],
+        'score': rng.randint(-20, 50, size=num_comments),
+        'comment_created_utc': POST_CREATION_TIME + pd.to_timedelta(np.arange(num_comments) * 60, unit='s')
+    })
+
+
+def get_top_level_frame(comment_frame: pd.DataFrame) -> pd.DataFrame:
+    return comment_frame[comment_frame.parent_id == 't3_p'].reset_index(drop=True)
+
+
+def get_replies(comment_frame: pd.DataFrame, comment_id: str) -> pd.DataFrame:
+    return comment_frame[comment_frame.parent_id == 't1_' + comment_id]
+
+
+def get_max_depth(comment_frame: pd.DataFrame, comment_id: str, depth: int = 0) -> int:
+    """
+    The recursion CommentNetworkFeatureBuilder used before the bottom up pass
+    """
+    return max([depth] + [get_max_depth(comment_frame, reply_id, depth + 1)
+                          for reply_id in get_replies(comment_frame, comment_id).comment_id])
+
+
+def get_thread_size(comment_frame: pd.DataFrame, comment_id: str) -> int:
+    replies = get_replies(comment_frame, comment_id)
+    return len(replies) + sum(get_thread_size(comment_frame, reply_id) for reply_id in replies.comment_id)
+
+
+def get_thread_authors(comment_frame: pd.DataFrame, comment_id: str) -> list:
+    replies = get_replies(comment_frame, comment_id)
+    return list(replies.author) + [author for reply_id in replies.comment_id
+                                   for author in get_thread_authors(comment_frame, reply_id)]
+
+
+@pytest.mark.parametrize('num_comments,seed', [(1, 0), (60, 1), (300, 2)])
+def test_thread_metrics_match_recursion(num_comments, seed):
+    comment_frame = generate_comment_frame(num_comments, seed)
+    thread_metrics = CommentNetworkFeatureBuilder.get_thread_metrics_frame(Common.ThreadIndex(comment_frame))
+    assert thread_metrics.index.tolist() == comment_frame.comment_id.tolist()
+    for comment_id in comment_frame.comment_id:
+        assert thread_metrics.loc[comment_id].tolist() == [
+            len(get_replies(comment_frame, comment_id)),
+            get_max_depth(comment_frame, comment_id),
+            get_thread_size(comment_frame, comment_id)
+        ]
+    top_level_frame = get_top_level_frame(comment_frame)
+    features = CommentNetworkFeatureBuilder(comment_frame).get_features_for_frame(top_level_frame)
+    pd.testing.assert_frame_equal(features, thread_metrics.loc[top_level_frame.comment_id].reset_index(drop=True))
+
+
+def test_thread_metrics_of_deep_reply_chain():
+    depth = 5000
+    comment_frame = pd.DataFrame({
+        'comment_id': [f'c{i}' for i in range(depth)],
+        'parent_id': ['t3_p'] + [f't1_c{i}' for i in range(depth - 1)],
+        'post_id': 'p'
+    })
+    thread_metrics = CommentNetworkFeatureBuilder.get_thread_metrics_frame(Common.ThreadIndex(comment_frame))
+    assert thread_metrics.loc['c0'].tolist() == [1, depth - 1, depth - 1]
+    assert thread_metrics.loc[f'c{depth - 1}'].tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize('num_comments,seed', [(1, 0), (60, 1), (300, 2)])
+def test_author_counts_match_scans(num_comments, seed):
+    comment_frame = generate_comment_frame(num_comments, seed)
+    top_level_frame = get_top_level_frame(comment_frame)
+    builder = PostUserFeatureBuilder(comment_frame)
+    features = builder.get_features_for_frame(top_level_frame)
+    for position, row in enumerate(top_level_frame.itertuples()):
+        expected = {
+            "network_user_top_level_comment_count": int((top_level_frame.author == row.author).sum()),
+            "network_user_thread_comment_count": get_thread_authors(comment_frame, row.comment_id).count(row.author)
+            if pd.notnull(row.author) else 0,
+            "network_user_total_comment_count": int((comment_frame.author == row.author).sum())
+        }
+        assert builder.get_features_for_row(row) == expected
+        assert features.drop(columns=['comment_id']).iloc[position].to_dict() == expected
+
+
+def test_text_features_for_bodies_match_rows(monkeypatch):
+    skip_without_text_models()
+    monkeypatch.setattr(CommentTextFeatureBuilder, 'SENTIMENT_CHUNK_SIZE', 2)     # Several chunks for the pool
+    frame = pd.DataFrame({
+        'comment_id': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+        'body': ['The report is out, teh goverment said so', '', '[deleted]', '>quoted u/spez damn',
+                 'see http://www.example.com/news and https://en.wikipedia.org/wiki/Special_counsel', '   ',
+                 'Definately not what they said!!'],
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+    builder = CommentTextFeatureBuilder(Common.Constants.EXCLUSION_WLIST)
+    expected = [builder.get_features_for_row(row) for row in frame.itertuples()]
+    for workers in [1, 2]:
+        features = builder.get_features_for_bodies(frame.body, workers=workers)
+        assert features.index.tolist() == frame.index.tolist()
+        for position, row_features in enumerate(expected):
+            assert set(row_features) == set(features.columns)
+            for column, value in row_features.items():
+                if isinstance(value, float):
+                    assert features[column].iloc[position] == pytest.approx(value)
+                else:
+                    assert features[column].iloc[position] == value
+
+
+def build_post_feature_frame(comment_frame: pd.DataFrame) -> pd.DataFrame:
+    builder = PostFeatureBuilder(comment_frame, post_timestamp=POST_CREATION_TIME)
+    top_level_frame = builder.thread_index.get_top_level_comments().reset_index(drop=True)
+    return top_level_frame.merge(builder.get_features_for_frame(top_level_frame, workers=1), on='comment_id')
+
+
+def get_delta(comment_frame: pd.DataFrame, known_count: int, changed_count: int, seed: int) -> pd.DataFrame:
+    """
+    The comments after the first known_count, and changed_count of the known ones with a new body, score and author
+    """
+    changed = comment_frame.iloc[:known_count].sample(changed_count, random_state=seed).copy()
+    changed['body'] = 'changed ' + changed.comment_id
+    changed['score'] = 100
+    changed['author'] = changed.author.where(np.arange(changed_count) % 2 == 1, 'new_author')
+    return pd.concat([comment_frame.iloc[known_count:], changed], ignore_index=True).sample(frac=1, random_state=seed)
+
+
+@pytest.mark.parametrize('num_comments,known_count,changed_count,seed', [
+    (300, 250, 5, 0),
+    (300, 299, 0, 1),
+    (1000, 600, 20, 2),
+    (50, 1, 1, 3),
+])
+def test_update_matches_full_rebuild(requested_bodies, num_comments, known_count, changed_count, seed):
+    comment_frame = generate_comment_frame(num_comments, seed)
+    known_frame = comment_frame.iloc[:known_count].reset_index(drop=True)
+    delta_frame = get_delta(comment_frame, known_count, changed_count, seed)
+    post_feature_frame = build_post_feature_frame(known_frame)
+    builder = IncrementalPostFeatureBuilder(known_frame, POST_CREATION_TIME)
+    del requested_bodies[:]
+    updated_comment_frame, updated = builder.update(post_feature_frame, delta_frame, workers=1)
+    expected_comment_frame = IncrementalPostFeatureBuilder.merge_delta(known_frame, delta_frame)
+    pd.testing.assert_frame_equal(updated_comment_frame, expected_comment_frame)
+    # Only the text features of the top level comments of the delta are computed
+    top_level_delta = get_top_level_frame(expected_comment_frame)
+    assert sorted(requested_bodies) == sorted(top_level_delta.body[top_level_delta.comment_id.isin(
+        delta_frame.comment_id)])
+    expected = build_post_feature_frame(updated_comment_frame)
+    pd.testing.assert_frame_equal(updated, expected)
+
+
+def get_graph_reply_counts(comment_frame: pd.DataFrame) -> dict:
+    from Analysis.ReplyGraph import UserReplyGraph
+    reply_graph = UserReplyGraph(comment_frame)
+    reply_matrix = reply_graph.reply_matrix.tocoo()
+    return {(reply_graph.authors[row], reply_graph.authors[column]): count
+            for row, column, count in zip(reply_matrix.row, reply_matrix.col, reply_matrix.data)}
+
+
+def test_consecutive_updates_keep_the_reply_counts(requested_bodies):
+    comment_frame = generate_comment_frame(600, 4)
+    known_frame = comment_frame.iloc[:300].reset_index(drop=True)
+    builder = IncrementalPostFeatureBuilder(known_frame, POST_CREATION_TIME)
+    post_feature_frame = build_post_feature_frame(known_frame)
+    for known_count, seed in [(300, 4), (450, 5)]:
+        next_frame = pd.concat([builder.comment_frame, comment_frame.iloc[known_count:known_count + 150]],
+                               ignore_index=True)
+        delta_frame = get_delta(next_frame, known_count, 10, seed)
+        updated_comment_frame, post_feature_frame = builder.update(post_feature_frame, delta_frame, workers=1)
+        assert builder.comment_frame is updated_comment_frame
+        assert dict(builder.reply_counts) == get_graph_reply_counts(updated_comment_frame)
+        assert set(builder.author_comment_counts) == set(updated_comment_frame.author.dropna())
+        pd.testing.assert_frame_equal(post_feature_frame, build_post_feature_frame(updated_comment_frame))
+
+
+def test_merge_delta_replaces_in_place():
+    comment_frame = pd.DataFrame({'comment_id': ['a', 'b', 'c'], 'body': ['1', '2', '3']})
+    delta_frame = pd.DataFrame({'comment_id': ['d', 'b'], 'body': ['4', 'changed']})
+    merged = IncrementalPostFeatureBuilder.merge_delta(comment_frame, delta_frame)
+    assert merged.comment_id.tolist() == ['a', 'b', 'c', 'd']
+    assert merged.body.tolist() == ['1', 'changed', '3', '4']
+
+
+def test_get_roots():
+    parent_ids = pd.Series(['t3_p', 't1_a', 't1_b', 't1_missing'], index=['a', 'b', 'c', 'd'])
+    roots, depths = IncrementalPostFeatureBuilder.get_roots(parent_ids, np.array(['c', 'a', 'd']))
+    assert roots.tolist() == ['a', 'a', 'd']
+    assert depths.tolist() == [2, 0, 0]
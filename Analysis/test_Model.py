@@ -0,0 +1,89 @@
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis.Model import Model, TRAINING_DATA_FEATURES, ARTIFACT_FORMAT, CREDIBLE_SCORE, MISINFORMATION_SCORE, \
+    gen_model_for, get_model_path
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)     # Constants.MODEL_DIR is relative
+
+
+def generate_dataset(num_comments: int, seed: int) -> pd.DataFrame:
+    """
+    Dataset whose comment_char_count and golds tell misinformation apart from credible comments
+    """
+    rng = np.random.RandomState(seed)
+    score = rng.randint(-60, 100, size=num_comments)
+    features = {feature: rng.rand(num_comments) for feature in TRAINING_DATA_FEATURES}
+    features['comment_char_count'] = np.where(score < 0, 50, 500) + rng.randint(0, 40, size=num_comments)
+    features['golds'] = (score > 50).astype(int)
+    return pd.DataFrame({
+        'comment_id': [f'c{index}' for index in range(num_comments)],
+        'post_id': 'p',
+        'score': score,
+        **features
+    })
+
+
+def test_labels_drop_the_comments_in_between():
+    dataset = generate_dataset(500, 0)
+    labelled = gen_model_for(dataset)
+    assert list(labelled.columns) == ['comment_id', 'post_id'] + TRAINING_DATA_FEATURES + ['misinformation']
+    scores = dataset.set_index('comment_id').score[labelled.comment_id]
+    assert (labelled.misinformation.values == (scores.values < MISINFORMATION_SCORE)).all()
+    assert ((scores < MISINFORMATION_SCORE) | (scores > CREDIBLE_SCORE)).all()
+    assert len(labelled) == ((dataset.score < MISINFORMATION_SCORE) | (dataset.score > CREDIBLE_SCORE)).sum()
+
+
+def test_artifact_round_trip():
+    pytest.importorskip('sklearn')
+    dataset = generate_dataset(600, 1)
+    model = Model.train(dataset, estimator='random_forest')
+    assert model.metadata['test_accuracy'] > 0.9
+    assert model.save('misinformation') == get_model_path('misinformation', 1)
+    assert model.version == 1
+    loaded = Model.load_latest('misinformation')
+    assert loaded.version == 1
+    assert loaded.training_data_features == TRAINING_DATA_FEATURES
+    assert loaded.metadata == model.metadata
+    np.testing.assert_array_equal(loaded.predict(dataset), model.predict(dataset))
+    # Features are selected by name, in whatever order the frame has them
+    shuffled = dataset[dataset.columns[::-1]]
+    np.testing.assert_array_equal(loaded.predict(shuffled), model.predict(dataset))
+
+
+def test_versions_are_numbered_in_order():
+    pytest.importorskip('sklearn')
+    model = Model.train(generate_dataset(300, 2), estimator='random_forest')
+    for _ in range(11):
+        model.save('misinformation')
+    model.save('other')
+    assert Model.get_versions('misinformation') == list(range(1, 12))
+    assert Model.load_latest('misinformation').version == 11
+    assert Model.get_versions('missing') == []
+    with pytest.raises(FileNotFoundError):
+        Model.load_latest('missing')
+
+
+def test_artifact_of_another_format_is_rejected(tmp_path):
+    fname = str(tmp_path / 'v1.pkl')
+    with open(fname, 'wb') as artifact_file:
+        pickle.dump({"format": ARTIFACT_FORMAT + 1}, artifact_file)
+    with pytest.raises(ValueError):
+        Model.load(fname)
+
+
+def test_missing_features_are_reported():
+    with pytest.raises(KeyError, match='golds'):
+        Model.to_matrix(pd.DataFrame({'comment_char_count': [1]}), ['golds', 'comment_char_count'])
+    model = Model(None, None, ['golds'])
+    assert model.predict_matrix(np.empty((0, 1))).shape == (0,)
+
+
+def test_unknown_estimator():
+    from Analysis.Model import get_estimator
+    with pytest.raises(ValueError):
+        get_estimator('svm')
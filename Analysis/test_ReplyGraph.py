@@ -0,0 +1,79 @@
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis import Common
+from Analysis.CompactFrame import compact_comment_frame
+from Analysis.ReplyGraph import UserReplyGraph
+from Benchmarks.synthetic import generate_comment_frame
+
+
+def get_comment_frame() -> pd.DataFrame:
+    """
+    a1 by x, replied to by y twice (b1, b2) and by z (c1). x answers y (a2 under b1), y replies to itself (b3 under b2)
+    and the reply to the comment without author (e1 under n1) is left out
+    """
+    return pd.DataFrame({
+        'comment_id': ['a1', 'b1', 'b2', 'c1', 'a2', 'b3', 'n1', 'e1'],
+        'parent_id': ['t3_p', 't1_a1', 't1_a1', 't1_a1', 't1_b1', 't1_b2', 't3_p', 't1_n1'],
+        'post_id': 'p',
+        'author': ['x', 'y', 'y', 'z', 'x', 'y', np.nan, 'x'],
+    })
+
+
+def get_metrics(comment_frame: pd.DataFrame) -> pd.DataFrame:
+    return UserReplyGraph(comment_frame).get_user_metrics_frame().sort_index()
+
+
+def test_reply_matrix():
+    reply_graph = UserReplyGraph(get_comment_frame())
+    assert len(reply_graph) == 3
+    replies = pd.DataFrame(reply_graph.reply_matrix.toarray(), index=reply_graph.authors, columns=reply_graph.authors)
+    assert replies.loc['y', 'x'] == 2
+    assert replies.loc['z', 'x'] == 1
+    assert replies.loc['x', 'y'] == 1
+    assert replies.values.sum() == 4
+    assert (np.diag(replies.values) == 0).all()
+
+
+def test_degrees_and_reciprocity():
+    metrics = get_metrics(get_comment_frame())
+    assert metrics.network_user_reply_in_degree.to_dict() == {'x': 2, 'y': 1, 'z': 0}
+    assert metrics.network_user_reply_out_degree.to_dict() == {'x': 1, 'y': 1, 'z': 1}
+    assert metrics.network_user_reply_reciprocity.to_dict() == {'x': 1.0, 'y': 1.0, 'z': 0.0}
+
+
+def test_pagerank_matches_dense_power_iteration():
+    reply_graph = UserReplyGraph(generate_comment_frame(1000, seed=4))
+    replies = reply_graph.reply_matrix.toarray().astype(float)
+    author_count = len(replies)
+    out_weights = replies.sum(axis=1)
+    # Authors who replied to nobody link to everyone
+    transitions = np.where(out_weights[:, None] > 0, replies / np.maximum(out_weights, 1)[:, None], 1 / author_count)
+    ranks = np.full(author_count, 1 / author_count)
+    for _ in range(200):
+        ranks = UserReplyGraph.DAMPING * transitions.T @ ranks + (1 - UserReplyGraph.DAMPING) / author_count
+    pageranks = reply_graph.get_pageranks()
+    assert np.allclose(pageranks, ranks * author_count, atol=1e-8)
+    assert pageranks.mean() == pytest.approx(1.0)
+
+
+def test_frame_forms_match():
+    comment_frame = generate_comment_frame(2000, seed=5)
+    string_positions = UserReplyGraph.get_parent_positions(comment_frame)
+    assert string_positions.tolist() == Common.get_thread_index(comment_frame).parent_positions.tolist()
+    pd.testing.assert_frame_equal(get_metrics(compact_comment_frame(comment_frame)), get_metrics(comment_frame),
+                                  check_index_type=False)
+
+
+def test_from_reply_counts_matches():
+    comment_frame = get_comment_frame()
+    reply_counts = Counter({('y', 'x'): 2, ('z', 'x'): 1, ('x', 'y'): 1})
+    from_counts = UserReplyGraph.from_reply_counts(reply_counts, ['z', 'x', 'y']).get_user_metrics_frame()
+    pd.testing.assert_frame_equal(from_counts.sort_index(), get_metrics(comment_frame), check_index_type=False)
+
+
+def test_empty_frame():
+    comment_frame = get_comment_frame().iloc[:0]
+    assert len(get_metrics(comment_frame)) == 0
+    assert len(UserReplyGraph.from_reply_counts({}, []).get_pageranks()) == 0
@@ -0,0 +1,109 @@
+import os
+import re
+import numpy as np
+import pytest
+from Analysis.Common import Constants
+from Analysis.Spelling import AhoCorasick, LRUCache, SpellingEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BODIES = [
+    'The report is out, teh goverment said so', '', '   ', '[deleted]', '>quoted u/spez',
+    'see http://www.example.com/news and (https://en.wikipedia.org/wiki/Special_counsel)', "Mueller's muellers",
+    'Definately not what they said!!', 'recieve 2 subpoenas_now', 'naïve café über', 'lol witchhunt exonerated'
+]
+
+
+class PerWordSpelling:
+    """
+    The per word spelling features CommentTextFeatureBuilder had before the SpellingEngine: every word is looked up on
+    its own and checked against every excluded word
+    """
+
+    def __init__(self, exclusion_wordlist_fname: str):
+        from spellchecker import SpellChecker
+        self.spell_check = SpellChecker()
+        with open(exclusion_wordlist_fname, 'rt') as fd:
+            self.excluded_wordlist = fd.read().split('\n')
+
+    def get_spelling_features(self, comment_body: str) -> dict:
+        comment_body = comment_body.strip().lower()
+        comment_body = ' '.join(word for word in comment_body.split(' ') if not self.is_word_a_url(word))
+        comment_body = ''.join(char if char.isalpha() else ' ' for char in comment_body)
+        mistaken_words = [word for word in comment_body.split(' ')
+                          if len(word) > 0 and not self.is_word_spelled_correctly(word)]
+        return {"comment_spelling_error_count": len(mistaken_words), "meta_comment_spelling_errors": mistaken_words}
+
+    @classmethod
+    def is_word_a_url(cls, word: str) -> bool:
+        return len(re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+] |[!*\(\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
+                              word)) > 0
+
+    def is_excluded(self, word: str) -> bool:
+        return any(excluded_word in word for excluded_word in self.excluded_wordlist)
+
+    def is_word_spelled_correctly(self, word: str) -> bool:
+        return len([word for word in self.spell_check.unknown([word]) if not self.is_excluded(word)]) == 0
+
+
+@pytest.fixture
+def exclusion_wordlist_fname() -> str:
+    return os.path.join(ROOT, Constants.EXCLUSION_WLIST)
+
+
+@pytest.mark.parametrize('memo_size', [100000, 2])
+def test_spelling_features_match_per_word_lookups(exclusion_wordlist_fname, memo_size):
+    pytest.importorskip('spellchecker')
+    engine = SpellingEngine(exclusion_wordlist_fname, memo_size=memo_size)
+    per_word = PerWordSpelling(exclusion_wordlist_fname)
+    expected = [per_word.get_spelling_features(body) for body in BODIES]
+    assert any(features["comment_spelling_error_count"] > 0 for features in expected)
+    assert engine.get_spelling_features(BODIES) == expected
+    assert engine.get_spelling_features(BODIES[::-1]) == expected[::-1]     # Now from the memo
+
+
+def test_empty_excluded_word_excludes_every_word(tmp_path):
+    """
+    A word list ending with a newline has the empty string as its last word, which is in every word
+    """
+    pytest.importorskip('spellchecker')
+    fname = str(tmp_path / 'known_spellings.txt')
+    with open(fname, 'w') as fd:
+        fd.write('mueller\nwitchhunt\n')
+    assert SpellingEngine.load_excluded_words(fname)[-1] == ''
+    expected = [PerWordSpelling(fname).get_spelling_features(body) for body in BODIES]
+    assert all(features["comment_spelling_error_count"] == 0 for features in expected)
+    assert SpellingEngine(fname).get_spelling_features(BODIES) == expected
+
+
+def test_aho_corasick_matches_substring_scan():
+    rng = np.random.RandomState(0)
+    alphabet = np.array(list('abc'))
+    patterns = [''.join(rng.choice(alphabet, size=rng.randint(1, 5))) for _ in range(20)]
+    matcher = AhoCorasick(patterns)
+    for _ in range(500):
+        text = ''.join(rng.choice(alphabet, size=rng.randint(0, 12)))
+        assert matcher.contains_any(text) == any(pattern in text for pattern in patterns)
+
+
+def test_aho_corasick_edge_cases():
+    assert not AhoCorasick([]).contains_any('mueller')
+    assert AhoCorasick(['']).contains_any('')
+    assert AhoCorasick(['he', 'she', 'hers']).contains_any('ushers')
+    assert AhoCorasick(['abcd', 'bc']).contains_any('xabcx')
+    assert not AhoCorasick(['abcd', 'bce']).contains_any('abcbcd')
+
+
+def test_tokenize_drops_urls_and_splits_on_non_letters():
+    assert SpellingEngine.tokenize("Mueller's report: http://example.com/x 2nd_time") == \
+        ['mueller', 's', 'report', 'nd', 'time']
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert len(cache) == 2
+    assert cache.get('b', False) is False
@@ -0,0 +1,118 @@
+import json
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from Analysis import Storage
+
+
+def get_user_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'author': ['a', 'b', 'c', 'd'],
+        'user_total_comment_karma': [10, -3, 0, 7],
+        'subreddit_comment_count': [{'politics': 2, 'news': 1}, {}, {'politics': 5}, {}],
+        'subreddit_post_count': [{}, {}, {}, {}],
+        'user_account_creation_utc': pd.to_datetime(['2015-01-01', '2016-01-01', '2017-01-01', '2018-01-01']),
+    })
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'user_frame.parquet')
+    frame = get_user_frame()
+    Storage.write_frame(frame, path)
+    read = Storage.read_frame(path)
+    assert list(read.columns) == list(frame.columns)
+    assert read.subreddit_comment_count.tolist() == frame.subreddit_comment_count.tolist()
+    assert read.subreddit_post_count.tolist() == frame.subreddit_post_count.tolist()
+    pd.testing.assert_frame_equal(read.drop(columns=['subreddit_comment_count', 'subreddit_post_count']),
+                                  frame.drop(columns=['subreddit_comment_count', 'subreddit_post_count']),
+                                  check_dtype=False)
+
+
+def test_dict_column_empty_in_every_row(tmp_path):
+    path = str(tmp_path / 'user_frame.parquet')
+    frame = get_user_frame()[['author', 'subreddit_post_count']]
+    Storage.write_frame(frame, path)
+    read = Storage.read_frame(path)
+    assert list(read.columns) == ['author', 'subreddit_post_count']
+    assert read.subreddit_post_count.tolist() == [{}] * 4
+    assert Storage.read_frame(path, columns=['subreddit_post_count']).subreddit_post_count.tolist() == [{}] * 4
+
+
+def test_files_without_dict_columns_metadata_use_the_sidecar(tmp_path):
+    path = str(tmp_path / 'user_frame.parquet')
+    Storage.write_frame(get_user_frame(), path)
+    table = pq.read_table(path)
+    metadata = {key: value for key, value in table.schema.metadata.items()
+                if key != Storage.DICT_COLUMNS_METADATA_KEY}
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+    assert Storage.read_frame(path, columns=['subreddit_comment_count']).subreddit_comment_count.tolist() == \
+        get_user_frame().subreddit_comment_count.tolist()
+
+
+def test_projection_and_filters(tmp_path):
+    path = str(tmp_path / 'dataset.parquet')
+    frame = pd.DataFrame({'post_id': ['p1', 'p2'] * 50, 'score': range(100)})
+    Storage.write_frame(frame, path, sort_by='post_id', row_group_size=10)
+    read = Storage.read_frame(path, columns=['score'], filters=[('post_id', '==', 'p2'), ('score', '<', 10)])
+    assert list(read.columns) == ['score']
+    assert read.score.tolist() == [1, 3, 5, 7, 9]
+    assert Storage.read_frame(path, filters=[('score', 'in', {4, 5})]).score.tolist() == [4, 5]
+    empty = Storage.read_frame(path, filters=[('score', '>', 1000)])
+    assert len(empty) == 0 and list(empty.columns) == ['post_id', 'score'] and empty.score.dtype == frame.score.dtype
+    pd.testing.assert_frame_equal(
+        Storage.select(frame, columns=['score'], filters=[('post_id', '!=', 'p1'), ('score', '>=', 95)]),
+        Storage.read_frame(path, columns=['score'], filters=[('post_id', '!=', 'p1'), ('score', '>=', 95)]),
+        check_dtype=False
+    )
+
+
+def test_row_groups_are_pruned(tmp_path):
+    path = str(tmp_path / 'dataset.parquet')
+    Storage.write_frame(pd.DataFrame({'score': range(100)}), path, row_group_size=10)
+    parquet_file = pq.ParquetFile(path)
+    matching = [index for index in range(parquet_file.num_row_groups)
+                if Storage.may_row_group_match(parquet_file, index, [('score', '>=', 85)])]
+    assert matching == [8, 9]
+
+
+def test_sidecar_row_groups_are_pruned(tmp_path, monkeypatch):
+    path = str(tmp_path / 'user_frame.parquet')
+    frame = pd.DataFrame({
+        'post_id': ['p1', 'p2'] * 50,
+        'subreddit_comment_count': [{'politics': row, 'news': 1} if row % 3 else {} for row in range(100)],
+        'subreddit_post_count': [{'news': row} for row in range(100)],
+    })
+    Storage.write_frame(frame, path, sort_by='post_id', row_group_size=20)
+    sidecar_file = pq.ParquetFile(Storage.get_sidecar_path(path))
+    read_row_groups = []
+    may_hold_rows = Storage.may_hold_rows
+
+    def spy(sidecar_file, row_group_index, rows):
+        holds_rows = may_hold_rows(sidecar_file, row_group_index, rows)
+        if holds_rows:
+            read_row_groups.append(row_group_index)
+        return holds_rows
+
+    monkeypatch.setattr(Storage, 'may_hold_rows', spy)
+    read = Storage.read_frame(path, filters=[('post_id', '==', 'p2')])
+    expected = frame[frame.post_id == 'p2'].reset_index(drop=True)
+    assert read.subreddit_comment_count.tolist() == expected.subreddit_comment_count.tolist()
+    assert read.subreddit_post_count.tolist() == expected.subreddit_post_count.tolist()
+    assert 0 < len(read_row_groups) < sidecar_file.num_row_groups
+    assert Storage.read_frame(path, filters=[('post_id', '==', 'p3')]).subreddit_post_count.tolist() == []
+
+
+def test_unsupported_operator(tmp_path):
+    path = str(tmp_path / 'dataset.parquet')
+    Storage.write_frame(pd.DataFrame({'score': range(3)}), path)
+    with pytest.raises(ValueError):
+        Storage.read_frame(path, filters=[('score', '~', 1)])
+
+
+def test_column_order_is_recorded(tmp_path):
+    path = str(tmp_path / 'user_frame.parquet')
+    Storage.write_frame(get_user_frame(), path)
+    metadata = pq.ParquetFile(path).metadata.metadata
+    assert json.loads(metadata[Storage.COLUMNS_METADATA_KEY]) == list(get_user_frame().columns)
+    assert json.loads(metadata[Storage.DICT_COLUMNS_METADATA_KEY]) == ['subreddit_comment_count',
+                                                                       'subreddit_post_count']
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis.FeatureBuilder import SubredditFeatureBuilder, UserFeatureBuilder
+from Analysis.SubredditMatrix import MEASURES, SubredditVocabulary, UserSubredditMatrix
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POST_CREATION_TIME = pd.Timestamp('2019-03-22 21:00:00')
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    monkeypatch.chdir(ROOT)     # Constants.PARTISAN_RESOURCE is relative to the root
+
+
+def change_case(subreddit: str, rng: np.random.RandomState) -> str:
+    return ''.join(char.upper() if rng.rand() < 0.5 else char.lower() for char in subreddit)
+
+
+def generate_user_frame(num_users: int, seed: int) -> pd.DataFrame:
+    """
+    Users active in random partisan, specific and other subreddits, spelled in a random case but at most once per user
+    """
+    rng = np.random.RandomState(seed)
+    resource = SubredditFeatureBuilder.load_partisan_resource()
+    subreddits = sorted({subreddit for category in resource.values() for subreddit in category} |
+                        set(SubredditFeatureBuilder.SPECIFIC_SUBREDDITS) | {'aww', 'AskReddit', 'pics'},
+                        key=str.lower)
+    columns = {measure: [] for measure in MEASURES}
+    for _ in range(num_users):
+        active = rng.choice(len(subreddits), size=rng.randint(0, 12), replace=False)
+        for measure in MEASURES:
+            columns[measure].append({change_case(subreddits[index], rng): int(rng.randint(-50, 500))
+                                     for index in active})
+    return pd.DataFrame({
+        'author': [f'u{position}' for position in range(num_users)],
+        'user_account_creation_utc': POST_CREATION_TIME - pd.to_timedelta(rng.randint(1, 10**8, size=num_users),
+                                                                          unit='s'),
+        **columns
+    })
+
+
+@pytest.mark.parametrize('num_users,seed', [(1, 0), (50, 1), (400, 2)])
+def test_frame_features_match_row_features(num_users, seed):
+    user_frame = generate_user_frame(num_users, seed)
+    builder = UserFeatureBuilder(POST_CREATION_TIME)
+    features = builder.get_features_for_frame(user_frame)
+    expected = pd.DataFrame([builder.get_features_for_row(row) for row in user_frame.itertuples()])
+    assert set(features.columns) == set(expected.columns)
+    pd.testing.assert_frame_equal(features[expected.columns], expected, check_dtype=False)
+
+
+def test_frame_features_of_users_without_activity():
+    user_frame = generate_user_frame(3, 0)
+    for measure in MEASURES:
+        user_frame[measure] = [{}, {}, {}]
+    features = SubredditFeatureBuilder.get_features_for_frame(user_frame)
+    assert features.shape[0] == 3
+    assert (features.values == 0).all()
+
+
+def test_case_variants_of_a_subreddit_are_summed():
+    """
+    A dict with the same subreddit spelled twice sums both values, the dicts of the per row path kept only one of them
+    """
+    user_frame = pd.DataFrame({
+        'author': ['a', 'b'],
+        **{measure: [{'politics': 1, 'Politics': 2, 'POLITICS': 4}, {'Politics': 8, 'news': 16}] for measure in MEASURES}
+    })
+    matrix = UserSubredditMatrix(user_frame)
+    assert matrix.get_subreddits('subreddit_post_count') == ['politics', 'news']
+    category_matrix = matrix.get_category_matrix({'politics': ['POLITICS'], 'news': ['news'], 'none': ['aww']})
+    assert matrix.aggregate('subreddit_post_count', category_matrix).tolist() == [[7, 0, 0], [8, 16, 0]]
+
+
+def test_category_matrix_counts_subreddits_listed_twice():
+    user_frame = pd.DataFrame({'author': ['a'], 'subreddit_post_count': [{'news': 3, 'aww': 1}]})
+    matrix = UserSubredditMatrix(user_frame, measures=['subreddit_post_count'])
+    category_matrix = matrix.get_category_matrix({'twice': ['news', 'News'], 'missing': ['pics']})
+    assert matrix.aggregate('subreddit_post_count', category_matrix).tolist() == [[6, 0]]
+
+
+def test_vocabulary_keeps_first_spelling():
+    vocabulary = SubredditVocabulary()
+    assert vocabulary.add('AskReddit') == 0
+    assert vocabulary.add('askreddit') == 0
+    assert vocabulary.add('news') == 1
+    assert vocabulary.get('ASKREDDIT') == 0
+    assert vocabulary.get('pics') == -1
+    assert vocabulary.display_names == ['AskReddit', 'news']
@@ -0,0 +1,133 @@
+import os
+import sys
+import types
+import numpy as np
+import pandas as pd
+import pytest
+from Analysis import Common
+from Analysis.featureGenScript import combine_partitions, get_shared_user_frame, join_user_features
+
+POST_CREATION_TIME = pd.Timestamp('2019-03-22 21:00:00')
+CUTOFF = POST_CREATION_TIME.timestamp()
+
+
+@pytest.fixture
+def in_tmp_path(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)     # The frames are read from and written to data/, relative to the working directory
+
+
+def get_post_feature_frame(authors: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'comment_id': [f'c{position}' for position in range(len(authors))],
+        'post_id': 'p',
+        'author': np.array(authors, dtype=object),
+        'score': np.arange(len(authors)) - 3,
+        'comment_char_count': np.arange(len(authors)) * 10,
+    })
+
+
+def get_user_feature_frame(authors: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'author': authors,
+        'user_total_comment_karma': np.arange(len(authors)) * 100,
+        'user_email_verified': np.arange(len(authors)) % 2 == 0,
+        'user_account_age_seconds': np.arange(len(authors)) * 1.5,
+    })
+
+
+def test_join_matches_merge():
+    rng = np.random.RandomState(0)
+    post_feature_frame = get_post_feature_frame(list(rng.choice(['a', 'b', 'c', 'gone', None], size=200)))
+    user_feature_frame = get_user_feature_frame(['c', 'a', 'b', 'a', 'unrelated'])     # The first a wins
+    joined, missing_users = join_user_features(post_feature_frame, user_feature_frame)
+    expected = post_feature_frame.merge(user_feature_frame.drop_duplicates(subset='author'), on='author', how='inner')
+    # The merge groups the comments by author, the join keeps them in the order of post_feature_frame
+    positions = pd.Index(post_feature_frame.comment_id).get_indexer(expected.comment_id)
+    expected = expected.iloc[np.argsort(positions, kind='stable')].reset_index(drop=True)
+    pd.testing.assert_frame_equal(joined, expected)
+    assert len(missing_users) == 2 and 'gone' in missing_users and any(pd.isnull(list(missing_users)))
+
+
+def test_join_without_users():
+    post_feature_frame = get_post_feature_frame(['a', 'b'])
+    joined, missing_users = join_user_features(post_feature_frame, get_user_feature_frame([]))
+    assert len(joined) == 0 and missing_users == {'a', 'b'}
+    assert set(joined.columns) == set(post_feature_frame.columns) | {'user_total_comment_karma', 'user_email_verified',
+                                                                       'user_account_age_seconds'}
+
+
+def test_combine_partitions(in_tmp_path):
+    pytest.importorskip('pyarrow')
+    partitions = {post_id: get_post_feature_frame(['a', 'b', 'c']).assign(post_id=post_id) for post_id in ['q', 'p']}
+    for post_id, partition in partitions.items():
+        Common.save_frame(partition, 'dataset', post_id)
+    combined = combine_partitions(['q', 'p'], 'combined')
+    pd.testing.assert_frame_equal(combined, pd.concat(partitions.values(), ignore_index=True))
+    loaded = Common.load_dataset_for_post('combined')
+    assert sorted(loaded.post_id) == ['p'] * 3 + ['q'] * 3
+    pd.testing.assert_frame_equal(
+        Common.load_dataset_for_post('combined', filters=[('post_id', '==', 'q')]).reset_index(drop=True),
+        partitions['q']
+    )
+
+
+def save_user_frame(user_frame: pd.DataFrame, frame_id: str):
+    path = Common.get_frame_path('user_frame', frame_id, 'pkl')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    user_frame.to_pickle(path)
+
+
+def get_user_frame(authors: list, history_before_utc, karma: int = 0) -> pd.DataFrame:
+    return pd.DataFrame({
+        'author': authors,
+        'user_total_comment_karma': karma,
+        'history_before_utc': history_before_utc
+    })
+
+
+def test_shared_user_frame_prefers_rows_with_the_cutoff(in_tmp_path, capsys):
+    save_user_frame(get_user_frame(['a', 'b'], CUTOFF, karma=1), 'combined')
+    save_user_frame(get_user_frame(['b', 'c'], CUTOFF, karma=2), 'p')
+    save_user_frame(get_user_frame(['c', 'd'], CUTOFF + 60, karma=3), 'q')
+    user_frame = get_shared_user_frame({'p': {'a', 'b', 'c'}, 'q': {'c', 'd'}}, 'combined',
+                                       history_before=POST_CREATION_TIME)
+    assert dict(zip(user_frame.author, user_frame.user_total_comment_karma)) == {'a': 1, 'b': 1, 'c': 2, 'd': 3}
+    assert 'Warning: Reusing 1 user rows' in capsys.readouterr().out
+
+
+def test_shared_user_frame_reuses_legacy_frames(in_tmp_path, capsys):
+    # Frames crawled before the cutoff was recorded have no history_before_utc column
+    save_user_frame(get_user_frame(['a', 'b'], CUTOFF, karma=1).drop(columns=['history_before_utc']), 'p')
+    user_frame = get_shared_user_frame({'p': {'a', 'b', 'c'}}, 'combined', history_before=POST_CREATION_TIME)
+    assert sorted(user_frame.author) == ['a', 'b']
+    assert 'Warning: Reusing 2 user rows' in capsys.readouterr().out
+
+
+def test_shared_user_frame_without_any_rows_raises(in_tmp_path):
+    with pytest.raises(ValueError, match='extract-missing-users'):
+        get_shared_user_frame({'p': {'a', 'b'}}, 'combined', history_before=POST_CREATION_TIME)
+
+
+def test_shared_user_frame_crawls_the_missing_authors(in_tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    crawls = []
+
+    class UserExtractor:
+
+        def __init__(self, workers: int = 1, history_before_utc: float = None):
+            self.history_before_utc = history_before_utc
+
+        def get_frame_for_authors(self, authors: list) -> pd.DataFrame:
+            crawls.append((list(authors), self.history_before_utc))
+            return get_user_frame(authors, self.history_before_utc, karma=5)
+
+    extractors = types.ModuleType('Ingest.extractors')
+    extractors.UserExtractor = UserExtractor
+    monkeypatch.setitem(sys.modules, 'Ingest.extractors', extractors)
+    save_user_frame(get_user_frame(['a'], CUTOFF, karma=1), 'p')
+    save_user_frame(get_user_frame(['b'], CUTOFF + 60, karma=3), 'q')     # Crawled again up to the cutoff
+    user_frame = get_shared_user_frame({'p': {'a', 'b'}, 'q': {'c'}}, 'combined', extract_missing_users=True,
+                                       history_before=POST_CREATION_TIME)
+    assert crawls == [(['b', 'c'], CUTOFF)]
+    assert dict(zip(user_frame.author, user_frame.user_total_comment_karma)) == {'a': 1, 'b': 5, 'c': 5}
+    assert sorted(Common.load_user_frame('combined').author) == ['a', 'b', 'c']
@@ -0,0 +1,144 @@
+import json
+import asyncio
+import numpy as np
+import pytest
+from Analysis.Model import Model
+from Analysis.scoringServer import ScoringServer, get_batch
+
+
+class CountingEstimator:
+    """
+    Probability of misinformation is the first feature, the batches it's asked for are kept
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        self.batch_sizes.append(len(X))
+        return np.column_stack([1 - X[:, 0], X[:, 0]])
+
+
+class IdentityScaler:
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return X
+
+
+def get_model() -> Model:
+    return Model(IdentityScaler(), CountingEstimator(), ['golds', 'comment_char_count'], version=3)
+
+
+def test_get_batch_collects_what_arrived():
+    async def collect():
+        queue = asyncio.Queue()
+        for item in range(5):
+            queue.put_nowait(item)
+        first = await get_batch(queue, max_size=3, max_wait_seconds=1)
+        second = await get_batch(queue, max_size=3, max_wait_seconds=0.01)
+        return first, second
+
+    assert asyncio.run(collect()) == ([0, 1, 2], [3, 4])
+
+
+def test_concurrent_requests_share_a_predict_call():
+    model = get_model()
+    server = ScoringServer(model, max_batch_requests=64, max_wait_seconds=0.05)
+
+    async def score_all():
+        server.pending = asyncio.Queue()
+        batches = asyncio.ensure_future(server.run_batches())
+        matrices = [np.array([[index / 100, 1.0]] * (index % 3 + 1)) for index in range(40)]
+        results = await asyncio.gather(*[server.score(matrix) for matrix in matrices])
+        batches.cancel()
+        return matrices, results
+
+    matrices, results = asyncio.run(score_all())
+    for matrix, probabilities in zip(matrices, results):
+        np.testing.assert_array_equal(probabilities, matrix[:, 0])
+    assert model.estimator.batch_sizes == [sum(len(matrix) for matrix in matrices)]
+
+
+def test_batches_are_bounded():
+    model = get_model()
+    server = ScoringServer(model, max_batch_requests=8, max_wait_seconds=0.05)
+
+    async def score_all():
+        server.pending = asyncio.Queue()
+        batches = asyncio.ensure_future(server.run_batches())
+        await asyncio.gather(*[server.score(np.array([[0.5, 1.0]])) for _ in range(20)])
+        batches.cancel()
+
+    asyncio.run(score_all())
+    assert model.estimator.batch_sizes == [8, 8, 4]
+
+
+def test_payload_formats():
+    server = ScoringServer(get_model())
+    rows = server.to_matrix({"rows": [{"comment_char_count": 10, "golds": 1, "other": 5}]})
+    columns = server.to_matrix({"columns": ["other", "comment_char_count", "golds"], "data": [[5, 10, 1]]})
+    np.testing.assert_array_equal(rows, [[1.0, 10.0]])
+    np.testing.assert_array_equal(columns, [[1.0, 10.0]])
+    assert server.to_matrix({"rows": []}).shape == (0, 2)
+    with pytest.raises(KeyError):
+        server.to_matrix({"columns": ["golds"], "data": [[1]]})
+
+
+def test_routes():
+    server = ScoringServer(get_model())
+
+    async def route_all():
+        return [
+            await server.route('GET', '/health', b''),
+            await server.route('GET', '/missing', b''),
+            await server.route('POST', '/predict', b'{"rows": [{"golds": 1}]}'),
+            await server.route('POST', '/predict', b'not json'),
+            await server.route('POST', '/predict', b'{"rows": []}'),
+        ]
+
+    health, missing, missing_feature, not_json, empty = asyncio.run(route_all())
+    assert health == (200, {"status": "ok", "model_version": 3, "training_data_features": ['golds',
+                                                                                             'comment_char_count']})
+    assert missing[0] == 404 and missing_feature[0] == 400 and not_json[0] == 400
+    assert empty == (200, {"probabilities": [], "model_version": 3})
+
+
+def test_keep_alive_connection():
+    model = get_model()
+    server = ScoringServer(model)
+
+    async def request(reader, writer, payload: dict, close: bool = False) -> dict:
+        body = json.dumps(payload).encode()
+        writer.write(f"POST /predict HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                     f"{'Connection: close' if close else 'Connection: keep-alive'}\r\n\r\n".encode() + body)
+        status_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line == b'\r\n':
+                break
+            key, _, value = line.decode().partition(':')
+            headers[key.strip().lower()] = value.strip()
+        assert status_line.startswith(b'HTTP/1.1 200')
+        return json.loads(await reader.readexactly(int(headers['content-length'])))
+
+    async def run():
+        server.pending = asyncio.Queue()
+        batches = asyncio.ensure_future(server.run_batches())
+        tcp_server = await asyncio.start_server(server.handle_connection, host='127.0.0.1', port=0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        first = await request(reader, writer, {"rows": [{"golds": 0.25, "comment_char_count": 3}]})
+        second = await request(reader, writer, {"columns": ["comment_char_count", "golds"], "data": [[1, 0.75]]},
+                               close=True)
+        closed = await reader.read()
+        writer.close()
+        tcp_server.close()
+        await tcp_server.wait_closed()
+        batches.cancel()
+        return first, second, closed
+
+    first, second, closed = asyncio.run(run())
+    assert first == {"probabilities": [0.25], "model_version": 3}
+    assert second == {"probabilities": [0.75], "model_version": 3}
+    assert closed == b''
@@ -0,0 +1,186 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+pytest.importorskip('prawcore.exceptions')  # The stream enriches its comments with the extractors
+from Analysis import Common
+from Analysis.FeatureBuilder import CommentNetworkFeatureBuilder, PostUserFeatureBuilder, ReplyGraphFeatureBuilder
+from Analysis.Spelling import LRUCache
+from Analysis.streamScript import LiveScorer, LiveThreadState
+
+AUTHORS = np.array(['u0', 'u1', 'u2', 'u3', 'u4', 'u5', None], dtype=object)
+
+
+def generate_comment_frame(num_comments: int, seed: int, reply_to_latest: bool = False) -> pd.DataFrame:
+    """
+    Random reply forest of post p in creation order, a comment replies to the post or to an earlier comment. The last
+    comment replies to a comment missing from the frame.
+    :param reply_to_latest: Replies go to one of the 10 latest comments, so that old threads go quiet
+    """
+    rng = np.random.RandomState(seed)
+    comment_ids = np.array([f'c{position}' for position in range(num_comments)], dtype=object)
+    parent_ids = np.full(num_comments, 't3_p', dtype=object)
+    for position in range(1, num_comments):
+        if rng.rand() < 0.7:
+            earliest = max(position - 10, 0) if reply_to_latest else 0
+            parent_ids[position] = 't1_' + comment_ids[rng.randint(earliest, position)]
+    if num_comments > 1:
+        parent_ids[-1] = 't1_missing'
+    return pd.DataFrame({
+        'comment_id': comment_ids,
+        'parent_id': parent_ids,
+        'post_id': 'p',
+        'author': AUTHORS[rng.randint(len(AUTHORS), size=num_comments)],
+    })
+
+
+def get_state(comment_frame: pd.DataFrame, max_comments: int = 500000) -> LiveThreadState:
+    state = LiveThreadState('p', max_comments=max_comments)
+    for row in comment_frame.to_dict('records'):
+        state.add(row)
+    return state
+
+
+def get_expected_features(comment_frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    The features of the PostFeatureBuilders for the top level comments of comment_frame
+    """
+    thread_index = Common.ThreadIndex(comment_frame)
+    top_level_frame = thread_index.get_top_level_comments().reset_index(drop=True)
+    return pd.concat([
+        CommentNetworkFeatureBuilder(comment_frame, thread_index).get_features_for_frame(top_level_frame),
+        PostUserFeatureBuilder(comment_frame, thread_index).get_features_for_frame(top_level_frame)
+        .drop(columns=['comment_id']),
+        ReplyGraphFeatureBuilder(comment_frame, thread_index).get_features_for_frame(top_level_frame)
+    ], axis=1).set_index(top_level_frame.comment_id)
+
+
+def get_reply_counts(comment_frame: pd.DataFrame) -> Counter:
+    authors = dict(zip(comment_frame.comment_id, comment_frame.author))
+    return Counter((author, authors[parent_id[3:]]) for author, parent_id in zip(comment_frame.author,
+                                                                                  comment_frame.parent_id)
+                   if parent_id[3:] in authors and isinstance(author, str)
+                   and isinstance(authors[parent_id[3:]], str) and author != authors[parent_id[3:]])
+
+
+def assert_features_equal(state: LiveThreadState, comment_frame: pd.DataFrame):
+    expected = get_expected_features(comment_frame)
+    for comment_id, expected_row in expected.iterrows():
+        row = comment_frame[comment_frame.comment_id == comment_id].iloc[0].to_dict()
+        features = state.get_features(row)
+        assert set(features) == set(expected.columns)
+        for column, value in expected_row.items():
+            assert features[column] == pytest.approx(value), (comment_id, column)
+
+
+@pytest.mark.parametrize('num_comments,seed', [(1, 0), (80, 1), (400, 2)])
+def test_live_features_match_the_builders(num_comments, seed):
+    comment_frame = generate_comment_frame(num_comments, seed)
+    state = get_state(comment_frame)
+    assert len(state) == num_comments
+    assert state.reply_counts == get_reply_counts(comment_frame)
+    assert_features_equal(state, comment_frame)
+
+
+def test_replayed_comments_are_ignored():
+    comment_frame = generate_comment_frame(50, 3)
+    state = get_state(pd.concat([comment_frame, comment_frame.iloc[::3]], ignore_index=True))
+    assert len(state) == 50
+    assert_features_equal(state, comment_frame)
+
+
+def get_tracked_frame(state: LiveThreadState, comment_frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    The comments of comment_frame the state still tracks, the replies to evicted comments have a missing parent
+    """
+    return comment_frame[comment_frame.comment_id.isin(state.comment_roots)].reset_index(drop=True)
+
+
+def test_eviction_bounds_the_tracked_comments():
+    comment_frame = generate_comment_frame(1000, 4, reply_to_latest=True)
+    state = LiveThreadState('p', max_comments=100)
+    for position, row in enumerate(comment_frame.to_dict('records')):
+        state.add(row)
+        assert len(state) <= 100 or len(state.threads) == 1
+    assert len(state.threads) < len(comment_frame[comment_frame.parent_id == 't3_p'])
+    tracked_frame = get_tracked_frame(state, comment_frame)
+    assert state.reply_counts == get_reply_counts(tracked_frame)
+    # The per author counts only have the comments that are still tracked
+    assert state.total_comment_counts == Counter(tracked_frame.author.dropna())
+    assert state.top_level_comment_counts == Counter(tracked_frame.author[tracked_frame.parent_id == 't3_p'].dropna())
+    assert_features_equal(state, tracked_frame)
+    thread_metrics = CommentNetworkFeatureBuilder.get_thread_metrics_frame(Common.ThreadIndex(tracked_frame))
+    for root, thread in state.threads.items():
+        assert thread_metrics.loc[root].tolist() == [thread.top_level_count, thread.max_depth, thread.size]
+        assert set(thread.comment_ids) == {comment_id for comment_id, (thread_root, _, _) in
+                                           state.comment_roots.items() if thread_root == root}
+
+
+def test_reply_to_an_evicted_thread_starts_a_new_one():
+    state = LiveThreadState('p', max_comments=2)
+    state.add({'comment_id': 'a', 'parent_id': 't3_p', 'author': 'x'})
+    state.add({'comment_id': 'b', 'parent_id': 't1_a', 'author': 'y'})
+    state.add({'comment_id': 'c', 'parent_id': 't3_p', 'author': 'z'})
+    assert list(state.threads) == ['c'] and 'a' not in state.comment_roots
+    assert state.reply_counts == Counter()
+    assert state.total_comment_counts == Counter({'z': 1}) and state.top_level_comment_counts == Counter({'z': 1})
+    state.add({'comment_id': 'd', 'parent_id': 't1_b', 'author': 'x'})
+    assert state.comment_roots['d'] == ('d', 0, 'x')
+    assert state.threads['d'].size == 0
+
+
+class UserExtractor:
+    """
+    Crawls every author at once, but the account of deleted is deleted
+    """
+    database = None
+
+    def __init__(self):
+        self.crawled_authors = []
+        self.failures = []
+
+    def get_user_predictors_for_author(self, author: str):
+        self.crawled_authors.append(author)
+        if author == 'deleted':
+            return None, {"author": author, "status": "deleted"}
+        return {"author": author, "user_total_comment_karma": 10}, None
+
+    def record_failure(self, failure: dict):
+        self.failures.append(failure)
+
+
+def get_scorer() -> LiveScorer:
+    scorer = LiveScorer.__new__(LiveScorer)     # Without the reddit instances
+    scorer.userExtractor = UserExtractor()
+    scorer.user_executor = ThreadPoolExecutor(max_workers=2)
+    scorer.user_rows = LRUCache(10)
+    scorer.pending_authors = set()
+    scorer.history_before_utc = 1553288400.0
+    scorer.batch_size = 10
+    scorer.batch_wait_seconds = 0.01
+    return scorer
+
+
+def test_new_authors_get_default_rows_until_they_are_crawled():
+    scorer = get_scorer()
+
+    async def score_twice():
+        scorer.user_queue = asyncio.Queue(maxsize=2)   # Created on the loop of asyncio.run
+        first = await scorer.get_user_rows(['a', 'deleted', 'b', None])   # b doesn't fit in the queue
+        crawler = asyncio.ensure_future(scorer.crawl_users())
+        while len(scorer.pending_authors) > 0:
+            await asyncio.sleep(0.01)
+        second = await scorer.get_user_rows(['a', 'deleted', 'b'])
+        crawler.cancel()
+        return first, second
+
+    first, second = asyncio.run(score_twice())
+    assert [(row['author'], row['user_total_comment_karma']) for row in first] == [('a', 0), ('deleted', 0), ('b', 0)]
+    assert first[0]['subreddit_post_count'] == {} and first[0]['history_before_utc'] == scorer.history_before_utc
+    assert sorted(scorer.userExtractor.crawled_authors) == ['a', 'deleted']
+    assert scorer.userExtractor.failures == [{"author": 'deleted', "status": 'deleted'}]
+    # The deleted account is left out, b is queued now
+    assert [(row['author'], row['user_total_comment_karma']) for row in second] == [('a', 10), ('b', 0)]
+    assert scorer.pending_authors == {'b'} and scorer.user_queue.qsize() == 1
@@ -0,0 +1,344 @@
+"""
+    Benchmarks the hot paths on synthetic posts of growing size and reports the time and the peak memory of each.
+
+        python -m Benchmarks.benchScript --sizes 1000 5000 20000 50000 --output bench.json
+        python -m Benchmarks.benchScript --only network_features text_features --sizes 50000 --branching-factor 2
+
+    Every benchmark of a size works on the same synthetic post (see `Benchmarks.synthetic`), generated before any of
+    them is timed. The best of --repeats runs is kept. Peak memory is measured with tracemalloc in one more run, it
+    covers the python and numpy allocations of the benchmark. Between two sizes the growth exponent
+    log(t2 / t1) / log(n2 / n1) is reported, 1 is linear, benchmarks growing faster than --max-exponent are flagged.
+
+    The pushshift and extractor benchmarks run against a local `FakeApiServer`, the extractors need praw and are
+    skipped without it. The compact_* benchmarks run the same code on the compact form of the post (see
+    `Analysis.CompactFrame`), the description of every post compares the memory of its id columns in both forms.
+"""
+import gc
+import json
+import math
+import time
+import asyncio
+import argparse
+import tracemalloc
+from collections import OrderedDict
+from typing import Callable, Dict, List
+from Analysis import Common
+from Analysis.CompactFrame import compact_comment_frame, get_id_memory_usage
+from Analysis.FeatureBuilder import CommentNetworkFeatureBuilder, CommentTextFeatureBuilder, PostFeatureBuilder, \
+    PostUserFeatureBuilder, ReplyGraphFeatureBuilder, SubredditFeatureBuilder, UserFeatureBuilder
+from Analysis.featureGenScript import build_user_feature_frame, join_user_features
+from Ingest.pushShift import PushShift, AsyncPushShift
+from Ingest.ratelimit import enable_scheduler
+from Benchmarks.fakeApi import FakeApiServer
+from Benchmarks.synthetic import POST_ID, POST_CREATION_TIME, generate_comment_frame, generate_user_frame, \
+    to_pushshift_comments
+
+MIN_SECONDS_FOR_EXPONENT = 0.01     # Below, timer noise dominates the growth exponent
+UNLIMITED_REQUESTS_PER_SECOND = 1e6     # The fake API server has no rate limit
+
+
+class SyntheticPost:
+    """
+    The frames, and the fake API server, shared by the benchmarks of one size
+    """
+
+    def __init__(self, num_comments: int, generator_kwargs: Dict, subreddit_vocabulary_size: int,
+                 api_latency_seconds: float = 0.0):
+        self.num_comments = num_comments
+        self.comment_frame = generate_comment_frame(num_comments, **generator_kwargs)
+        self.thread_index = Common.get_thread_index(self.comment_frame)
+        self.top_level_frame = Common.get_top_level_comments(self.comment_frame, self.thread_index).reset_index(drop=True)
+        self.compact_post = None
+        self.user_frame = generate_user_frame(self.comment_frame.author.dropna().unique(),
+                                              subreddit_vocabulary_size=subreddit_vocabulary_size,
+                                              seed=generator_kwargs.get('seed', 0))
+        self.api_latency_seconds = api_latency_seconds
+        self.api_server = None
+
+    def get_compact(self) -> 'SyntheticPost':
+        """
+        The same post with its frames in the compact form
+        """
+        if self.compact_post is None:
+            self.compact_post = SyntheticPost.__new__(SyntheticPost)
+            self.compact_post.__dict__.update(self.__dict__)
+            self.compact_post.comment_frame = compact_comment_frame(self.comment_frame)
+            self.compact_post.thread_index = Common.get_thread_index(self.compact_post.comment_frame)
+            self.compact_post.top_level_frame = self.compact_post.thread_index.get_top_level_comments() \
+                .reset_index(drop=True)
+        return self.compact_post
+
+    def get_api_server(self) -> FakeApiServer:
+        if self.api_server is None:
+            self.api_server = FakeApiServer(self.comment_frame, self.user_frame,
+                                            latency_seconds=self.api_latency_seconds).__enter__()
+        return self.api_server
+
+    def close(self):
+        if self.api_server is not None:
+            self.api_server.__exit__(None, None, None)
+
+    def describe(self) -> Dict:
+        return {
+            "comments": self.num_comments,
+            "top_level_comments": len(self.top_level_frame),
+            "authors": len(self.user_frame),
+            "max_depth": int(self.thread_index.depths.max()) if self.num_comments > 0 else 0,
+            "id_columns_mb": get_id_memory_usage(self.comment_frame) / 2 ** 20,
+            "compact_id_columns_mb": get_id_memory_usage(self.get_compact().comment_frame) / 2 ** 20
+        }
+
+
+# Every benchmark prepares its inputs from a SyntheticPost and returns the function that is timed
+
+def bench_thread_index(post: SyntheticPost) -> Callable:
+    return lambda: Common.get_thread_index(post.comment_frame)
+
+
+def bench_compact_frame(post: SyntheticPost) -> Callable:
+    return lambda: compact_comment_frame(post.comment_frame)
+
+
+def bench_flattened_thread(post: SyntheticPost) -> Callable:
+    """
+    The 100 oldest, and largest, threads with a prebuilt index
+    """
+    root_ids = list(Common.get_comment_keys(post.top_level_frame)[:100])
+    return lambda: [Common.get_flattened_thread_under_parent_id(post.comment_frame, root_id, post.thread_index)
+                    for root_id in root_ids]
+
+
+def bench_post_user_features(post: SyntheticPost) -> Callable:
+    return lambda: PostUserFeatureBuilder(post.comment_frame, post.thread_index) \
+        .get_features_for_frame(post.top_level_frame)
+
+
+def bench_network_features(post: SyntheticPost) -> Callable:
+    return lambda: CommentNetworkFeatureBuilder(post.comment_frame, post.thread_index) \
+        .get_features_for_frame(post.top_level_frame)
+
+
+def bench_reply_graph_features(post: SyntheticPost) -> Callable:
+    return lambda: ReplyGraphFeatureBuilder(post.comment_frame, post.thread_index) \
+        .get_features_for_frame(post.top_level_frame)
+
+
+def bench_text_features(post: SyntheticPost) -> Callable:
+    commentTextFeatureBuilder = CommentTextFeatureBuilder(exclusion_wordlist_fname=Common.Constants.EXCLUSION_WLIST)
+
+    def run():
+        commentTextFeatureBuilder.spelling_engine.verdicts.entries.clear()     # Every run starts from a cold memo
+        return commentTextFeatureBuilder.get_features_for_bodies(post.top_level_frame.body, workers=1)
+    return run
+
+
+def bench_subreddit_features(post: SyntheticPost) -> Callable:
+    return lambda: SubredditFeatureBuilder.get_features_for_frame(post.user_frame)
+
+
+def bench_user_features(post: SyntheticPost) -> Callable:
+    return lambda: UserFeatureBuilder(POST_CREATION_TIME).get_features_for_frame(post.user_frame)
+
+
+def bench_post_features(post: SyntheticPost) -> Callable:
+    return lambda: PostFeatureBuilder(post.comment_frame, post_timestamp=POST_CREATION_TIME) \
+        .get_features_for_frame(post.top_level_frame, workers=1)
+
+
+def bench_join(post: SyntheticPost) -> Callable:
+    """
+    featureGenScript's keyed join, the post_feature_frame only has the network features, the join only depends on the
+    authors and the number of columns
+    """
+    post_feature_frame = post.top_level_frame.join(bench_network_features(post)())
+    user_feature_frame = build_user_feature_frame(post.user_frame, POST_CREATION_TIME)
+    return lambda: join_user_features(post_feature_frame, user_feature_frame)
+
+
+def on_compact_post(bench: Callable) -> Callable:
+    return lambda post: bench(post.get_compact())
+
+
+def bench_pushshift(post: SyntheticPost) -> Callable:
+    server = post.get_api_server()
+
+    def run():
+        with server.redirect_pushshift():
+            return PushShift.get_comments_for_submission_id(POST_ID)
+    return run
+
+
+def bench_async_pushshift(post: SyntheticPost) -> Callable:
+    server = post.get_api_server()
+
+    def run():
+        with AsyncPushShift(concurrency=8, path=f'{server.url}/reddit') as pushshift:
+            return asyncio.run(pushshift.get_comments_for_submission_id(POST_ID))
+    return run
+
+
+def bench_comment_extractor(post: SyntheticPost) -> Callable:
+    from Ingest.extractors import CommentExtractor  # praw is only needed by the extractor benchmarks
+    server = post.get_api_server()
+    commentExtractor = CommentExtractor(no_caching=True, database_fname=None, reddit_kwargs=server.reddit_kwargs)
+    submission = commentExtractor.reddit.submission(id=POST_ID)
+    pshift_comments = to_pushshift_comments(post.comment_frame)
+    return lambda: commentExtractor.extract_comments(pshift_comments, submission)
+
+
+def bench_user_extractor(post: SyntheticPost, history_backend: str = "pushshift") -> Callable:
+    """
+    Crawls the authors of the top level comments, the users a dataset needs
+    """
+    from Ingest.extractors import UserExtractor
+    server = post.get_api_server()
+    userExtractor = UserExtractor(workers=8, requests_per_second=10000, no_caching=True, database_fname=None,
+                                  reddit_kwargs=server.reddit_kwargs, history_backend=history_backend,
+                                  history_before_utc=POST_CREATION_TIME.timestamp())
+    authors = list(post.top_level_frame.author.dropna().unique())
+
+    def run():
+        with server.redirect_pushshift():
+            return userExtractor.get_frame_for_authors(authors)
+    return run
+
+
+def bench_user_extractor_listing(post: SyntheticPost) -> Callable:
+    return bench_user_extractor(post, history_backend="listing")
+
+
+BENCHMARKS = OrderedDict([
+    ("thread_index", bench_thread_index),
+    ("flattened_thread", bench_flattened_thread),
+    ("post_user_features", bench_post_user_features),
+    ("network_features", bench_network_features),
+    ("reply_graph_features", bench_reply_graph_features),
+    ("text_features", bench_text_features),
+    ("subreddit_features", bench_subreddit_features),
+    ("user_features", bench_user_features),
+    ("post_features", bench_post_features),
+    ("join", bench_join),
+    ("compact_frame", bench_compact_frame),
+    ("compact_thread_index", on_compact_post(bench_thread_index)),
+    ("compact_flattened_thread", on_compact_post(bench_flattened_thread)),
+    ("compact_post_user_features", on_compact_post(bench_post_user_features)),
+    ("compact_network_features", on_compact_post(bench_network_features)),
+    ("compact_reply_graph_features", on_compact_post(bench_reply_graph_features)),
+    ("compact_join", on_compact_post(bench_join)),
+    ("pushshift", bench_pushshift),
+    ("async_pushshift", bench_async_pushshift),
+    ("comment_extractor", bench_comment_extractor),
+    ("user_extractor", bench_user_extractor),
+    ("user_extractor_listing", bench_user_extractor_listing),
+])
+
+
+def measure(run: Callable, repeats: int) -> Dict:
+    """
+    :return: The best time of repeats runs, and the tracemalloc peak of one more run
+    """
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": peak / 2 ** 20}
+
+
+def get_exponent(previous: Dict, result: Dict) -> float:
+    if previous is None or min(previous['seconds'], result['seconds']) < MIN_SECONDS_FOR_EXPONENT:
+        return None
+    return math.log(result['seconds'] / previous['seconds']) / math.log(result['size'] / previous['size'])
+
+
+def run_benchmarks(sizes: List[int], names: List[str], repeats: int = 3, generator_kwargs: Dict = None,
+                   subreddit_vocabulary_size: int = 1000, api_latency_seconds: float = 0.0,
+                   max_exponent: float = 1.3) -> Dict:
+    """
+    :return: The report, a result per benchmark and size
+    """
+    generator_kwargs = generator_kwargs if generator_kwargs is not None else {}
+    enable_scheduler(reddit_requests_per_second=UNLIMITED_REQUESTS_PER_SECOND,
+                     pushshift_requests_per_second=UNLIMITED_REQUESTS_PER_SECOND)
+    results, posts, skipped = [], [], {}
+    previous_results = {}
+    for size in sorted(sizes):
+        post = SyntheticPost(size, generator_kwargs, subreddit_vocabulary_size, api_latency_seconds)
+        posts.append(post.describe())
+        print(f"Post of {size} comments: {posts[-1]}")
+        try:
+            for name in names:
+                if name in skipped:
+                    continue
+                try:
+                    run = BENCHMARKS[name](post)
+                except ImportError as e:
+                    skipped[name] = repr(e)
+                    print(f"Skipping {name}: {e}")
+                    continue
+                result = {"benchmark": name, "size": size, **measure(run, repeats)}
+                result["exponent"] = get_exponent(previous_results.get(name), result)
+                result["superlinear"] = result["exponent"] is not None and result["exponent"] > max_exponent
+                previous_results[name] = result
+                results.append(result)
+                print(format_result(result))
+        finally:
+            post.close()
+    superlinear = sorted({result["benchmark"] for result in results if result["superlinear"]})
+    if len(superlinear) > 0:
+        print(f"Growing faster than n^{max_exponent}: {superlinear}")
+    return {
+        "generated_utc": time.time(),
+        "config": {"sizes": sorted(sizes), "repeats": repeats, "generator": generator_kwargs,
+                   "subreddit_vocabulary_size": subreddit_vocabulary_size, "api_latency_seconds": api_latency_seconds,
+                   "max_exponent": max_exponent},
+        "posts": posts,
+        "results": results,
+        "skipped": skipped,
+        "superlinear": superlinear
+    }
+
+
+def format_result(result: Dict) -> str:
+    exponent = f"n^{result['exponent']:.2f}" if result['exponent'] is not None else ""
+    flag = "  <- superlinear" if result['superlinear'] else ""
+    return f"{result['benchmark']:<30} {result['size']:>8} {result['seconds']:>10.4f}s {result['peak_mb']:>9.1f}MB " \
+        f"{exponent:>8}{flag}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths on synthetic posts of growing size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000, 50000], help="Comments per post")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help="JSON file the report is written to")
+    parser.add_argument('--branching-factor', type=int, default=5, help="Maximum replies to a comment")
+    parser.add_argument('--depth-decay', type=float, default=0.6, help="P(depth = d) ~ depth_decay ** d")
+    parser.add_argument('--author-reuse', type=float, default=0.7, help="Share of comments by returning authors")
+    parser.add_argument('--subreddit-vocabulary-size', type=int, default=1000)
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="Latency of every fake API response")
+    parser.add_argument('--max-exponent', type=float, default=1.3, help="Growth exponent flagged as superlinear")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    report = run_benchmarks(args.sizes, args.only, repeats=args.repeats, generator_kwargs={
+        "branching_factor": args.branching_factor,
+        "depth_decay": args.depth_decay,
+        "author_reuse": args.author_reuse,
+        "seed": args.seed
+    }, subreddit_vocabulary_size=args.subreddit_vocabulary_size, api_latency_seconds=args.api_latency_ms / 1000,
+        max_exponent=args.max_exponent)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
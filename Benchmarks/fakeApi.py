@@ -0,0 +1,234 @@
+"""
+    Local HTTP server answering the PushShift and reddit API requests the extractors make from synthetic frames, so
+    that `PushShift`, `AsyncPushShift` and the Extractors can be benchmarked offline.
+
+        with FakeApiServer(comment_frame, user_frame, latency_seconds=0.01) as server:
+            with server.redirect_pushshift():
+                comments = PushShift.get_comments_for_submission_id(POST_ID)
+            extractor = CommentExtractor(no_caching=True, database_fname=None, reddit_kwargs=server.reddit_kwargs)
+
+    PushShift
+        /reddit/submission/comment_ids/{post_id}    /reddit/comment/search?ids=
+        /reddit/search/submission?author=&before=&size=     /reddit/search/comment?author=&before=&size=
+    reddit
+        /api/v1/access_token    /api/info?id=    /comments/{post_id}    /user/{name}/about
+        /user/{name}/submitted    /user/{name}/comments
+
+    Users of the user_frame have a submission (comment) per post (comment) counted in their subreddit dicts, authors
+    missing from it answer 404 like deleted accounts. Listings are served in a single page, an hour apart before the
+    post, newest first.
+"""
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+from pandas import DataFrame as Df
+from Analysis.Common import Constants
+from Benchmarks.synthetic import POST_ID, POST_CREATION_TIME, to_pushshift_comments
+
+
+class FakeApiServer:
+
+    def __init__(self, comment_frame: Df, user_frame: Df = None, latency_seconds: float = 0.0, port: int = 0):
+        """
+        :param latency_seconds: Added to every response, to simulate the network
+        :param port: 0 picks a free port
+        """
+        self.pushshift_comments = {comment['id']: comment for comment in to_pushshift_comments(comment_frame)}
+        self.comment_ids_by_post = {}
+        for comment in self.pushshift_comments.values():
+            self.comment_ids_by_post.setdefault(comment['link_id'].split('_', 1)[1], []).append(comment['id'])
+        self.users = {row['author']: row for row in user_frame.to_dict('records')} if user_frame is not None else {}
+        self.latency_seconds = latency_seconds
+        self.request_counts = Counter()
+        self.lock = threading.Lock()
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', port), self.get_handler_class())
+        self.http_server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.http_server.server_address[1]}'
+
+    @property
+    def reddit_kwargs(self) -> Dict:
+        """
+        praw.Reddit keyword arguments that point an instance to the server, see `Extractor`
+        """
+        return {"oauth_url": self.url, "reddit_url": self.url}
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    @contextmanager
+    def redirect_pushshift(self):
+        """
+        Points `PushShift` (and the AsyncPushShift clients created by the CommentExtractor) to the server
+        """
+        from Ingest.pushShift import PushShift
+        path = PushShift.PATH
+        PushShift.PATH = f'{self.url}/reddit'
+        try:
+            yield
+        finally:
+            PushShift.PATH = path
+
+    def get_handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # Keep-alive, like the real APIs
+
+            def do_GET(self):
+                self.respond(*server.route('GET', self.path))
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.respond(*server.route('POST', self.path))
+
+            def respond(self, status: int, content):
+                body = json.dumps(content).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def route(self, method: str, path: str):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        url = urlparse(path)
+        parts = [part for part in url.path.split('/') if part != '']
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if len(parts) == 0:
+            return self.count('not_found', 404, {"message": "Not Found", "error": 404})
+        if method == 'POST' and parts[-1] == 'access_token':
+            return self.count('access_token', 200, {
+                "access_token": "benchmark", "expires_in": 3600, "scope": "*", "token_type": "bearer"
+            })
+        if parts[:3] == ['reddit', 'submission', 'comment_ids']:
+            return self.count('pushshift_comment_ids', 200, {"data": self.comment_ids_by_post.get(parts[3], [])})
+        if parts[:3] == ['reddit', 'comment', 'search']:
+            comment_ids = params.get('ids', '').split(',')
+            return self.count('pushshift_comment_search', 200, {"data": [
+                self.pushshift_comments[comment_id] for comment_id in comment_ids if comment_id in self.pushshift_comments
+            ]})
+        if parts[:2] == ['reddit', 'search'] and len(parts) >= 3:
+            user = self.users.get(params.get('author'))
+            history = self.get_user_history(user, parts[2]) if user is not None else []
+            before = int(params['before']) if 'before' in params else None
+            items = [item for item in history if before is None or item['created_utc'] < before]
+            return self.count(f'pushshift_search_{parts[2]}', 200, {"data": items[:int(params.get('size', 25))]})
+        if parts[:2] == ['api', 'info']:
+            fullnames = params.get('id', '').split(',')
+            return self.count('reddit_info', 200, self.get_listing('t1', [
+                self.get_praw_comment(fullname.split('_', 1)[1]) for fullname in fullnames
+                if fullname.split('_', 1)[-1] in self.pushshift_comments
+            ]))
+        if parts[0] == 'comments':
+            return self.count('reddit_submission', 200, [
+                self.get_listing('t3', [self.get_submission(parts[1])]), self.get_listing('t1', [])
+            ])
+        if parts[0] == 'user' and len(parts) >= 3:
+            user = self.users.get(parts[1])
+            if user is None:
+                return self.count('reddit_user_not_found', 404, {"message": "Not Found", "error": 404})
+            if parts[2] == 'about':
+                return self.count('reddit_user_about', 200, {"kind": "t2", "data": self.get_redditor(user)})
+            if parts[2] == 'submitted':
+                return self.count('reddit_user_submitted', 200, self.get_listing('t3', self.get_user_history(
+                    user, 'submission')))
+            if parts[2] == 'comments':
+                return self.count('reddit_user_comments', 200, self.get_listing('t1', self.get_user_history(
+                    user, 'comment')))
+        return self.count('not_found', 404, {"message": "Not Found", "error": 404})
+
+    def count(self, request_type: str, status: int, content):
+        with self.lock:
+            self.request_counts[request_type] += 1
+        return status, content
+
+    @classmethod
+    def get_listing(cls, kind: str, children: List[Dict]) -> Dict:
+        return {"kind": "Listing", "data": {
+            "children": [{"kind": kind, "data": child} for child in children],
+            "after": None, "before": None, "dist": len(children), "modhash": None
+        }}
+
+    def get_praw_comment(self, comment_id: str) -> Dict:
+        comment = self.pushshift_comments[comment_id]
+        return {
+            "id": comment_id,
+            "name": Constants.COMMENT_PREFIX + comment_id,
+            "body": comment['body'],
+            "author": comment['author'],
+            "edited": False,
+            "gilded": 0,
+            "score": comment['score'],
+            "score_hidden": comment['score'] == Constants.SCORE_HIDDEN,
+            "parent_id": comment['parent_id'],
+            "link_id": comment['link_id'],
+            "created_utc": comment['created_utc'],
+            "subreddit": comment['subreddit']
+        }
+
+    @classmethod
+    def get_submission(cls, post_id: str) -> Dict:
+        return {
+            "id": post_id,
+            "name": Constants.POST_PREFIX + post_id,
+            "author": "submitter",
+            "title": "Synthetic megathread",
+            "subreddit": "politics",
+            "created_utc": POST_CREATION_TIME.timestamp(),
+            "num_comments": 0
+        }
+
+    @classmethod
+    def get_redditor(cls, user: Dict) -> Dict:
+        return {
+            "name": user['author'],
+            "id": user['author'],
+            "comment_karma": user['user_total_comment_karma'],
+            "link_karma": user['user_total_post_karma'],
+            "has_verified_email": user['user_email_verified'],
+            "created_utc": user['user_account_creation_utc'].timestamp()
+        }
+
+    @classmethod
+    def get_user_history(cls, user: Dict, kind: str) -> List[Dict]:
+        """
+        :param kind: submission or comment
+        """
+        measure = "post" if kind == "submission" else "comment"
+        return cls.get_history(user[f'subreddit_{measure}_count'], user[f'subreddit_{measure}_karma'])
+
+    @classmethod
+    def get_history(cls, subreddit_counts: Dict[str, int], subreddit_karma: Dict[str, int]) -> List[Dict]:
+        """
+        A post (comment) per count, the karma of a subreddit is put on its first item
+        """
+        history = [{
+            "subreddit": subreddit,
+            "score": subreddit_karma.get(subreddit, 0) if index == 0 else 0,
+            "score_hidden": False
+        } for subreddit, count in subreddit_counts.items() for index in range(count)]
+        for index, item in enumerate(history):
+            item["id"] = f"h{index}"
+            item["created_utc"] = int(POST_CREATION_TIME.timestamp()) - 3600 * (index + 1)
+        return history
@@ -0,0 +1,108 @@
+"""
+    Measures how long importing the modules scripts and pool workers start from takes, each in a fresh interpreter, and
+    checks it against a budget. None of them may import a heavy dependency, those are loaded on first use.
+
+        python -m Benchmarks.importBudget --repeats 5 --output import_budget.json
+
+    The best of --repeats imports is kept. The slowest direct imports of every module come from `python -X importtime`.
+    Exits with 1 if a module is over its budget or imports a heavy dependency.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import OrderedDict
+from typing import Dict, List
+
+# Seconds, pandas alone takes about half of each
+IMPORT_BUDGETS = OrderedDict([
+    ('Analysis.Common', 1.0),
+    ('Analysis.FeatureBuilder', 1.25),
+    ('Ingest.extractors', 1.5),
+])
+HEAVY_MODULES = ['praw', 'profanity_check', 'sklearn', 'textblob', 'nltk', 'spellchecker', 'scipy', 'xgboost',
+                 'pyarrow']
+BASELINE_MODULE = 'pandas'  # Heavy modules pandas imports by itself (e.g pyarrow for newer versions) aren't charged
+IMPORT_CODE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module: str) -> Dict:
+    """
+    Imports module in a fresh interpreter
+    :return: seconds, the modules loaded afterwards and the -X importtime lines of the import
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_CODE.format(module=module)],
+                             cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise ImportError(f"Couldn't import {module}: {process.stderr.strip().splitlines()[-1]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["importtime"] = [line for line in process.stderr.splitlines() if line.startswith('import time:')]
+    return result
+
+
+def get_slowest_imports(importtime_lines: List[str], top: int = 5) -> List[Dict]:
+    """
+    The direct imports of the measured module taking the longest, including their own imports
+    :param importtime_lines: e.g "import time:       812 |      41250 |   numpy", nesting is indented by 2 spaces
+    """
+    imports = []
+    for line in importtime_lines:
+        _, cumulative_us, name = line.split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1 and cumulative_us.strip().isdigit():
+            imports.append({"module": name.strip(), "seconds": int(cumulative_us) / 1e6})
+    return sorted(imports, key=lambda entry: -entry["seconds"])[:top]
+
+
+def check_import_budgets(budgets: Dict[str, float], repeats: int = 3) -> Dict:
+    report = OrderedDict()
+    baseline_modules = {loaded.split('.')[0] for loaded in measure_import(BASELINE_MODULE)["modules"]}
+    for module, budget_seconds in budgets.items():
+        try:
+            results = [measure_import(module) for _ in range(repeats)]
+        except ImportError as e:
+            print(f"{module:<28} skipped, {e}")
+            report[module] = {"error": str(e)}
+            continue
+        best = min(results, key=lambda result: result["seconds"])
+        loaded_modules = {loaded.split('.')[0] for loaded in best["modules"]}.difference(baseline_modules)
+        heavy_modules = sorted(loaded_modules.intersection(HEAVY_MODULES))
+        within_budget = best["seconds"] <= budget_seconds and len(heavy_modules) == 0
+        report[module] = {
+            "seconds": best["seconds"],
+            "budget_seconds": budget_seconds,
+            "heavy_modules": heavy_modules,
+            "slowest_imports": get_slowest_imports(best["importtime"]),
+            "within_budget": within_budget
+        }
+        slowest = ', '.join(f"{entry['module']} {entry['seconds']:.3f}s" for entry in report[module]["slowest_imports"])
+        print(f"{module:<28} {best['seconds']:.3f}s of {budget_seconds:.2f}s  {'ok' if within_budget else 'OVER'}"
+              f"{'  imports ' + ', '.join(heavy_modules) if len(heavy_modules) > 0 else ''}  ({slowest})")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the import time of the modules against their budget")
+    parser.add_argument('--only', nargs='+', choices=list(IMPORT_BUDGETS), default=list(IMPORT_BUDGETS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help="JSON file the report is written to")
+    args = parser.parse_args()
+    report = check_import_budgets(OrderedDict((module, IMPORT_BUDGETS[module]) for module in args.only),
+                                  repeats=args.repeats)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if any(not result.get("within_budget", True) for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
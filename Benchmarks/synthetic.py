@@ -0,0 +1,189 @@
+"""
+    Synthetic comment_frames and user_frames shaped like the megathreads, for the benchmarks.
+
+        comment_frame = generate_comment_frame(50000, branching_factor=5, depth_decay=0.6, author_reuse=0.7)
+        user_frame = generate_user_frame(comment_frame.author.dropna().unique(), subreddit_vocabulary_size=5000)
+
+    The frames have the columns and dtypes of the frames written by the extractors and are the same for the same seed.
+"""
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from pandas import DataFrame as Df
+from Analysis.Common import Constants
+
+POST_ID = 'b4agza'
+POST_CREATION_TIME = pd.Timestamp('2019-03-22 21:00:00')
+# Mix of dictionary words, misspellings, profanity, user references, citations and urls, so that every text feature
+# has something to find
+WORDS = np.array([
+    'the', 'report', 'mueller', 'collusion', 'congress', 'barr', 'summary', 'obstruction', 'evidence', 'president',
+    'senate', 'investigation', 'redacted', 'indictment', 'is', 'not', 'what', 'they', 'said', 'about', 'a', 'of',
+    'damn', 'hell', 'teh', 'definately', 'recieve', 'goverment', 'u/spez', '>quoted', 'http://www.example.com/news',
+    '(https://en.wikipedia.org/wiki/Special_counsel)', 'lol', 'exonerated', 'subpoena', 'impeach', 'witchhunt'
+])
+
+
+def generate_comment_frame(num_comments: int, branching_factor: int = 5, depth_decay: float = 0.6,
+                           max_depth: int = 20, author_reuse: float = 0.7, deleted_fraction: float = 0.02,
+                           mean_words: int = 25, seed: int = 0) -> Df:
+    """
+    Grows a reply forest one comment at a time, in creation order.
+    :param branching_factor: Maximum number of direct replies to a comment
+    :param depth_decay: The depth of a comment is drawn with P(depth = d) proportional to depth_decay ** d, the
+    lower the flatter the post. A comment whose level is full goes one level up, depth 0 is a top level comment.
+    :param max_depth: Deepest reply chain
+    :param author_reuse: Probability that a comment is written by an author who already commented. Earlier authors
+    are picked more often, so a few authors write many comments each
+    :param deleted_fraction: Comments whose author deleted their account (author is NaN)
+    :param mean_words: Mean number of words of a body
+    """
+    rng = np.random.RandomState(seed)
+    depth_weights = depth_decay ** np.arange(max_depth + 1)
+    depths = rng.choice(max_depth + 1, size=num_comments, p=depth_weights / depth_weights.sum())
+    open_parents = [[] for _ in range(max_depth + 1)]   # Per depth, positions of the comments with room for replies
+    reply_counts = np.zeros(num_comments, dtype=np.int64)
+    parent_positions = np.full(num_comments, -1, dtype=np.int64)
+    for position in range(num_comments):
+        depth = depths[position]
+        while depth > 0 and len(open_parents[depth - 1]) == 0:
+            depth -= 1
+        if depth > 0:
+            candidates = open_parents[depth - 1]
+            slot = rng.randint(len(candidates))
+            parent = candidates[slot]
+            parent_positions[position] = parent
+            reply_counts[parent] += 1
+            if reply_counts[parent] >= branching_factor:    # Swap remove
+                candidates[slot] = candidates[-1]
+                candidates.pop()
+        depths[position] = depth
+        if branching_factor > 0 and depth < max_depth:
+            open_parents[depth].append(position)
+    comment_ids = np.array([np.base_repr(position + 36 ** 6, 36).lower() for position in range(num_comments)],
+                           dtype=object)
+    parent_ids = np.where(parent_positions >= 0, Constants.COMMENT_PREFIX + comment_ids[np.maximum(parent_positions, 0)],
+                          Constants.POST_PREFIX + POST_ID)
+    return Df({
+        "author": get_authors(rng, num_comments, author_reuse, deleted_fraction),
+        "body": get_bodies(rng, num_comments, mean_words),
+        "comment_created_utc": POST_CREATION_TIME + pd.to_timedelta(
+            np.cumsum(rng.exponential(2.0, size=num_comments)), unit='s'
+        ),
+        "comment_deleted": rng.random_sample(num_comments) < 0.01,
+        "comment_id": comment_ids,
+        "comment_removed_by_mods": rng.random_sample(num_comments) < 0.01,
+        "edited": rng.random_sample(num_comments) < 0.05,
+        "golds": rng.poisson(0.02, size=num_comments),
+        "is_submitter": np.zeros(num_comments, dtype=bool),
+        "parent_id": parent_ids,
+        "post_id": POST_ID,
+        "score": get_scores(rng, num_comments),
+    })
+
+
+def get_authors(rng: np.random.RandomState, num_comments: int, author_reuse: float,
+                deleted_fraction: float) -> np.ndarray:
+    authors = np.empty(num_comments, dtype=object)
+    reuses = rng.random_sample(num_comments) < author_reuse
+    picks = rng.random_sample(num_comments)
+    num_authors = 0
+    for position in range(num_comments):
+        if reuses[position] and num_authors > 0:
+            # The k-th of n authors is picked with a probability ~ 1 / sqrt(k n)
+            authors[position] = f'user_{int(picks[position] ** 2 * num_authors)}'
+        else:
+            authors[position] = f'user_{num_authors}'
+            num_authors += 1
+    authors[rng.random_sample(num_comments) < deleted_fraction] = np.nan
+    return authors
+
+
+def get_bodies(rng: np.random.RandomState, num_comments: int, mean_words: int) -> np.ndarray:
+    word_counts = rng.geometric(1 / mean_words, size=num_comments)
+    words = WORDS[rng.randint(len(WORDS), size=word_counts.sum())]
+    ends = np.cumsum(word_counts)
+    return np.array([' '.join(words[end - count:end]) for count, end in zip(word_counts, ends)], dtype=object)
+
+
+def get_scores(rng: np.random.RandomState, num_comments: int) -> np.ndarray:
+    """
+    Heavy tailed around a small positive score, so both labels of `Model.gen_model_for` occur
+    """
+    scores = np.round(rng.standard_t(2, size=num_comments) * 8 + 3).astype(np.float64)
+    scores[rng.random_sample(num_comments) < 0.05] = Constants.SCORE_HIDDEN
+    return scores
+
+
+def get_subreddit_vocabulary(size: int) -> List[str]:
+    """
+    The partisan subreddits, r/politics and r/news first, padded with made up subreddits up to size
+    """
+    with open(Constants.PARTISAN_RESOURCE) as json_data:
+        partisan_resource = json.load(json_data)
+    known = list(dict.fromkeys(['politics', 'news'] + [subreddit for subreddits in partisan_resource.values()
+                                                        for subreddit in subreddits]))
+    return (known + [f'subreddit_{index}' for index in range(max(size - len(known), 0))])[:size]
+
+
+def generate_user_frame(authors: List[str], subreddit_vocabulary_size: int = 1000, mean_subreddits: int = 8,
+                        seed: int = 0) -> Df:
+    """
+    A row per author, with the columns of `UserExtractor.get_all_user_predictors`.
+    :param subreddit_vocabulary_size: Number of distinct subreddits users are active in, subreddits are picked with a
+    zipf like popularity so a few are shared by most users
+    :param mean_subreddits: Mean number of draws from the vocabulary per user, draws of the same subreddit collapse
+    """
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array(get_subreddit_vocabulary(subreddit_vocabulary_size), dtype=object)
+    popularity = np.cumsum(1 / np.arange(1, len(vocabulary) + 1))
+    popularity /= popularity[-1]
+    rows = []
+    for author in authors:
+        comment_counts = get_subreddit_counts(rng, vocabulary, popularity, mean_subreddits)
+        post_counts = get_subreddit_counts(rng, vocabulary, popularity, max(mean_subreddits // 4, 1))
+        rows.append({
+            "author": author,
+            "user_total_comment_karma": int(rng.randint(-100, 50000)),
+            "user_total_post_karma": int(rng.randint(0, 5000)),
+            "user_email_verified": bool(rng.random_sample() < 0.6),
+            "user_account_creation_utc": POST_CREATION_TIME - pd.Timedelta(seconds=int(rng.randint(3600, 10 ** 9))),
+            "subreddit_post_karma": {subreddit: int(count * rng.randint(-5, 100)) for subreddit, count in
+                                     post_counts.items()},
+            "subreddit_post_count": post_counts,
+            "user_total_post_count": sum(post_counts.values()),
+            "subreddit_comment_karma": {subreddit: int(count * rng.randint(-5, 30)) for subreddit, count in
+                                        comment_counts.items()},
+            "subreddit_comment_count": comment_counts,
+            "user_total_comment_count": sum(comment_counts.values()),
+        })
+    return Df(rows)
+
+
+def get_subreddit_counts(rng: np.random.RandomState, vocabulary: np.ndarray, popularity: np.ndarray,
+                         mean_subreddits: int) -> Dict[str, int]:
+    """
+    :param popularity: Cumulative popularity of the subreddits of vocabulary
+    """
+    positions = np.searchsorted(popularity, rng.random_sample(rng.poisson(mean_subreddits)))
+    return {subreddit: int(rng.geometric(0.1)) for subreddit in vocabulary[np.unique(positions)]}
+
+
+def to_pushshift_comments(comment_frame: Df) -> List[Dict]:
+    """
+    The comments as PushShift's comment search returns them
+    """
+    return [{
+        "id": comment_id,
+        "body": body,
+        "author": author if isinstance(author, str) else "[deleted]",
+        "link_id": Constants.POST_PREFIX + post_id,
+        "parent_id": parent_id,
+        "created_utc": int(created_utc.timestamp()),
+        "score": int(score),
+        "subreddit": "politics"
+    } for comment_id, body, author, post_id, parent_id, created_utc, score in zip(
+        comment_frame.comment_id, comment_frame.body, comment_frame.author, comment_frame.post_id,
+        comment_frame.parent_id, comment_frame.comment_created_utc, comment_frame.score
+    )]
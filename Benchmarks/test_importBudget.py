@@ -0,0 +1,61 @@
+import sys
+import json
+import subprocess
+import pytest
+from Benchmarks.importBudget import BASELINE_MODULE, HEAVY_MODULES, IMPORT_BUDGETS, REPO_DIR, get_slowest_imports, \
+    measure_import
+
+LAZY_IMPORT_CODE = """
+import sys, json
+import pandas as pd
+from Analysis.FeatureBuilder import SubredditFeatureBuilder
+before = sorted(sys.modules)
+SubredditFeatureBuilder.get_features_for_frame(pd.DataFrame({'author': ['a'], **{
+    measure: [{'politics': 1}] for measure in ['subreddit_post_count', 'subreddit_post_karma',
+                                               'subreddit_comment_count', 'subreddit_comment_karma']}}))
+print(json.dumps({"before": before, "after": sorted(sys.modules)}))
+"""
+
+
+def get_top_level_modules(modules: list) -> set:
+    return {module.split('.')[0] for module in modules}
+
+
+@pytest.fixture(scope='module')
+def baseline_modules() -> set:
+    return get_top_level_modules(measure_import(BASELINE_MODULE)["modules"])
+
+
+@pytest.mark.parametrize('module', list(IMPORT_BUDGETS))
+def test_module_imports_no_heavy_dependency(module, baseline_modules):
+    try:
+        result = measure_import(module)
+    except ImportError as e:
+        pytest.skip(str(e))
+    assert result["seconds"] > 0
+    heavy_modules = get_top_level_modules(result["modules"]).difference(baseline_modules).intersection(HEAVY_MODULES)
+    assert heavy_modules == set()
+
+
+def test_heavy_dependency_is_imported_on_first_use(baseline_modules):
+    pytest.importorskip('scipy')
+    if 'scipy' in baseline_modules:
+        pytest.skip(f"{BASELINE_MODULE} imports scipy by itself")
+    process = subprocess.run([sys.executable, '-c', LAZY_IMPORT_CODE], cwd=REPO_DIR, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    assert 'scipy' not in get_top_level_modules(result["before"])
+    assert 'scipy' in get_top_level_modules(result["after"])
+
+
+def test_slowest_imports_are_the_direct_ones():
+    importtime_lines = [
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |     _io',
+        'import time:       812 |      41250 |   numpy',
+        'import time:        50 |       2000 |   json',
+        'import time:       300 |      90000 | Analysis.Common',
+    ]
+    assert get_slowest_imports(importtime_lines, top=1) == [{"module": "numpy", "seconds": 0.04125}]
+    assert [entry["module"] for entry in get_slowest_imports(importtime_lines)] == ['numpy', 'json']
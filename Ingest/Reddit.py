@@ -1,19 +1,139 @@
+import copy
 import json
-import praw
+import requests
+from urllib.parse import urlparse
+from prawcore import Requestor
 from Analysis.Common import Constants
+from Ingest.ratelimit import RateBudget, get_scheduler
+from Ingest.cache import ResponseCache, CacheMissError, get_default_cache
+from Ingest.instrumentation import get_instrumentation
 
 
-def get_reddit_instance(config_json_fname: str = Constants.CONFIG_FNAME):
+class BudgetedRequestor(Requestor):
+    """
+    prawcore Requestor that takes a token from a shared RateBudget before every request. Pass it to
+    `get_reddit_instance` as requestor_class, with requestor_kwargs={"budget": budget}. The wait for a token is timed
+    under api.reddit.budget_wait and the request under api.reddit.<request type>.
+
+    The rate limit headers of the responses adapt the budget and are removed afterwards, so that prawcore doesn't
+    sleep on them as well. A 429 pauses the budget for its Retry-After (or the reset of the window).
+    """
+    RATELIMIT_HEADERS = ('x-ratelimit-remaining', 'x-ratelimit-used', 'x-ratelimit-reset')
+
+    def __init__(self, *args, budget: RateBudget = None, **kwargs):
+        super(BudgetedRequestor, self).__init__(*args, **kwargs)
+        self.budget = budget
+
+    def request(self, method, url, *args, **kwargs):
+        instrumentation = get_instrumentation()
+        if self.budget is not None:
+            with instrumentation.timer('api.reddit.budget_wait'):
+                self.budget.acquire()
+        with instrumentation.timer(f'api.reddit.{self.get_request_type(url)}'):
+            response = super(BudgetedRequestor, self).request(method, url, *args, **kwargs)
+        if response.status_code != 200:
+            instrumentation.count(f'api.reddit.status_{response.status_code}')
+        if self.budget is not None:
+            self.update_budget(response)
+        return response
+
+    def update_budget(self, response):
+        if response.status_code == 429:
+            retry_after = response.headers.get('retry-after', response.headers.get(RateBudget.RESET_HEADER, 1))
+            try:
+                self.budget.pause(float(retry_after))
+            except ValueError:
+                self.budget.pause(1.0)
+        elif self.budget.update_from_headers(response.headers):
+            for header in self.RATELIMIT_HEADERS:
+                response.headers.pop(header, None)
+
+    @classmethod
+    def get_request_type(cls, url: str) -> str:
+        """
+        e.g user_comments for https://oauth.reddit.com/user/{name}/comments, submission for /comments/{id}
+        """
+        parts = [part for part in urlparse(url).path.split('/') if part != '']
+        if len(parts) == 0:
+            return 'other'
+        if parts[-1] == 'access_token':
+            return 'access_token'
+        if parts[0] in ('user', 'u') and len(parts) >= 3:
+            return f'user_{parts[2]}'
+        if parts[0] == 'comments':
+            return 'submission'
+        if parts[:2] == ['api', 'info']:
+            return 'info'
+        return parts[0]
+
+
+class CachingRequestor(BudgetedRequestor):
+    """
+    BudgetedRequestor that reads GET requests through a ResponseCache. Cache hits don't use the request budget.
+    In offline mode the OAuth token request is answered with a placeholder token and nothing hits the network.
+    """
+
+    def __init__(self, *args, cache: ResponseCache = None, **kwargs):
+        super(CachingRequestor, self).__init__(*args, **kwargs)
+        self.cache = cache
+
+    def request(self, method, url, *args, **kwargs):
+        if self.cache is None:
+            return super(CachingRequestor, self).request(method, url, *args, **kwargs)
+        if method.upper() != 'GET':
+            if not self.cache.offline:
+                return super(CachingRequestor, self).request(method, url, *args, **kwargs)
+            if url.endswith('access_token'):
+                return self.get_offline_token_response()
+            raise CacheMissError(f"Can't {method} {url} while the cache is offline")
+        key = ResponseCache.get_key(method, url, kwargs.get('params'), kwargs.get('data'))
+        response = self.cache.get(key)
+        if response is not None:
+            get_instrumentation().count('api.reddit.cache_hits')
+            for header in self.RATELIMIT_HEADERS:   # Stale rate limits would make prawcore sleep
+                response.headers.pop(header, None)
+            return response
+        response = super(CachingRequestor, self).request(method, url, *args, **kwargs)
+        if response.status_code == 200:
+            cached_response = copy.copy(response)
+            cached_response.request = None  # Don't write the bearer token to disk
+            self.cache.put(key, cached_response)
+        return response
+
+    @classmethod
+    def get_offline_token_response(cls) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['content-type'] = 'application/json'
+        response._content = json.dumps({
+            "access_token": "offline", "expires_in": 3600, "scope": "*", "token_type": "bearer"
+        }).encode('utf-8')
+        return response
+
+
+def get_reddit_instance(config_json_fname: str = Constants.CONFIG_FNAME, budget: RateBudget = None,
+                        cache: ResponseCache = None, **reddit_kwargs):
     """
     Given path to a file containing the credentials for reddit API's client_id, secret, user agent. This will return
     the praw instance.
     :param config_json_fname:
+    :param budget: Request budget shared with other instances, defaults to the reddit budget of the process's
+    `RequestScheduler`
+    :param cache: Response cache, defaults to the one set by `Ingest.cache.enable_cache`
+    :param reddit_kwargs: Passed on to praw.Reddit
     :return:
     """
+    cache = cache if cache is not None else get_default_cache()
+    budget = budget if budget is not None else get_scheduler().get_budget('reddit')
+    # Always through the CachingRequestor, which passes requests through without a cache, for the instrumentation
+    reddit_kwargs.setdefault('requestor_class', CachingRequestor)
+    reddit_kwargs.setdefault('requestor_kwargs', {"budget": budget, "cache": cache})
+    import praw     # Imported with the first instance, praw's models take a while to import
     with open(config_json_fname) as json_data:
         config_creds = json.load(json_data)
         json_data.close()
     reddit = praw.Reddit(client_id=config_creds['client_id'],
                          client_secret=config_creds['client_secret'],
-                         user_agent=config_creds['user_agent'])
+                         user_agent=config_creds['user_agent'],
+                         **reddit_kwargs)
     return reddit
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from typing import Optional
+from Analysis.Common import Constants
+
+
+class CacheMissError(ConnectionError):
+    """
+    Raised in offline mode when a request isn't in the cache
+    """
+
+
+class ResponseCache:
+    """
+        Content addressed on-disk cache of API responses.
+
+        Entries are keyed by the sha256 of the request (method, url, params, data) and stored as one pickle per key.
+            ttl_seconds     entries older than this are refetched, None keeps them forever
+            max_bytes       when the cache grows past this, the least recently used entries are evicted
+            offline         only serve from the cache, a miss raises CacheMissError and nothing hits the network.
+                            Expired entries are still served in offline mode.
+
+        Enable it process wide with `enable_cache`, PushShift and the praw instances from `get_reddit_instance` then
+        read through it.
+    """
+    EVICT_TO_FRACTION = 0.9
+
+    def __init__(self, directory: str = Constants.CACHE_DIR, ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 max_bytes: int = 1024 ** 3, offline: bool = False):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(os.path.getsize(path) for path, _ in self.list_entries())
+
+    @classmethod
+    def get_key(cls, method: str, url: str, params=None, data=None) -> str:
+        request = json.dumps([method.upper(), url, params, data], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.pkl')
+
+    def get(self, key: str):
+        """
+        Returns the cached response for key, None if it's missing or expired
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                created_at, response = pickle.load(entry_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            if self.offline:
+                raise CacheMissError(f"{key} is not cached and the cache is offline")
+            return None
+        if not self.offline and self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds:
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)  # The modification time is the recency used for LRU eviction
+        except OSError:
+            pass
+        return response
+
+    def put(self, key: str, response):
+        if self.offline:
+            return
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as entry_file:
+            pickle.dump((time.time(), response), entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(path) - previous_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is back under EVICT_TO_FRACTION of max_bytes
+        """
+        entries = sorted(self.list_entries(), key=lambda entry: entry[1])
+        for path, _ in entries:
+            if self.total_bytes <= self.max_bytes * self.EVICT_TO_FRACTION:
+                break
+            self.total_bytes -= self.remove(path)
+
+    def remove(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def list_entries(self):
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for fname in os.listdir(shard_path):
+                if fname.endswith('.pkl'):
+                    path = os.path.join(shard_path, fname)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+
+_default_cache = None
+
+
+def enable_cache(directory: str = Constants.CACHE_DIR, ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 max_bytes: int = 1024 ** 3, offline: bool = False) -> ResponseCache:
+    """
+    Makes PushShift and every praw instance created by `get_reddit_instance` afterwards read through the same cache.
+    """
+    global _default_cache
+    _default_cache = ResponseCache(directory, ttl_seconds=ttl_seconds, max_bytes=max_bytes, offline=offline)
+    return _default_cache
+
+
+def disable_cache():
+    global _default_cache
+    _default_cache = None
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    return _default_cache
@@ -0,0 +1,89 @@
+import os
+import pickle
+from typing import List, Dict, Iterator, Set, Tuple
+from pandas import DataFrame as Df
+
+# What unpickling a torn or corrupt segment raises, besides EOFError and UnpicklingError
+UNPICKLING_ERRORS = (EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError, IndexError, KeyError,
+                     TypeError)
+
+
+class CheckpointLog:
+    """
+        Append-only checkpoint log of extracted rows.
+
+        Every checkpoint appends one pickled segment holding only the rows added since the previous checkpoint, so the
+        cost of a checkpoint is proportional to the new rows and not to everything extracted so far. On restart the
+        segments are read back in order to find the rows that were already extracted, and they are compacted into the
+        final frame with `to_frame`.
+
+        A segment that was only partially written (the process died mid write), or is corrupt, is dropped when reading
+        together with everything after it. Before its first append the log is truncated to its last good segment, so
+        the segments appended after a crash can be read back.
+    """
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.is_repaired = False
+
+    def append(self, rows: List[Dict]):
+        if len(rows) == 0:
+            return
+        if not self.is_repaired:
+            self.repair()
+        with open(self.fname, 'ab') as log_file:
+            pickle.dump(rows, log_file, protocol=pickle.HIGHEST_PROTOCOL)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+    def read_segments(self) -> Iterator[List[Dict]]:
+        for segment, _ in self.read_segments_with_offsets():
+            yield segment
+
+    def read_segments_with_offsets(self) -> Iterator[Tuple[List[Dict], int]]:
+        """
+        The segments up to the first torn or corrupt one, each with the offset its segment ends at
+        """
+        if not os.path.exists(self.fname):
+            return
+        with open(self.fname, 'rb') as log_file:
+            while True:
+                try:
+                    segment = pickle.load(log_file)
+                except UNPICKLING_ERRORS:
+                    return
+                yield segment, log_file.tell()
+
+    def repair(self):
+        """
+        Truncates the log after its last good segment
+        """
+        if os.path.exists(self.fname):
+            good_size = 0
+            for _, end_offset in self.read_segments_with_offsets():
+                good_size = end_offset
+            if good_size < os.path.getsize(self.fname):
+                print(f"Truncating {self.fname} to its last good segment, at {good_size} bytes")
+                with open(self.fname, 'r+b') as log_file:
+                    log_file.truncate(good_size)
+        self.is_repaired = True
+
+    def load_rows(self) -> List[Dict]:
+        rows = []
+        for segment in self.read_segments():
+            rows += segment
+        return rows
+
+    def get_processed_keys(self, key: str) -> Set:
+        """
+        Returns the values of `key` in every logged row, e.g the comment_ids or authors already extracted.
+        """
+        return {row[key] for segment in self.read_segments() for row in segment if key in row}
+
+    def to_frame(self) -> Df:
+        return Df(self.load_rows())
+
+    def clear(self):
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+        self.is_repaired = True
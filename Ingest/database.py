@@ -0,0 +1,320 @@
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Iterable, Optional, Set
+from pandas import DataFrame as Df
+from Analysis.Common import Constants
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    post_id TEXT PRIMARY KEY,
+    author TEXT,
+    subreddit TEXT,
+    title TEXT,
+    created_utc REAL,
+    fetched_utc REAL
+);
+CREATE TABLE IF NOT EXISTS comments (
+    comment_id TEXT PRIMARY KEY,
+    post_id TEXT,
+    parent_id TEXT,
+    author TEXT,
+    body TEXT,
+    edited INTEGER,
+    golds INTEGER,
+    score REAL,
+    comment_removed_by_mods INTEGER,
+    comment_deleted INTEGER,
+    is_submitter INTEGER,
+    comment_created_utc REAL
+);
+CREATE INDEX IF NOT EXISTS comments_parent_id ON comments (parent_id);
+CREATE INDEX IF NOT EXISTS comments_author ON comments (author);
+CREATE INDEX IF NOT EXISTS comments_post_id ON comments (post_id);
+CREATE TABLE IF NOT EXISTS users (
+    author TEXT,
+    user_total_comment_karma INTEGER,
+    user_total_post_karma INTEGER,
+    user_email_verified INTEGER,
+    user_account_creation_utc REAL,
+    user_total_post_count INTEGER,
+    user_total_comment_count INTEGER,
+    history_before_utc REAL NOT NULL,
+    fetched_utc REAL,
+    PRIMARY KEY (author, history_before_utc)
+);
+CREATE TABLE IF NOT EXISTS user_subreddit_aggregates (
+    author TEXT,
+    history_before_utc REAL NOT NULL,
+    subreddit TEXT,
+    post_count INTEGER,
+    post_karma INTEGER,
+    comment_count INTEGER,
+    comment_karma INTEGER,
+    PRIMARY KEY (author, history_before_utc, subreddit)
+);
+CREATE INDEX IF NOT EXISTS user_subreddit_aggregates_author ON user_subreddit_aggregates (author);
+"""
+
+COMMENT_COLUMNS = ['comment_id', 'post_id', 'parent_id', 'author', 'body', 'edited', 'golds', 'score',
+                   'comment_removed_by_mods', 'comment_deleted', 'is_submitter', 'comment_created_utc']
+COMMENT_BOOL_COLUMNS = ['edited', 'comment_removed_by_mods', 'comment_deleted', 'is_submitter']
+USER_COLUMNS = ['author', 'user_total_comment_karma', 'user_total_post_karma', 'user_email_verified',
+                'user_account_creation_utc', 'user_total_post_count', 'user_total_comment_count', 'history_before_utc']
+# Column of the aggregates table -> dict column of the user_frame
+AGGREGATE_COLUMNS = {
+    'post_count': 'subreddit_post_count',
+    'post_karma': 'subreddit_post_karma',
+    'comment_count': 'subreddit_comment_count',
+    'comment_karma': 'subreddit_comment_karma',
+}
+MAX_SQL_VARIABLES = 900     # SQLite's default limit is 999 bound variables per statement
+NO_HISTORY_CUTOFF = -1.0    # history_before_utc of the users whose whole history was crawled, NULLs can't be keys
+
+
+class Database:
+    """
+        Embedded SQLite store of the submissions, comments and user histories of every post, shared across posts.
+
+        The extractors upsert into it, `Common.load_comment_frame` / `Common.load_user_frame` fall back to it when
+        there is no frame file for a post. Upserts are keyed by post_id, comment_id and author, so writing the same
+        rows twice leaves the store unchanged. Users are keyed by author and by the history_before_utc their history was
+        crawled up to, authors stored with the cutoff of a UserExtractor aren't crawled again by it.
+
+        Comments are indexed by parent_id, author and post_id, the per user per subreddit aggregates by author, so
+        reply tree and per author lookups are indexed queries:
+            database.get_replies_to('t1_ej5l32l'), database.get_comments_by_author('santaKlaus')
+
+        A connection is opened per thread, writes are serialized by SQLite.
+    """
+
+    def __init__(self, fname: str = Constants.DATABASE_FNAME):
+        self.fname = fname
+        self.thread_local = threading.local()
+        directory = os.path.dirname(fname)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self.migrate_users_without_cutoff()
+        self.get_connection().executescript(SCHEMA)
+
+    def migrate_users_without_cutoff(self):
+        """
+        Stores created before the users were keyed by history_before_utc have a single row per author. Those histories
+        were crawled without a cutoff, the rows are moved into the current tables as whole histories
+        (NO_HISTORY_CUTOFF).
+        """
+        connection = self.get_connection()
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(users)')]
+        if len(columns) == 0 or 'history_before_utc' in columns:
+            return
+        print(f"Migrating the users of {self.fname}, their histories are stored as whole histories")
+        user_columns = ', '.join(column for column in USER_COLUMNS + ['fetched_utc'] if column != 'history_before_utc')
+        aggregate_columns = ', '.join(['author', 'subreddit'] + list(AGGREGATE_COLUMNS))
+        has_aggregates = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_subreddit_aggregates'"
+        ).fetchone() is not None
+        connection.isolation_level = None   # The statements run in one explicit transaction
+        try:
+            connection.execute('BEGIN')
+            connection.execute('DROP INDEX IF EXISTS user_subreddit_aggregates_author')
+            connection.execute('ALTER TABLE users RENAME TO legacy_users')
+            if has_aggregates:
+                connection.execute('ALTER TABLE user_subreddit_aggregates RENAME TO legacy_user_subreddit_aggregates')
+            for statement in SCHEMA.split(';'):
+                connection.execute(statement)
+            connection.execute(f'INSERT INTO users ({user_columns}, history_before_utc) '
+                               f'SELECT {user_columns}, ? FROM legacy_users', (NO_HISTORY_CUTOFF,))
+            connection.execute('DROP TABLE legacy_users')
+            if has_aggregates:
+                connection.execute(f'INSERT INTO user_subreddit_aggregates ({aggregate_columns}, history_before_utc) '
+                                   f'SELECT {aggregate_columns}, ? FROM legacy_user_subreddit_aggregates',
+                                   (NO_HISTORY_CUTOFF,))
+                connection.execute('DROP TABLE legacy_user_subreddit_aggregates')
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.isolation_level = ''
+
+    @classmethod
+    def exists(cls, fname: str = Constants.DATABASE_FNAME) -> bool:
+        return os.path.exists(fname)
+
+    def get_connection(self) -> sqlite3.Connection:
+        if not hasattr(self.thread_local, 'connection'):
+            connection = sqlite3.connect(self.fname, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')   # Readers don't block the writer
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.thread_local.connection = connection
+        return self.thread_local.connection
+
+    def query(self, sql: str, params: Iterable = ()) -> Df:
+        return pd.read_sql_query(sql, self.get_connection(), params=list(params))
+
+    def query_in_chunks(self, sql: str, values: List, params: Iterable = ()) -> Df:
+        """
+        Runs sql, which has a single `{}` placeholder for an IN list, over values in chunks of bound variables
+        :param params: Bound before the values of every chunk, for the placeholders preceding the IN list
+        """
+        frames = []
+        for start in range(0, len(values), MAX_SQL_VARIABLES):
+            chunk = values[start:start + MAX_SQL_VARIABLES]
+            frames.append(self.query(sql.format(', '.join('?' * len(chunk))), list(params) + chunk))
+        return pd.concat(frames, ignore_index=True) if len(frames) > 0 else self.query(sql.format('NULL'), params)
+
+    def upsert_submission(self, post_id: str, author: str = None, subreddit: str = None, title: str = None,
+                          created_utc: float = None):
+        with self.get_connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?)',
+                (post_id, author, subreddit, title, created_utc, time.time())
+            )
+
+    def upsert_comments(self, comment_frame: Df):
+        """
+        Inserts the rows of a comment_frame, comments that are already stored are replaced
+        """
+        frame = comment_frame.reindex(columns=COMMENT_COLUMNS)
+        frame['comment_created_utc'] = self.to_epoch_seconds(frame['comment_created_utc'])
+        with self.get_connection() as connection:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO comments VALUES ({", ".join("?" * len(COMMENT_COLUMNS))})',
+                self.to_records(frame)
+            )
+
+    def upsert_users(self, user_rows: List[Dict]):
+        """
+        Inserts the rows of a user_frame (as built by `UserExtractor.get_all_user_predictors`). The subreddit
+        aggregates of a stored user are replaced as a whole, subreddits missing from the new row are removed. Rows
+        without history_before_utc are stored as whole histories.
+        """
+        if len(user_rows) == 0:
+            return
+        user_frame = Df(user_rows).reindex(columns=USER_COLUMNS)
+        user_frame['user_account_creation_utc'] = self.to_epoch_seconds(user_frame['user_account_creation_utc'])
+        user_frame['history_before_utc'] = user_frame['history_before_utc'].astype(float).fillna(NO_HISTORY_CUTOFF)
+        user_frame['fetched_utc'] = time.time()
+        aggregates = []
+        for user_row, history_before_utc in zip(user_rows, user_frame['history_before_utc']):
+            subreddits = {}
+            for column, dict_column in AGGREGATE_COLUMNS.items():
+                for subreddit, value in (user_row.get(dict_column) or {}).items():
+                    subreddits.setdefault(subreddit, dict.fromkeys(AGGREGATE_COLUMNS, 0))[column] = value
+            aggregates += [(user_row['author'], history_before_utc, subreddit, *values.values())
+                           for subreddit, values in subreddits.items()]
+        with self.get_connection() as connection:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO users ({", ".join(USER_COLUMNS)}, fetched_utc) '
+                f'VALUES ({", ".join("?" * (len(USER_COLUMNS) + 1))})',
+                self.to_records(user_frame)
+            )
+            connection.executemany('DELETE FROM user_subreddit_aggregates WHERE author = ? AND history_before_utc = ?',
+                                   self.to_records(user_frame[['author', 'history_before_utc']]))
+            connection.executemany('INSERT INTO user_subreddit_aggregates VALUES (?, ?, ?, ?, ?, ?, ?)', aggregates)
+
+    def has_comments(self, post_id: str) -> bool:
+        return self.get_connection().execute(
+            'SELECT 1 FROM comments WHERE post_id = ? LIMIT 1', (post_id,)
+        ).fetchone() is not None
+
+    def get_stored_authors(self, authors: List[str], history_before_utc: Optional[float] = None) -> Set[str]:
+        """
+        Returns the authors of authors whose history up to history_before_utc (None for the whole history) is already
+        in the store
+        """
+        return set(self.query_in_chunks('SELECT author FROM users WHERE history_before_utc = ? AND author IN ({})',
+                                        list(authors), params=[self.to_history_cutoff(history_before_utc)]).author)
+
+    def load_comment_frame(self, post_id: str) -> Df:
+        return self.to_comment_frame(self.query('SELECT * FROM comments WHERE post_id = ?', (post_id,)))
+
+    def get_replies_to(self, parent_id: str) -> Df:
+        """
+        :param parent_id: Fullname of the parent, t1_ for comments and t3_ for posts
+        """
+        return self.to_comment_frame(self.query('SELECT * FROM comments WHERE parent_id = ?', (parent_id,)))
+
+    def get_comments_by_author(self, author: str, post_id: str = None) -> Df:
+        if post_id is None:
+            return self.to_comment_frame(self.query('SELECT * FROM comments WHERE author = ?', (author,)))
+        return self.to_comment_frame(self.query(
+            'SELECT * FROM comments WHERE author = ? AND post_id = ?', (author, post_id)
+        ))
+
+    def load_user_frame(self, authors: List[str] = None, post_id: str = None,
+                        history_before_utc: Optional[float] = None) -> Df:
+        """
+        Returns the user_frame of the authors, or of the authors who commented in post_id, or of every stored user.
+        Only the users whose history was crawled up to history_before_utc (None for the whole history) are loaded, so
+        every author has at most one row.
+        """
+        history_cutoff = self.to_history_cutoff(history_before_utc)
+        if post_id is not None:
+            users = self.query('SELECT * FROM users WHERE history_before_utc = ? '
+                               'AND author IN (SELECT author FROM comments WHERE post_id = ?)', (history_cutoff, post_id))
+        elif authors is not None:
+            users = self.query_in_chunks('SELECT * FROM users WHERE history_before_utc = ? AND author IN ({})',
+                                         list(authors), params=[history_cutoff])
+        else:
+            users = self.query('SELECT * FROM users WHERE history_before_utc = ?', (history_cutoff,))
+        aggregates = self.query_in_chunks(
+            'SELECT * FROM user_subreddit_aggregates WHERE history_before_utc = ? AND author IN ({})',
+            list(users.author), params=[history_cutoff]
+        )
+        return self.to_user_frame(users, aggregates)
+
+    def get_user_rows(self, authors: List[str], history_before_utc: Optional[float] = None) -> List[Dict]:
+        """
+        The stored users as rows of `UserExtractor.get_all_user_predictors`, only those whose history was crawled up
+        to history_before_utc (None for the whole history)
+        """
+        return self.load_user_frame(authors=authors, history_before_utc=history_before_utc).to_dict('records')
+
+    @classmethod
+    def to_comment_frame(cls, comments: Df) -> Df:
+        comments = comments.reindex(columns=COMMENT_COLUMNS)
+        for column in COMMENT_BOOL_COLUMNS:
+            comments[column] = comments[column].astype(bool)
+        comments['comment_created_utc'] = pd.to_datetime(comments['comment_created_utc'], unit='s')
+        return comments
+
+    @classmethod
+    def to_user_frame(cls, users: Df, aggregates: Df) -> Df:
+        users = users.reindex(columns=USER_COLUMNS)
+        users['user_email_verified'] = users['user_email_verified'].astype(bool)
+        users['user_account_creation_utc'] = pd.to_datetime(users['user_account_creation_utc'], unit='s')
+        user_keys = list(zip(users.author, users.history_before_utc))
+        for column, dict_column in AGGREGATE_COLUMNS.items():
+            # The post (comment) dicts of a user only have the subreddits the user posted (commented) in
+            count_column = column.split('_')[0] + '_count'
+            listed = aggregates[aggregates[count_column] > 0]
+            dicts = {user_key: dict(zip(rows.subreddit, rows[column].astype(int).tolist()))
+                     for user_key, rows in listed.groupby(['author', 'history_before_utc'])}
+            users[dict_column] = [dicts.get(user_key, {}) for user_key in user_keys]
+        # Whole histories are NaN in user_frames, like the rows of a UserExtractor without history_before_utc
+        users['history_before_utc'] = users['history_before_utc'].astype(float) \
+            .where(users['history_before_utc'] != NO_HISTORY_CUTOFF)
+        return users
+
+    @classmethod
+    def to_history_cutoff(cls, history_before_utc: Optional[float]) -> float:
+        return NO_HISTORY_CUTOFF if history_before_utc is None else float(history_before_utc)
+
+    @classmethod
+    def to_epoch_seconds(cls, timestamps: pd.Series) -> pd.Series:
+        timestamps = pd.to_datetime(timestamps)
+        seconds = timestamps.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+        return pd.Series(np.where(timestamps.isnull(), np.nan, seconds), index=timestamps.index)
+
+    @classmethod
+    def to_records(cls, frame: Df) -> List[tuple]:
+        """
+        Converts a frame into tuples of python scalars sqlite3 can bind, NaN becomes NULL
+        """
+        frame = frame.astype(object).where(frame.notnull(), None)
+        return [tuple(value.item() if isinstance(value, np.generic) else value for value in row)
+                for row in frame.itertuples(index=False, name=None)]
@@ -1,29 +1,82 @@
-from praw.reddit import models
-from prawcore.exceptions import *
+import math
+import time
+import asyncio
+import threading
+import numpy as np
+import pandas as pd
 from collections import Counter
-from praw.models import Redditor
-from Ingest.Reddit import *
-from Ingest.pushShift import *
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from pandas import DataFrame as Df
+from prawcore.exceptions import PrawcoreException, NotFound, Forbidden, ServerError, RequestException
+from Analysis.Common import Constants
+from Ingest.Reddit import get_reddit_instance
+from Ingest.ratelimit import Priority, get_scheduler, request_priority
+from Ingest.pushShift import PushShift, AsyncPushShift
+from Ingest.checkpoints import CheckpointLog
+from Ingest.database import Database
+from Ingest.instrumentation import get_instrumentation
+if TYPE_CHECKING:   # praw itself is imported by get_reddit_instance, when the first instance is created
+    from praw.reddit import models
+    from praw.models import Redditor
 
 
 class Extractor:
-    def __init__(self, no_caching: bool = False, checkpoint_interval: int = 100):
+    def __init__(self, no_caching: bool = False, checkpoint_interval: int = 100,
+                 database_fname: Optional[str] = Constants.DATABASE_FNAME, reddit_kwargs: Dict = None):
         """
         :param checkpoint_interval: Saves the data every interval count rows
+        :param database_fname: SQLite store the extracted rows are upserted into, None to only write pickles
+        :param reddit_kwargs: Passed on to every praw instance, e.g the urls of a local server
         """
         self.cp_fname = "checkpoint_extractor_frame"    # Overriden by child class
-        self.reddit = get_reddit_instance()
+        self.reddit_kwargs = reddit_kwargs if reddit_kwargs is not None else {}
+        self.reddit = get_reddit_instance(**self.reddit_kwargs)
+        self.database = Database(database_fname) if database_fname is not None else None
         self.last_saved_at_index = 0
+        self.last_saved_row_count = 0
         self.save_cp_interval = checkpoint_interval
         self.no_caching = no_caching
+        self.checkpoint_log = None
+
+    def resume_from_checkpoint(self, checkpoint_name: str) -> List[Dict]:
+        """
+        Opens the append-only checkpoint log `{checkpoint_name}.log` and returns the rows a previous run already
+        extracted into it. Subsequent checkpoints only append the rows added after these.
+        """
+        self.checkpoint_log = CheckpointLog(f'{checkpoint_name}.log')
+        rows = [] if self.no_caching else self.checkpoint_log.load_rows()
+        self.last_saved_at_index = 0
+        self.last_saved_row_count = len(rows)
+        if len(rows) > 0:
+            print(f"Resuming from {len(rows)} rows in {self.checkpoint_log.fname}")
+        return rows
 
     def save_checkpoint_if_needed(self, cursor_index: int, rows: List[Dict]):
         if self.no_caching:
             return
         if cursor_index - self.last_saved_at_index >= self.save_cp_interval:
-            Df(rows).to_pickle(f'{self.cp_fname}.pkl')
+            self.save_checkpoint(rows)
             self.last_saved_at_index = cursor_index
 
+    def save_checkpoint(self, rows: List[Dict]):
+        """
+        Appends the rows added since the last checkpoint to the checkpoint log
+        """
+        if self.no_caching:
+            return
+        if self.checkpoint_log is None:
+            self.checkpoint_log = CheckpointLog(f'{self.cp_fname}.log')
+        self.checkpoint_log.append(rows[self.last_saved_row_count:])
+        self.last_saved_row_count = len(rows)
+
+    def clear_checkpoint(self):
+        """
+        Call once the final frame has been written, the log is compacted into it
+        """
+        if self.checkpoint_log is not None:
+            self.checkpoint_log.clear()
+
 
 class CommentExtractor(Extractor):
     """
@@ -39,9 +92,15 @@ class CommentExtractor(Extractor):
         If comment was removed by mods, you can still see the comment body but the author shows up as  an empty string
         If comment was removed by the user himself, the whole row is empty
     """
-    def __init__(self, **kwargs):
+    PRAW_INFO_BATCH_SIZE = 100  # Max number of fullnames reddit resolves in one info request
+
+    def __init__(self, pushshift_concurrency: int = 1, **kwargs):
+        """
+        :param pushshift_concurrency: Number of concurrent PushShift requests, >1 uses the AsyncPushShift client
+        """
         Extractor.__init__(self, **kwargs)
         self.cp_fname = "checkpoint_comment_frame"
+        self.pushshift_concurrency = pushshift_concurrency
 
     def extract_comments_for_submission_id(self, submission_ids: List[str]):
         """
@@ -53,23 +112,147 @@ class CommentExtractor(Extractor):
         submissions = [self.reddit.submission(id=submission_id) for submission_id in submission_ids]
         for submission in submissions:
             submission.comment_sort = 'controversial'
-            pshift_comments = PushShift.get_comments_for_submission_id(submission.id)
-            self.extract_comments(pshift_comments, submission).to_pickle(f"{submission.id}_comment_frame.pkl")
-
-    def extract_comments(self, pshift_comments: List[Dict], praw_submission: models.Submission):
-        rows = []
-        for index, pshift_comment in enumerate(pshift_comments):
-            progress = float(index / len(pshift_comments))
-            progress = progress * 100
-            print(progress)
-            rows.append(self.merge_with_praw_comment(pshift_comment))
-            self.save_checkpoint_if_needed(index, rows)
+            with request_priority(Priority.COMMENT_ENRICHMENT):
+                with get_instrumentation().timer('comment_extractor.pushshift'):
+                    pshift_comments = self.get_pushshift_comments(submission.id)
+                comment_frame = self.extract_comments(pshift_comments, submission)
+            comment_frame.to_pickle(f"{submission.id}_comment_frame.pkl")
+            with get_instrumentation().timer('comment_extractor.database'):
+                self.save_to_database(submission, comment_frame)
+            self.clear_checkpoint()
+
+    def save_to_database(self, submission: 'models.Submission', comment_frame: Df):
+        if self.database is None:
+            return
+        self.database.upsert_submission(
+            submission.id,
+            author=str(submission.author) if submission.author is not None else None,
+            subreddit=submission.subreddit.display_name,
+            title=submission.title,
+            created_utc=submission.created_utc
+        )
+        self.database.upsert_comments(comment_frame)
+
+    def get_pushshift_comments(self, submission_id: str) -> List[Dict]:
+        if self.pushshift_concurrency <= 1:
+            return PushShift.get_comments_for_submission_id(submission_id)
+        with AsyncPushShift(concurrency=self.pushshift_concurrency, path=PushShift.PATH) as pushshift:
+            comments = asyncio.run(pushshift.get_comments_for_submission_id(submission_id))
+            if len(pushshift.skipped_chunks) > 0:
+                skipped_count = sum(len(skipped_chunk['comment_ids']) for skipped_chunk in pushshift.skipped_chunks)
+                reasons = Counter(skipped_chunk['reason'] for skipped_chunk in pushshift.skipped_chunks)
+                print(f"Skipped {skipped_count} comments of {submission_id} in {len(pushshift.skipped_chunks)} "
+                      f"chunks: {dict(reasons)}")
+        return comments
+
+    def extract_comments(self, pshift_comments: List[Dict], praw_submission: 'models.Submission'):
+        """
+        Merges pshift_comments with reddit's metadata. Comments already in the checkpoint log of the submission (from
+        an interrupted run) are not fetched again.
+        """
+        rows = self.resume_from_checkpoint(f'{self.cp_fname}_{praw_submission.id}')
+        processed_comment_ids = {row['comment_id'] for row in rows}
+        #  If even pshift couldn't get the deleted version we get rid of it
+        pshift_comments = [pshift_comment for pshift_comment in pshift_comments
+                           if not self.is_comment_removed_by_mods(pshift_comment['body'])
+                           and pshift_comment['id'] not in processed_comment_ids]
+        instrumentation = get_instrumentation()
+        progress = instrumentation.progress(f"Merging the comments of {praw_submission.id}", len(pshift_comments))
+        for index in range(0, len(pshift_comments), self.PRAW_INFO_BATCH_SIZE):
+            batch = pshift_comments[index:index + self.PRAW_INFO_BATCH_SIZE]
+            rows += self.merge_with_praw_comments(batch)
+            with instrumentation.timer('comment_extractor.checkpoint'):
+                self.save_checkpoint_if_needed(index, rows)
+            progress.update(len(batch))
         frame = Df(rows)
         frame['is_submitter'] = frame['author'] == praw_submission.author
         frame = frame[~frame.body.isnull()]
         frame.reset_index(drop=True, inplace=True)
         return frame
 
+    def merge_with_praw_comments(self, pshift_comments: List[Dict]) -> List[Dict]:
+        """
+        Batch version of `merge_with_praw_comment`. The PRAW attributes of all pshift_comments are resolved with one
+        `reddit.info` call (up to 100 fullnames per request) and merged in vectorized form. Comments missing from the
+        bulk response fall back to a per comment lookup.
+        :param pshift_comments: At most PRAW_INFO_BATCH_SIZE comments from PushShift
+        :return: rows of the comment frame
+        """
+        instrumentation = get_instrumentation()
+        with instrumentation.timer('comment_extractor.praw_info'):
+            praw_attributes = self.get_praw_attributes_in_bulk([pshift_comment['id']
+                                                                for pshift_comment in pshift_comments])
+        for pshift_comment in pshift_comments:
+            if pshift_comment['id'] in praw_attributes:
+                continue
+            instrumentation.count('comment_extractor.praw_fallback_lookups')
+            try:
+                with instrumentation.timer('comment_extractor.praw_fallback'):
+                    praw_attributes[pshift_comment['id']] = self.get_praw_attributes(
+                        self.reddit.comment(pshift_comment['id'])
+                    )
+            except PrawcoreException as e:
+                instrumentation.count('comment_extractor.missing_on_reddit')
+                print(f"Couldn't find {pshift_comment['id']} on reddit: {e}")
+        with instrumentation.timer('comment_extractor.praw_merge'):
+            return self.merge_praw_attributes(pshift_comments, praw_attributes)
+
+    @classmethod
+    def merge_praw_attributes(cls, pshift_comments: List[Dict], praw_attributes: Dict[str, Dict]) -> List[Dict]:
+        """
+        Vectorized merge of pshift_comments with the attributes from `get_praw_attributes`, comments without
+        attributes are dropped
+        :param praw_attributes: comment_id -> attributes
+        :return: rows of the comment frame
+        """
+        if len(praw_attributes) == 0:
+            return []
+        pshift_frame = Df([{
+            "body": pshift_comment['body'],
+            "author": pshift_comment['author'],
+            "comment_id": pshift_comment['id'],
+            "link_id": pshift_comment['link_id']
+        } for pshift_comment in pshift_comments])
+        frame = pshift_frame.merge(Df(list(praw_attributes.values())), on='comment_id', how='inner')
+        praw_body = frame.praw_body.str.lower()
+        return Df({
+            "body": frame.body,
+            "edited": frame.praw_edited.astype(bool),  # if the comment is edited, the utc is given. We map it to a bool
+            "author": frame.author,
+            "comment_id": frame.comment_id,
+            "post_id": frame.link_id.str.split('_', n=1).str[-1],
+            "golds": frame.golds,
+            "score": np.where(frame.score_hidden, Constants.SCORE_HIDDEN, frame.praw_score),
+            "parent_id": frame.parent_id,
+            "comment_removed_by_mods": praw_body.str.contains('removed', regex=False),
+            "comment_deleted": praw_body.str.contains('deleted', regex=False),
+            "comment_created_utc": pd.to_datetime(frame.created_utc, unit='s')
+        }).to_dict('records')
+
+    def get_praw_attributes_in_bulk(self, comment_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Resolves comment_ids with a single bulk `reddit.info` lookup
+        :return: comment_id -> attributes from `get_praw_attributes`, comments reddit didn't return are missing
+        """
+        fullnames = [f"t1_{comment_id}" for comment_id in comment_ids]
+        return {
+            praw_comment.id: self.get_praw_attributes(praw_comment)
+            for praw_comment in self.reddit.info(fullnames=fullnames)
+        }
+
+    @classmethod
+    def get_praw_attributes(cls, praw_comment: 'models.Comment') -> Dict:
+        return {
+            "comment_id": praw_comment.id,
+            "praw_body": praw_comment.body,
+            "praw_edited": praw_comment.edited,
+            "golds": praw_comment.gilded,
+            "praw_score": praw_comment.score,
+            "score_hidden": praw_comment.score_hidden,
+            "parent_id": praw_comment.parent_id,
+            "created_utc": praw_comment.created_utc
+        }
+
     def merge_with_praw_comment(self, phsift_comment: Dict):
         pshift_body = phsift_comment['body']
         if self.is_comment_removed_by_mods(pshift_body) or self.is_comment_removed_by_mods(pshift_body):  #  If even pshift couldn't get the deleted version we get rid of it
@@ -82,7 +265,7 @@ class CommentExtractor(Extractor):
             "comment_id": phsift_comment['id'],
             "post_id": self.get_post_id(phsift_comment['link_id']),
             "golds": praw_comment.gilded,
-            "score": praw_comment.score if not praw_comment.score_hidden else -0.9,
+            "score": praw_comment.score if not praw_comment.score_hidden else Constants.SCORE_HIDDEN,
             "parent_id": praw_comment.parent_id,
             "comment_removed_by_mods": self.is_comment_removed_by_mods(praw_comment.body),
             "comment_deleted": self.is_comment_deleted(praw_comment.body),
@@ -105,35 +288,117 @@ class CommentExtractor(Extractor):
 
 
 class UserExtractor(Extractor):
+    """
+        Extracts the user predictors for a list of authors.
 
-    def __init_(self, **kwargs):
+        Authors are crawled by a pool of `workers` threads. Each thread has its own praw instance and all of them take
+        their requests from the reddit budget of the process's `RequestScheduler`, the one every other praw instance
+        uses as well, so throughput is bounded by the rate limit of the API and not by the latency of a single author.
+        Crawls run with `Priority.USER_HISTORY`, a CommentExtractor in the same process gets the tokens first.
+
+        Every author is isolated, a failure is classified and recorded in `failures` without affecting the others:
+            deleted     the account doesn't exist anymore (NotFound)
+            suspended   the account is suspended (Forbidden, or its is_suspended attribute is set)
+            transient   server/network errors, retried max_retries times with exponential backoff first
+            error       anything else
+        Deleted and suspended authors are logged so that a resumed run doesn't crawl them again.
+
+        Crawled authors are upserted into the database, authors already in it with the same history_before_utc (e.g
+        from another post) are read from it instead of being crawled again. Rows record the history_before_utc they
+        were crawled with, rows of the checkpoint log crawled with another one are crawled again.
+
+        The per subreddit counts and karma of a user come from a history backend:
+            pushshift   sums of PushShift's search, a few requests of MAX_ITEMS_PER_SEARCH items per user. Falls back
+                        to the listings if PushShift fails
+            listing     walks the user's submissions and comments listings on reddit, 100 items per request
+        Both only count what was created before history_before_utc, if it's set.
+    """
+    TRANSIENT_ERRORS = (ServerError, RequestException)
+    PERMANENT_FAILURES = ("deleted", "suspended")
+    HISTORY_BACKENDS = ("pushshift", "listing")
+
+    def __init__(self, workers: int = 1, requests_per_second: Optional[float] = None, max_retries: int = 3,
+                 history_backend: str = "pushshift", history_before_utc: Optional[float] = None, **kwargs):
+        """
+        :param workers: Number of authors crawled concurrently
+        :param requests_per_second: Sets the rate of the shared reddit budget, None keeps the scheduler's
+        :param max_retries: Retries of an author after a transient error
+        :param history_backend: One of HISTORY_BACKENDS
+        :param history_before_utc: Only count the submissions and comments created before, e.g the creation time of
+        the post, so that the user features are those the user had when commenting
+        """
+        if history_backend not in self.HISTORY_BACKENDS:
+            raise ValueError(f"history_backend must be one of {self.HISTORY_BACKENDS}, got {history_backend}")
         Extractor.__init__(self, **kwargs)
         self.cp_fname = "checkpoint_user_frame"
+        self.workers = workers
+        self.max_retries = max_retries
+        self.history_backend = history_backend
+        self.history_before_utc = history_before_utc
+        self.request_budget = get_scheduler().get_budget('reddit')
+        if requests_per_second is not None:
+            self.request_budget.set_rate(requests_per_second)
+        self.thread_local = threading.local()
+        self.failure_log = CheckpointLog(f'{self.cp_fname}_failures.log')
+        self.failures = []
 
-    @classmethod
-    def get_all_user_predictors(cls, redditor: Redditor) -> Dict:
+    def get_all_user_predictors(self, redditor: 'Redditor') -> Dict:
         return {
             "author": redditor.name,
             "user_total_comment_karma": redditor.comment_karma,
             "user_total_post_karma": redditor.link_karma,
             "user_email_verified": redditor.has_verified_email,
             "user_account_creation_utc": pd.to_datetime(redditor.created_utc, unit='s'),
-            **cls.get_subreddit_post_score_and_count(redditor),
-            **cls.get_subreddit_comment_score_and_count(redditor)
+            **self.get_subreddit_history(redditor),
+            "history_before_utc": self.history_before_utc
+        }
+
+    def get_subreddit_history(self, redditor: 'Redditor') -> Dict:
+        """
+        The subreddit_* and user_total_*_count predictors, from the history backend
+        """
+        if self.history_backend == "pushshift":
+            try:
+                with get_instrumentation().timer('user_extractor.pushshift_history'):
+                    return self.get_pushshift_history(redditor.name, self.history_before_utc)
+            except (OSError, KeyError) as e:    # ConnectionError and requests' errors are OSErrors
+                get_instrumentation().count('user_extractor.history_fallbacks')
+                print(f"Walking the listings of {redditor.name}, PushShift failed: {repr(e)}")
+        with get_instrumentation().timer('user_extractor.listing_history'):
+            return {
+                **self.get_subreddit_post_score_and_count(redditor, self.history_before_utc),
+                **self.get_subreddit_comment_score_and_count(redditor, self.history_before_utc)
+            }
+
+    @classmethod
+    def get_pushshift_history(cls, author: str, before_utc: Optional[float] = None) -> Dict:
+        subreddit_post_karma, subreddit_post_count = PushShift.get_subreddit_score_and_count(author, "submission",
+                                                                                             before_utc)
+        subreddit_comment_karma, subreddit_comment_count = PushShift.get_subreddit_score_and_count(author, "comment",
+                                                                                                   before_utc)
+        return {
+            "subreddit_post_karma": subreddit_post_karma,
+            "subreddit_post_count": subreddit_post_count,
+            "user_total_post_count": sum(subreddit_post_count.values()),
+            "subreddit_comment_karma": subreddit_comment_karma,
+            "subreddit_comment_count": subreddit_comment_count,
+            "user_total_comment_count": sum(subreddit_comment_count.values())
         }
 
     @classmethod
-    def get_subreddit_post_score_and_count(cls, redditor: Redditor) -> Dict:
+    def get_subreddit_post_score_and_count(cls, redditor: 'Redditor', before_utc: Optional[float] = None) -> Dict:
         """
         Returns the link/post karma grouped by subreddit and also number of posts in each subreddit
-        # @toDo: 1. Should we handlle only the posts before the time?
         :param redditor:
+        :param before_utc: Only the posts created before
         :return:
         """
         subreddit_post_karma = Counter()
         subreddit_post_count = Counter()
         total_posts = 0
         for author_submission in redditor.submissions.top(limit=None):
+            if before_utc is not None and author_submission.created_utc >= before_utc:
+                continue
             subreddit_post_karma[author_submission.subreddit.display_name] += author_submission.score
             subreddit_post_count[author_submission.subreddit.display_name] += 1
             total_posts += 1
@@ -143,17 +408,19 @@ class UserExtractor(Extractor):
                 }
 
     @classmethod
-    def get_subreddit_comment_score_and_count(cls, redditor: Redditor) -> Dict:
+    def get_subreddit_comment_score_and_count(cls, redditor: 'Redditor', before_utc: Optional[float] = None) -> Dict:
         """
         Returns the comment karma grouped by subreddit and also number of comments in each subreddit
-        # @toDo: 1. Should we handlle only the comments before the time?
         :param redditor:
+        :param before_utc: Only the comments created before
         :return:
         """
         subreddit_comment_karma = Counter()
         subreddit_comment_count = Counter()
         total_comments = 0
         for author_comment in redditor.comments.hot(limit=None):
+            if before_utc is not None and author_comment.created_utc >= before_utc:
+                continue
             subreddit_comment_karma[author_comment.subreddit.display_name] += 0 if author_comment.score_hidden else author_comment.score
             subreddit_comment_count[author_comment.subreddit.display_name] += 1
             total_comments += 1
@@ -165,45 +432,132 @@ class UserExtractor(Extractor):
 
     def get_frame_for_authors(self, authors: List[str]) -> Df:
         """
-        Method to get a dataframe of user predictors for a list of authors
+        Method to get a dataframe of user predictors for a list of authors. Rows are appended to the checkpoint log as
+        the workers finish them, authors already in the log (from an interrupted run) are not crawled again.
         :param authors:
         :return:
         """
-        rows, reddit = [], get_reddit_instance()
-        for index, author in enumerate(authors):
-            progress = float(index / len(authors))
-            progress = progress * 100
-            print(progress)
+        rows = [row for row in self.resume_from_checkpoint(self.cp_fname) if self.has_history_cutoff(row)]
+        self.last_saved_row_count = len(rows)   # The other rows stay in the log, they're skipped again on resume
+        processed_authors = {row['author'] for row in rows}
+        if not self.no_caching:
+            processed_authors |= {failure['author'] for failure in self.failure_log.load_rows()
+                                  if failure['status'] in self.PERMANENT_FAILURES}
+        pending_authors = []
+        for author in dict.fromkeys(authors):
             if author == "":
                 continue
             if type(author) == float and math.isnan(author):
                 continue
-            try:
-                rows.append(self.get_all_user_predictors(reddit.redditor(name=author)))
-            except Exception as e:
-                print(f"Encountered error: {e} at index: {index}. Saving checkpoint....")
-                print(f"Encountered error at index {index}")
-                out_fname = f'checkpoint_users_exception.pkl'
-                Df(rows).to_pickle(out_fname)
-            except NotFound as e:
-                print(f"Seems like {author} has deleted their account: {e}")
-            self.save_checkpoint_if_needed(index, rows)
-        frame = Df(rows)
+            if author in processed_authors:
+                continue
+            pending_authors.append(author)
+        stored_rows = []
+        instrumentation = get_instrumentation()
+        if self.database is not None:
+            with instrumentation.timer('user_extractor.database_lookup'):
+                stored_rows = self.database.get_user_rows(pending_authors, self.history_before_utc)
+            stored_authors = {row['author'] for row in stored_rows}
+            pending_authors = [author for author in pending_authors if author not in stored_authors]
+            print(f"{len(stored_authors)} authors are already in {self.database.fname}")
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        crawls = [executor.submit(self.get_user_predictors_for_author, author) for author in pending_authors]
+        progress = instrumentation.progress("Crawling authors", len(crawls))
+        try:
+            for index, crawl in enumerate(as_completed(crawls)):
+                row, failure = crawl.result()
+                progress.update()
+                if row is not None:
+                    rows.append(row)
+                    if self.database is not None:
+                        self.database.upsert_users([row])
+                else:
+                    self.record_failure(failure)
+                self.save_checkpoint_if_needed(index, rows)
+        finally:
+            for crawl in crawls:
+                crawl.cancel()
+            executor.shutdown(wait=True)
+            self.save_checkpoint(rows)
+        if len(self.failures) > 0:
+            print(f"Couldn't crawl {len(self.failures)} authors: {dict(Counter(f['status'] for f in self.failures))}")
+        requested_authors = set(authors)
+        frame = Df([row for row in rows + stored_rows if row['author'] in requested_authors])
         frame.reset_index(drop=True, inplace=True)
         return frame
 
+    def has_history_cutoff(self, row: Dict) -> bool:
+        """
+        If row was crawled with the history_before_utc of the extractor, rows logged before it was recorded weren't
+        """
+        return 'history_before_utc' in row and row['history_before_utc'] == self.history_before_utc
+
+    def get_user_predictors_for_author(self, author: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """
+        Crawls a single author on the calling worker thread.
+        :return: (row, None) if the author was crawled, (None, failure) otherwise
+        """
+        with request_priority(Priority.USER_HISTORY), get_instrumentation().timer('user_extractor.crawl_author'):
+            return self.crawl_author(author)
+
+    def crawl_author(self, author: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                redditor = self.get_thread_reddit_instance().redditor(name=author)
+                # Suspended accounts only have name and is_suspended, the attribute isn't there for the others
+                if getattr(redditor, 'is_suspended', False):
+                    return None, self.get_failure(author, "suspended", "is_suspended")
+                return self.get_all_user_predictors(redditor), None
+            except NotFound as e:
+                return None, self.get_failure(author, "deleted", e)
+            except Forbidden as e:
+                return None, self.get_failure(author, "suspended", e)
+            except self.TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    return None, self.get_failure(author, "transient", e)
+                get_instrumentation().count('user_extractor.retries')
+                time.sleep(2 ** attempt)
+            except Exception as e:
+                return None, self.get_failure(author, "error", e)
+
+    def get_thread_reddit_instance(self):
+        """
+        praw isn't thread safe, every worker thread gets its own instance drawing from the shared request budget
+        """
+        if not hasattr(self.thread_local, 'reddit'):
+            self.thread_local.reddit = get_reddit_instance(budget=self.request_budget, **self.reddit_kwargs)
+        return self.thread_local.reddit
+
     @classmethod
-    def save_user_comments(cls, input_fname: str, start_index: int = 0):
+    def get_failure(cls, author: str, status: str, error) -> Dict:
+        """
+        :param error: The exception, or a description of the failure
+        """
+        return {"author": author, "status": status, "reason": error if isinstance(error, str) else repr(error)}
+
+    def record_failure(self, failure: Dict):
+        get_instrumentation().count(f"user_extractor.failures.{failure['status']}")
+        self.failures.append(failure)
+        if not self.no_caching:
+            self.failure_log.append([failure])
+
+    def clear_checkpoint(self):
+        Extractor.clear_checkpoint(self)
+        self.failure_log.clear()
+
+    def save_user_comments(self, input_fname: str, start_index: int = 0):
         """
-        Main method to extract all user predictors from the author column of the frame in input_fname pickle
+        Main method to extract all user predictors from the author column of the frame in input_fname pickle.
+        Interrupted runs resume from the checkpoint log automatically.
         :param input_fname:
-        :param start_index: To resume
+        :param start_index: Skips the first start_index authors
         :return:
         """
         comment_frame = pd.read_pickle(input_fname + '.pkl')
         authors = comment_frame.author.unique()[start_index:]
-        user_frame = cls.get_frame_for_authors(authors)
+        user_frame = self.get_frame_for_authors(authors)
         output_fname = f'{input_fname}_authors_{start_index}_'
         out_fname = f'{output_fname}_all.pkl'
         user_frame.to_pickle(out_fname)
+        self.clear_checkpoint()
 
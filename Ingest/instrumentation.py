@@ -0,0 +1,249 @@
+import sys
+import json
+import time
+import random
+import atexit
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Timer:
+    """
+    Count, total and a bounded reservoir of the durations of one kind of operation, for the percentiles
+    """
+    RESERVOIR_SIZE = 4096
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = []
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if len(self.samples) < self.RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:   # Reservoir sampling, every duration has the same chance of being kept
+            slot = random.randrange(self.count)
+            if slot < self.RESERVOIR_SIZE:
+                self.samples[slot] = seconds
+
+    def merge(self, state: Dict):
+        self.count += state['count']
+        self.total_seconds += state['total_seconds']
+        self.max_seconds = max(self.max_seconds, state['max_seconds'])
+        self.samples = (self.samples + state['samples'])[-self.RESERVOIR_SIZE:]
+
+    def get_state(self) -> Dict:
+        return {"count": self.count, "total_seconds": self.total_seconds, "max_seconds": self.max_seconds,
+                "samples": list(self.samples)}
+
+    def get_summary(self) -> Dict:
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "mean_seconds": self.total_seconds / self.count if self.count > 0 else 0.0,
+            **{f"p{percentile}_seconds": samples[min(int(len(samples) * percentile / 100), len(samples) - 1)]
+               if len(samples) > 0 else 0.0 for percentile in (50, 90, 99)},
+            "max_seconds": self.max_seconds
+        }
+
+
+class ProgressReporter:
+    """
+    Prints the progress of a loop at most every interval_seconds, and once when it's done
+        progress = get_instrumentation().progress("Crawling authors", len(authors))
+        for author in authors:
+            ...
+            progress.update()
+    """
+
+    def __init__(self, name: str, total: int, interval_seconds: float = 10.0):
+        self.name = name
+        self.total = total
+        self.interval_seconds = interval_seconds
+        self.done = 0
+        self.started_at = time.monotonic()
+        self.last_reported_at = self.started_at
+
+    def update(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        if self.done >= self.total or now - self.last_reported_at >= self.interval_seconds:
+            self.last_reported_at = now
+            print(self.format(now))
+
+    def format(self, now: float) -> str:
+        elapsed = max(now - self.started_at, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+        percent = 100 * self.done / self.total if self.total > 0 else 100.0
+        return f"{self.name}: {percent:.1f}% ({self.done}/{self.total}), {rate:.1f}/s, eta {eta:.0f}s"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every other thread each interval_seconds from a daemon thread. A function's self samples
+    are the samples it was running in, its total samples the ones it was on the stack in.
+    """
+
+    def __init__(self, interval_seconds: float = 0.005):
+        self.interval_seconds = interval_seconds
+        self.self_samples = Counter()
+        self.total_samples = Counter()
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        own_thread_id = threading.get_ident()
+        while not self.stopped.wait(self.interval_seconds):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                self.sample_count += 1
+                self.self_samples[self.get_location(frame)] += 1
+                on_stack = set()
+                while frame is not None:
+                    on_stack.add(self.get_location(frame))
+                    frame = frame.f_back
+                self.total_samples.update(on_stack)
+
+    @classmethod
+    def get_location(cls, frame) -> str:
+        return f"{frame.f_code.co_filename}:{frame.f_code.co_name}"
+
+    def get_summary(self, top: int = 30) -> Dict:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "samples": self.sample_count,
+            "self": [{"function": location, "samples": samples} for location, samples in
+                     self.self_samples.most_common(top)],
+            "total": [{"function": location, "samples": samples} for location, samples in
+                      self.total_samples.most_common(top)]
+        }
+
+
+class Instrumentation:
+    """
+        Timers and counters of the hot paths of a run.
+
+            with get_instrumentation().timer('api.pushshift.comment_search'):
+                ...
+            get_instrumentation().count('user_extractor.failures.deleted')
+
+        Timers are named `<area>.<operation>`: api.pushshift.*, api.reddit.* per request type, comment_extractor.* and
+        user_extractor.* per stage, features.* per FeatureBuilder sub builder. `get_report` summarizes them with latency
+        percentiles, `enable_instrumentation` writes it as JSON when the process exits. All methods are thread safe.
+    """
+
+    def __init__(self):
+        self.started_utc = time.time()
+        self.started_at = time.monotonic()
+        self.timers = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.profiler = None
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(name, time.perf_counter() - start)
+
+    def add_duration(self, name: str, seconds: float):
+        with self.lock:
+            if name not in self.timers:
+                self.timers[name] = Timer()
+            self.timers[name].add(seconds)
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def progress(self, name: str, total: int, interval_seconds: float = 10.0) -> ProgressReporter:
+        return ProgressReporter(name, total, interval_seconds=interval_seconds)
+
+    def start_profiler(self, interval_seconds: float = 0.005):
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval_seconds)
+            self.profiler.start()
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def get_state(self) -> Dict:
+        """
+        Picklable state of the timers and counters, e.g to merge the instrumentation of worker processes
+        """
+        with self.lock:
+            return {"timers": {name: timer.get_state() for name, timer in self.timers.items()},
+                    "counters": dict(self.counters)}
+
+    def merge(self, state: Dict):
+        with self.lock:
+            for name, timer_state in state['timers'].items():
+                self.timers.setdefault(name, Timer()).merge(timer_state)
+            self.counters.update(state['counters'])
+
+    def get_report(self) -> Dict:
+        with self.lock:
+            report = {
+                "started_utc": self.started_utc,
+                "elapsed_seconds": time.monotonic() - self.started_at,
+                "timers": {name: self.timers[name].get_summary() for name in sorted(self.timers)},
+                "counters": dict(sorted(self.counters.items()))
+            }
+        if self.profiler is not None:
+            report["profile"] = self.profiler.get_summary()
+        return report
+
+    def write_report(self, fname: str):
+        with open(fname, 'w') as report_file:
+            json.dump(self.get_report(), report_file, indent=2)
+        print(f"Wrote the instrumentation report to {fname}")
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def reset_instrumentation() -> Instrumentation:
+    global _instrumentation
+    _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def enable_instrumentation(report_fname: Optional[str] = None, profile: bool = False,
+                           profile_interval_seconds: float = 0.005) -> Instrumentation:
+    """
+    Writes the report of the run to report_fname when the process exits
+    :param profile: Also run the sampling profiler, its summary is added to the report
+    """
+    instrumentation = get_instrumentation()
+    if profile:
+        instrumentation.start_profiler(profile_interval_seconds)
+    if report_fname is not None:
+        def write_report():
+            instrumentation.stop_profiler()
+            instrumentation.write_report(report_fname)
+        atexit.register(write_report)
+    return instrumentation
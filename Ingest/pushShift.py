@@ -1,15 +1,27 @@
 import json
-from typing import List, Dict
+import asyncio
+from collections import Counter
+from typing import List, Dict, AsyncIterator, Optional, Tuple
 import numpy as np
 import math
+from urllib.parse import quote
 from pandas import DataFrame as Df
 import pandas as pd
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from Ingest.cache import ResponseCache, get_default_cache
+from Ingest.instrumentation import get_instrumentation
+from Ingest.ratelimit import RateBudget, get_scheduler, get_request_priority
 
 
 class PushShift:
     PATH = "https://api.pushshift.io/reddit"
+    MAX_IDS_PER_REQUEST = 99
+    MAX_ITEMS_PER_SEARCH = 500
+    HISTORY_FIELDS = "id,subreddit,score,created_utc"
+    MAX_RETRIES = 5
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
     @classmethod
     def get_comment_ids_for_submission_id(cls, submission_id: str) -> List[str]:
@@ -27,38 +39,272 @@ class PushShift:
         For a list of comment ids this will get all the comments. It will handle however big the list is
         :return:
         """
-        num_splits = math.ceil(len(comment_ids) / 99)
-        comment_ids_sets = np.array_split(comment_ids, num_splits)
         comments = []
-        for comment_ids_set in comment_ids_sets:
+        for comment_ids_set in cls.get_comment_id_chunks(comment_ids):
             comment_ids = ",".join(comment_ids_set)
             url = f"{cls.PATH}/comment/search?ids={comment_ids}"
             try:
                 comments += cls.get_request(url)['data']
-            except KeyError as e:
-                print(f"SKipped {comment_ids}")
+            except KeyError:
+                get_instrumentation().count('api.pushshift.skipped_chunks')
+                get_instrumentation().count('api.pushshift.skipped_comments', len(comment_ids_set))
                 continue
         return comments
 
+    @classmethod
+    def get_comment_id_chunks(cls, comment_ids: List[str]) -> List[List[str]]:
+        """
+        Splits comment_ids into chunks small enough for a single comment search request
+        """
+        if len(comment_ids) == 0:
+            return []
+        num_splits = math.ceil(len(comment_ids) / cls.MAX_IDS_PER_REQUEST)
+        return [list(comment_ids_set) for comment_ids_set in np.array_split(comment_ids, num_splits)]
+
     @classmethod
     def get_comments_for_submission_id(cls, submission_id: str) -> List[Dict]:
         comment_ids = cls.get_comment_ids_for_submission_id(submission_id)
         comments = cls.get_comments_for_comment_ids(comment_ids)
         missed = len(comment_ids) - len(comments)
-        print(f"Missed {missed} comments out of {len(comment_ids)}.")
+        get_instrumentation().count('api.pushshift.missed_comments', missed)
+        if missed > 0:
+            print(f"Missed {missed} comments out of {len(comment_ids)} of {submission_id}")
         return comments
 
+    @classmethod
+    def get_subreddit_score_and_count(cls, author: str, kind: str,
+                                      before: Optional[float] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Sums the scores and counts the submissions or comments of author per subreddit. PushShift's search is walked
+        newest first in pages of MAX_ITEMS_PER_SEARCH items that only have the HISTORY_FIELDS, so a user with a few
+        thousand comments takes a handful of requests.
+        :param kind: submission or comment
+        :param before: Only the items created before this utc timestamp, e.g the creation of the post
+        :return: subreddit -> score sum, subreddit -> count
+        """
+        subreddit_score, subreddit_count = Counter(), Counter()
+        cursor = int(math.ceil(before)) if before is not None else None
+        boundary_ids = set()    # Items of the last page's oldest second, they are requested again as before is exclusive
+        while True:
+            url = f"{cls.PATH}/search/{kind}/?author={quote(author, safe='')}&size={cls.MAX_ITEMS_PER_SEARCH}" \
+                  f"&sort=desc&sort_type=created_utc&fields={cls.HISTORY_FIELDS}"
+            if cursor is not None:
+                url += f"&before={cursor}"
+            items = cls.get_request(url)['data']
+            new_items = [item for item in items if item['id'] not in boundary_ids]
+            for item in new_items:
+                subreddit_score[item['subreddit']] += item.get('score', 0)
+                subreddit_count[item['subreddit']] += 1
+            if len(items) < cls.MAX_ITEMS_PER_SEARCH:
+                return dict(subreddit_score), dict(subreddit_count)
+            oldest_created_utc = int(items[-1]['created_utc'])
+            if len(new_items) == 0:     # More items in a second than in a page, the rest of the second is skipped
+                cursor, boundary_ids = oldest_created_utc, set()
+                continue
+            if cursor != oldest_created_utc + 1:
+                boundary_ids = set()
+            boundary_ids |= {item['id'] for item in items if int(item['created_utc']) == oldest_created_utc}
+            cursor = oldest_created_utc + 1
+
     @classmethod
     def get_request(cls, url) -> dict:
         """
-        Helper to make network requests
+        Helper to make network requests. Reads through the cache set by `Ingest.cache.enable_cache`. Every request
+        takes a token from the pushshift budget of the process's `RequestScheduler`, 429 and 5xx responses pause the
+        budget and are retried MAX_RETRIES times. The latency of every request is timed under
+        api.pushshift.<request type>.
+        """
+        instrumentation = get_instrumentation()
+        cache, key = get_default_cache(), ResponseCache.get_key('GET', url)
+        if cache is not None:
+            content = cache.get(key)
+            if content is not None:
+                instrumentation.count('api.pushshift.cache_hits')
+                return content
+        budget = get_scheduler().get_budget('pushshift')
+        for attempt in range(cls.MAX_RETRIES + 1):
+            if attempt > 0:
+                instrumentation.count('api.pushshift.retries')
+            with instrumentation.timer('api.pushshift.budget_wait'):
+                budget.acquire()
+            with instrumentation.timer(f'api.pushshift.{cls.get_request_type(url)}'):
+                resp = requests.get(url=url)
+            if resp.status_code == 200:
+                break
+            instrumentation.count(f'api.pushshift.status_{resp.status_code}')
+            if resp.status_code not in cls.RETRY_STATUS_CODES or attempt == cls.MAX_RETRIES:
+                raise ConnectionError(f"Unable to fulfill {url}, got {resp.content} with {resp.status_code}")
+            budget.pause(cls.get_backoff_seconds(resp, attempt))
+        budget.update_from_headers(resp.headers)
+        content = json.loads(resp.content)
+        if cache is not None:
+            cache.put(key, content)
+        return content
+
+    @classmethod
+    def get_backoff_seconds(cls, resp, attempt: int, backoff_seconds: float = 1.0) -> float:
+        """
+        The Retry-After of resp if it has one, exponential backoff otherwise
+        """
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return backoff_seconds * (2 ** attempt)
+
+    @classmethod
+    def get_request_type(cls, url: str) -> str:
+        """
+        e.g comment_search for .../reddit/comment/search?ids=...
+        """
+        path = url.split('?', 1)[0].split('/reddit/', 1)[-1]
+        return '_'.join(path.split('/')[:2])
+
+
+class AsyncPushShift:
+    """
+        asyncio client for PushShift that fetches the comment search chunks concurrently.
+
+        1. Requests go through one pooled requests.Session (keep-alive connections are reused) on a thread pool.
+        2. At most `concurrency` requests are in flight at any time, and they take their tokens from the pushshift
+           budget of the process's `RequestScheduler` with the priority of the thread that created the client.
+        3. 429 and 5xx responses are retried with exponential backoff, honoring the Retry-After header when present.
+           The backoff pauses the budget, so the other requests wait as well.
+        4. Chunks that can't be fetched are recorded in `skipped_chunks` as {"comment_ids": [...], "reason": str} and
+           counted in the api.pushshift.skipped_* counters, reporting them is left to the caller.
+
+        Usage:
+            with AsyncPushShift(concurrency=8) as pushshift:
+                comments = asyncio.run(pushshift.get_comments_for_submission_id('b4agza'))
+
+        `path` can point to a local stub server for testing. Responses are read through `cache`, which defaults to the
+        one set by `Ingest.cache.enable_cache`.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, concurrency: int = 8, max_retries: int = 5, backoff_seconds: float = 1.0,
+                 path: str = PushShift.PATH, cache: ResponseCache = None, budget: RateBudget = None):
+        self.path = path
+        self.cache = cache if cache is not None else get_default_cache()
+        self.budget = budget if budget is not None else get_scheduler().get_budget('pushshift')
+        self.priority = get_request_priority()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.skipped_chunks = []
+        self._semaphore = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def get_comment_ids_for_submission_id(self, submission_id: str) -> List[str]:
+        url = "/".join([self.path, "submission/comment_ids", submission_id])
+        return (await self.get_request(url))['data']
+
+    async def get_comments_for_submission_id(self, submission_id: str) -> List[Dict]:
+        comment_ids = await self.get_comment_ids_for_submission_id(submission_id)
+        comments = await self.get_comments_for_comment_ids(comment_ids)
+        get_instrumentation().count('api.pushshift.missed_comments', len(comment_ids) - len(comments))
+        return comments
+
+    async def get_comments_for_comment_ids(self, comment_ids: List[str]) -> List[Dict]:
+        """
+        Fetches every chunk of comment_ids concurrently, the comments are returned in the order of the chunks like
+        `PushShift.get_comments_for_comment_ids` does, whichever chunk finishes first
+        """
+        chunk_comments = await asyncio.gather(*[self.get_comments_for_chunk(comment_ids_set)
+                                                for comment_ids_set in PushShift.get_comment_id_chunks(comment_ids)])
+        return [comment for comments in chunk_comments for comment in comments]
+
+    async def iter_comments_for_comment_ids(self, comment_ids: List[str]) -> AsyncIterator[List[Dict]]:
+        """
+        Fetches every chunk of comment_ids concurrently and yields the comments of each chunk as soon as it finishes,
+        in completion order.
+        """
+        chunk_fetches = [asyncio.ensure_future(self.get_comments_for_chunk(comment_ids_set))
+                         for comment_ids_set in PushShift.get_comment_id_chunks(comment_ids)]
+        try:
+            for chunk_fetch in asyncio.as_completed(chunk_fetches):
+                yield await chunk_fetch
+        finally:
+            for chunk_fetch in chunk_fetches:
+                chunk_fetch.cancel()
+
+    async def get_comments_for_chunk(self, comment_ids_set: List[str]) -> List[Dict]:
+        url = f"{self.path}/comment/search?ids={','.join(comment_ids_set)}"
+        try:
+            return (await self.get_request(url))['data']
+        except (KeyError, ConnectionError) as e:
+            get_instrumentation().count('api.pushshift.skipped_chunks')
+            get_instrumentation().count('api.pushshift.skipped_comments', len(comment_ids_set))
+            self.skipped_chunks.append({"comment_ids": comment_ids_set, "reason": repr(e)})
+            return []
+
+    async def get_request(self, url: str) -> dict:
+        """
+        Makes the request on the pooled session, retrying 429/5xx and connection failures with exponential backoff
+        """
+        key = ResponseCache.get_key('GET', url)
+        if self.cache is not None:
+            content = self.cache.get(key)
+            if content is not None:
+                get_instrumentation().count('api.pushshift.cache_hits')
+                return content
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                get_instrumentation().count('api.pushshift.retries')
+            async with self.semaphore:
+                try:
+                    resp = await loop.run_in_executor(self.executor, self.fetch, url)
+                except requests.exceptions.RequestException as e:
+                    resp, error = None, e
+            if resp is not None and resp.status_code == 200:
+                self.budget.update_from_headers(resp.headers)
+                content = json.loads(resp.content)
+                if self.cache is not None:
+                    self.cache.put(key, content)
+                return content
+            if resp is not None:
+                get_instrumentation().count(f'api.pushshift.status_{resp.status_code}')
+            if resp is not None and resp.status_code not in self.RETRY_STATUS_CODES:
+                raise ConnectionError(f"Unable to fulfill {url}, got {resp.content} with {resp.status_code}")
+            if attempt == self.max_retries:
+                break
+            self.budget.pause(self.get_backoff_seconds(resp, attempt))
+        if resp is None:
+            raise ConnectionError(f"Unable to fulfill {url} after {self.max_retries} retries: {error}")
+        raise ConnectionError(f"Unable to fulfill {url} after {self.max_retries} retries, got {resp.status_code}")
+
+    def fetch(self, url: str) -> requests.Response:
+        """
+        Runs on the thread pool, waits for a token of the budget before making the request
         """
-        then = datetime.now()
-        resp = requests.get(url=url)
-        if resp.status_code != 200:
-            raise ConnectionError(f"Unable to fulfill {url}, got {resp.content} with {resp.status_code}")
-        now = datetime.now()
-        resp_time = now - then
-        print(f"Took {resp_time.total_seconds()} seconds to hit {url}")
-        return json.loads(resp.content)
+        with get_instrumentation().timer('api.pushshift.budget_wait'):
+            self.budget.acquire(self.priority)
+        with get_instrumentation().timer(f'api.pushshift.{PushShift.get_request_type(url)}'):
+            return self.session.get(url)
 
+    def get_backoff_seconds(self, resp, attempt: int) -> float:
+        return PushShift.get_backoff_seconds(resp, attempt, self.backoff_seconds)
@@ -0,0 +1,216 @@
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Mapping, Optional
+
+
+class Priority:
+    """
+    Waiters with a lower priority get the tokens of a budget first, comment enrichment goes before user history crawls
+    """
+    COMMENT_ENRICHMENT = 0
+    USER_HISTORY = 1
+
+
+class RateBudget:
+    """
+        Thread-safe request budget shared by every worker of an extractor.
+
+        Tokens refill at `requests_per_second` up to `burst`, `acquire` blocks until a token is available. Workers
+        therefore never exceed the allowed request rate together, however many of them there are.
+
+        Waiters are served by priority (see `Priority`), first come first served within a priority. The rate adapts to
+        the x-ratelimit-remaining/x-ratelimit-reset headers of the responses: what's left of the window is spread
+        evenly over it, up to `max_requests_per_second`. An exhausted window or a 429 pauses the budget, no token is
+        given out until it's over. A budget with a `share` below 1 only takes that part of what's left, the rest is left
+        to the budgets of the other processes behind the same rate limit.
+    """
+    REMAINING_HEADER = 'x-ratelimit-remaining'
+    RESET_HEADER = 'x-ratelimit-reset'
+
+    def __init__(self, requests_per_second: float, burst: int = 1, max_requests_per_second: Optional[float] = None,
+                 share: float = 1.0):
+        """
+        :param requests_per_second: Rate until the first rate limit headers arrive
+        :param max_requests_per_second: Cap of the rate adapted to the headers, None to follow them
+        :param share: Part of the rate limit in the headers this budget uses
+        """
+        self.requests_per_second = requests_per_second
+        self.max_requests_per_second = max_requests_per_second
+        self.share = share
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()     # In the future while the budget is paused
+        self.waiters = []   # Heap of (priority, ticket)
+        self.tickets = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, priority: Optional[int] = None):
+        """
+        :param priority: Defaults to the priority of the calling thread, see `request_priority`
+        """
+        waiter = (get_request_priority() if priority is None else priority, next(self.tickets))
+        with self.condition:
+            heapq.heappush(self.waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if self.waiters[0] == waiter and self.tokens >= 1:
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.condition.notify_all()     # The next waiter is at the head now
+                        return
+                    # Only the head of the queue waits for the refill, the others for the head to be served
+                    self.condition.wait(self.get_wait_seconds(now) if self.waiters[0] == waiter else None)
+            except BaseException:
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+                raise
+
+    def refill(self, now: float):
+        if now > self.last_refill:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.requests_per_second)
+            self.last_refill = now
+
+    def get_wait_seconds(self, now: float) -> float:
+        return max(self.last_refill - now, 0.0) + max(1 - self.tokens, 0.0) / self.requests_per_second
+
+    def pause(self, seconds: float):
+        """
+        No token is given out for seconds, e.g after a 429 or once the window of the rate limit is used up
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_refill = max(self.last_refill, now + seconds)
+            self.condition.notify_all()
+
+    def set_rate(self, requests_per_second: float):
+        with self.condition:
+            self.refill(time.monotonic())
+            if self.max_requests_per_second is not None:
+                requests_per_second = min(requests_per_second, self.max_requests_per_second)
+            self.requests_per_second = requests_per_second
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> bool:
+        """
+        Adapts the rate to the rate limit headers of a response
+        :return: If headers had them
+        """
+        try:
+            remaining = float(headers[self.REMAINING_HEADER])
+            reset_seconds = max(float(headers[self.RESET_HEADER]), 0.0)
+        except (KeyError, TypeError, ValueError):
+            return False
+        if remaining < 1:
+            self.pause(reset_seconds)
+        else:
+            self.set_rate(self.share * remaining / max(reset_seconds, 1.0))
+        return True
+
+    def get_state(self) -> Dict:
+        with self.condition:
+            return {"requests_per_second": self.requests_per_second, "tokens": self.tokens,
+                    "waiters": len(self.waiters), "paused_seconds": max(self.last_refill - time.monotonic(), 0.0)}
+
+
+class RequestScheduler:
+    """
+        The request budgets of a process, one token bucket per API. praw instances from `get_reddit_instance`,
+        `PushShift` and `AsyncPushShift` take their tokens from the budget of their API here, so all the components of
+        a process together stay within the limits of each API.
+
+            enable_scheduler(reddit_requests_per_second=1.0, pushshift_requests_per_second=1.0)
+            with request_priority(Priority.USER_HISTORY):
+                ...     # Requests made by this thread wait for the comment enrichment ones
+
+        The budgets aren't shared between processes. Worker processes that make requests run with a scheduler from
+        `get_share`, so that together they stay within the rates of the parent:
+            ProcessPoolExecutor(workers, initializer=set_scheduler, initargs=(get_scheduler().get_share(workers),))
+    """
+    DEFAULT_REQUESTS_PER_SECOND = 1.0
+
+    def __init__(self, requests_per_second: Dict[str, float] = None, burst: int = 1, share: float = 1.0):
+        """
+        :param requests_per_second: api (reddit, pushshift) -> initial rate, DEFAULT_REQUESTS_PER_SECOND for the others
+        :param share: Part of every rate (and of the rate limits in the headers) the budgets of this scheduler use
+        """
+        self.requests_per_second = requests_per_second if requests_per_second is not None else {}
+        self.burst = burst
+        self.share = share
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # Only the settings are pickled, e.g to a worker process, its budgets start over
+        return {"requests_per_second": self.requests_per_second, "burst": self.burst, "share": self.share}
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def get_budget(self, api: str) -> RateBudget:
+        with self.lock:
+            if api not in self.budgets:
+                requests_per_second = self.requests_per_second.get(api, self.DEFAULT_REQUESTS_PER_SECOND)
+                self.budgets[api] = RateBudget(self.share * requests_per_second, burst=self.burst, share=self.share)
+            return self.budgets[api]
+
+    def get_share(self, processes: int) -> 'RequestScheduler':
+        """
+        Scheduler for each of processes worker processes, with 1/processes of the rates of this one
+        """
+        return RequestScheduler(self.requests_per_second, burst=self.burst, share=self.share / max(processes, 1))
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            budgets = dict(self.budgets)
+        return {api: budget.get_state() for api, budget in budgets.items()}
+
+
+_default_scheduler = RequestScheduler()
+_thread_state = threading.local()
+
+
+def get_scheduler() -> RequestScheduler:
+    return _default_scheduler
+
+
+def enable_scheduler(reddit_requests_per_second: float = 1.0, pushshift_requests_per_second: float = 1.0,
+                     burst: int = 1) -> RequestScheduler:
+    """
+    Replaces the scheduler of the process, the budgets already handed out keep their old settings
+    """
+    return set_scheduler(RequestScheduler({"reddit": reddit_requests_per_second,
+                                          "pushshift": pushshift_requests_per_second}, burst=burst))
+
+
+def set_scheduler(scheduler: RequestScheduler) -> RequestScheduler:
+    """
+    Replaces the scheduler of the process, e.g with a share of the parent's in the initializer of a worker process
+    """
+    global _default_scheduler
+    _default_scheduler = scheduler
+    return _default_scheduler
+
+
+def get_request_priority() -> int:
+    return getattr(_thread_state, 'priority', Priority.COMMENT_ENRICHMENT)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """
+    The requests the calling thread makes in the block wait with priority, e.g inside praw's lazy attribute loads
+    """
+    previous = get_request_priority()
+    _thread_state.priority = priority
+    try:
+        yield
+    finally:
+        _thread_state.priority = previous
@@ -0,0 +1,118 @@
+import os
+import pytest
+import requests
+from Ingest import cache as cache_module
+from Ingest.cache import CacheMissError, ResponseCache, disable_cache, enable_cache
+from Ingest.pushShift import PushShift
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list:
+    """
+    Replaces the clock of the cache, set clock[0] to move it
+    """
+    clock = [1000000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: clock[0])
+    return clock
+
+
+@pytest.fixture
+def default_cache(tmp_path):
+    yield enable_cache(str(tmp_path / 'cache'), ttl_seconds=None)
+    disable_cache()
+
+
+def test_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    key = ResponseCache.get_key('get', 'https://api.pushshift.io/reddit/comment/search', {'ids': 'a', 'size': 2})
+    assert key == ResponseCache.get_key('GET', 'https://api.pushshift.io/reddit/comment/search', {'size': 2, 'ids': 'a'})
+    assert cache.get(key) is None
+    cache.put(key, {'data': [1, 2]})
+    assert cache.get(key) == {'data': [1, 2]}
+    assert ResponseCache(str(tmp_path)).total_bytes == cache.total_bytes > 0
+
+
+def test_expired_entries_are_removed(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60)
+    cache.put('ab', 'response')
+    clock[0] += 59
+    assert cache.get('ab') == 'response'
+    clock[0] += 2
+    assert cache.get('ab') is None
+    assert not os.path.exists(cache.get_path('ab'))
+
+
+def test_offline_serves_expired_entries_and_raises_on_misses(tmp_path, clock):
+    ResponseCache(str(tmp_path), ttl_seconds=60).put('ab', 'response')
+    clock[0] += 3600
+    offline = ResponseCache(str(tmp_path), ttl_seconds=60, offline=True)
+    assert offline.get('ab') == 'response'
+    with pytest.raises(CacheMissError):
+        offline.get('cd')
+    offline.put('cd', 'response')     # Nothing is written offline
+    assert not os.path.exists(offline.get_path('cd'))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('aa', 'x' * 100)
+    entry_size = cache.total_bytes
+    cache.max_bytes = 3.5 * entry_size      # Room for 3 entries, the 4th evicts one
+    cache.put('bb', 'y' * 100)
+    cache.put('cc', 'z' * 100)
+    for age, key in enumerate(['cc', 'bb', 'aa']):
+        os.utime(cache.get_path(key), (0, 1000000 - age * 100))
+    assert cache.get('aa') == 'x' * 100    # aa is now the most recently used, bb the least
+    cache.put('dd', 'w' * 100)
+    assert not os.path.exists(cache.get_path('bb'))
+    assert all(os.path.exists(cache.get_path(key)) for key in ['aa', 'cc', 'dd'])
+    assert cache.total_bytes == 3 * entry_size
+
+
+def test_pushshift_reads_through_the_default_cache(monkeypatch, default_cache):
+    requested_urls = []
+
+    def get(url):
+        requested_urls.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"data": ["c1", "c2"]}'
+        return response
+
+    monkeypatch.setattr(requests, 'get', get)
+    assert PushShift.get_comment_ids_for_submission_id('p') == ['c1', 'c2']
+    assert PushShift.get_comment_ids_for_submission_id('p') == ['c1', 'c2']
+    assert len(requested_urls) == 1
+    default_cache.offline = True
+    assert PushShift.get_comment_ids_for_submission_id('p') == ['c1', 'c2']
+    with pytest.raises(CacheMissError):
+        PushShift.get_comment_ids_for_submission_id('q')
+    assert len(requested_urls) == 1
+
+
+def test_reddit_requests_read_through_the_cache(monkeypatch, tmp_path):
+    from Ingest.Reddit import BudgetedRequestor, CachingRequestor
+    requested_urls = []
+
+    def request(self, method, url, *args, **kwargs):
+        requested_urls.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        return response
+
+    monkeypatch.setattr(BudgetedRequestor, 'request', request)
+    cache = ResponseCache(str(tmp_path))
+    requestor = CachingRequestor('user agent', cache=cache)
+    url = 'https://oauth.reddit.com/api/info'
+    assert requestor.request('GET', url, params={'id': 't1_a'}).status_code == 200
+    assert requestor.request('GET', url, params={'id': 't1_a'}).status_code == 200
+    assert requestor.request('GET', url, params={'id': 't1_b'}).status_code == 200
+    assert requested_urls == [url, url]
+    cache.offline = True
+    assert requestor.request('POST', 'https://www.reddit.com/api/v1/access_token').json()['access_token'] == 'offline'
+    with pytest.raises(CacheMissError):
+        requestor.request('POST', 'https://oauth.reddit.com/api/comment')
+    with pytest.raises(CacheMissError):
+        requestor.request('GET', url, params={'id': 't1_c'})
+    assert len(requested_urls) == 2
@@ -0,0 +1,62 @@
+import os
+import pickle
+from Ingest.checkpoints import CheckpointLog
+
+
+def get_log(tmp_path) -> CheckpointLog:
+    return CheckpointLog(str(tmp_path / 'checkpoint.pkl'))
+
+
+def test_segments_are_read_back_in_order(tmp_path):
+    log = get_log(tmp_path)
+    log.append([{'comment_id': 'a'}, {'comment_id': 'b'}])
+    log.append([])
+    log.append([{'comment_id': 'c'}])
+    assert [len(segment) for segment in log.read_segments()] == [2, 1]
+    assert [row['comment_id'] for row in log.load_rows()] == ['a', 'b', 'c']
+    assert log.get_processed_keys('comment_id') == {'a', 'b', 'c'}
+    assert log.to_frame().comment_id.tolist() == ['a', 'b', 'c']
+
+
+def test_missing_log_is_empty(tmp_path):
+    log = get_log(tmp_path)
+    assert log.load_rows() == []
+    assert len(log.to_frame()) == 0
+    log.clear()
+    assert not os.path.exists(log.fname)
+
+
+def test_torn_tail_is_dropped_and_truncated(tmp_path):
+    log = get_log(tmp_path)
+    log.append([{'author': 'a'}])
+    good_size = os.path.getsize(log.fname)
+    torn = pickle.dumps([{'author': 'b'}], protocol=pickle.HIGHEST_PROTOCOL)
+    with open(log.fname, 'ab') as log_file:
+        log_file.write(torn[:len(torn) // 2])   # The process died mid write
+    restarted = CheckpointLog(log.fname)
+    assert restarted.get_processed_keys('author') == {'a'}
+    restarted.append([{'author': 'c'}])
+    assert restarted.get_processed_keys('author') == {'a', 'c'}
+    assert os.path.getsize(log.fname) == good_size + len(pickle.dumps([{'author': 'c'}],
+                                                                      protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_corrupt_tail_is_dropped(tmp_path):
+    log = get_log(tmp_path)
+    log.append([{'author': 'a'}])
+    with open(log.fname, 'ab') as log_file:
+        log_file.write(b'\x00garbage')
+    restarted = CheckpointLog(log.fname)
+    assert [row['author'] for row in restarted.load_rows()] == ['a']
+    restarted.append([{'author': 'b'}])
+    restarted.append([{'author': 'c'}])
+    assert [row['author'] for row in CheckpointLog(log.fname).load_rows()] == ['a', 'b', 'c']
+
+
+def test_clear(tmp_path):
+    log = get_log(tmp_path)
+    log.append([{'author': 'a'}])
+    log.clear()
+    assert not os.path.exists(log.fname)
+    log.append([{'author': 'b'}])
+    assert log.get_processed_keys('author') == {'b'}
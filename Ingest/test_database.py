@@ -0,0 +1,182 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from Ingest import database as database_module
+from Ingest.database import Database, NO_HISTORY_CUTOFF
+
+POST_CREATION_TIME = pd.Timestamp('2019-03-22 21:00:00')
+
+
+@pytest.fixture
+def database(tmp_path) -> Database:
+    return Database(str(tmp_path / 'creddit.sqlite3'))
+
+
+def get_comment_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'comment_id': ['a', 'b', 'c', 'd'],
+        'post_id': ['p', 'p', 'p', 'q'],
+        'parent_id': ['t3_p', 't1_a', 't1_a', 't3_q'],
+        'author': ['santaKlaus', 'elf', None, 'santaKlaus'],
+        'body': ['ho ho ho', 'hi', '[deleted]', 'other post'],
+        'edited': [False, True, False, False],
+        'golds': [0, 2, 0, 1],
+        'score': [10.0, -3.0, 1.0, 5.0],
+        'comment_removed_by_mods': [False, False, True, False],
+        'comment_deleted': [False, False, True, False],
+        'is_submitter': [True, False, False, False],
+        'comment_created_utc': POST_CREATION_TIME + pd.to_timedelta([60, 120, 180, 240], unit='s')
+    })
+
+
+def get_user_row(author: str, history_before_utc: float = None, karma: int = 1, subreddits: dict = None) -> dict:
+    """
+    subreddits: subreddit -> (post_count, post_karma, comment_count, comment_karma)
+    """
+    subreddits = subreddits if subreddits is not None else {'politics': (1, 10, 0, 0), 'news': (0, 0, 3, 7)}
+    return {
+        'author': author,
+        'user_total_comment_karma': karma,
+        'user_total_post_karma': 2 * karma,
+        'user_email_verified': True,
+        'user_account_creation_utc': pd.Timestamp('2015-01-01 12:00:00'),
+        'user_total_post_count': 3,
+        'user_total_comment_count': 4,
+        'subreddit_post_count': {name: values[0] for name, values in subreddits.items() if values[0] > 0},
+        'subreddit_post_karma': {name: values[1] for name, values in subreddits.items() if values[0] > 0},
+        'subreddit_comment_count': {name: values[2] for name, values in subreddits.items() if values[2] > 0},
+        'subreddit_comment_karma': {name: values[3] for name, values in subreddits.items() if values[2] > 0},
+        'history_before_utc': history_before_utc
+    }
+
+
+def assert_user_row_equal(stored: dict, expected: dict):
+    expected = dict(expected)
+    if expected['history_before_utc'] is None:
+        expected['history_before_utc'] = np.nan
+    assert set(stored) == set(expected)
+    for column, value in expected.items():
+        if isinstance(value, float) and np.isnan(value):
+            assert np.isnan(stored[column])
+        else:
+            assert stored[column] == value, column
+
+
+def test_comment_round_trip(database):
+    comment_frame = get_comment_frame()
+    database.upsert_comments(comment_frame)
+    database.upsert_comments(comment_frame)     # Writing the same rows twice leaves the store unchanged
+    assert database.has_comments('p') and not database.has_comments('r')
+    loaded = database.load_comment_frame('p').sort_values('comment_id').reset_index(drop=True)
+    expected = comment_frame[comment_frame.post_id == 'p'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(loaded, expected, check_dtype=False)
+
+
+def test_changed_comments_are_replaced(database):
+    database.upsert_comments(get_comment_frame())
+    changed = get_comment_frame().iloc[[1]].assign(body='edited', edited=True, score=4.0)
+    database.upsert_comments(changed)
+    loaded = database.load_comment_frame('p').set_index('comment_id')
+    assert len(loaded) == 3
+    assert loaded.loc['b', 'body'] == 'edited' and loaded.loc['b', 'score'] == 4.0
+
+
+def test_reply_and_author_lookups(database):
+    database.upsert_comments(get_comment_frame())
+    assert sorted(database.get_replies_to('t1_a').comment_id) == ['b', 'c']
+    assert database.get_replies_to('t1_b').empty
+    assert sorted(database.get_comments_by_author('santaKlaus').comment_id) == ['a', 'd']
+    assert database.get_comments_by_author('santaKlaus', post_id='q').comment_id.tolist() == ['d']
+
+
+def test_user_round_trip(database):
+    user_rows = [get_user_row('santaKlaus'), get_user_row('elf', subreddits={}),
+                 get_user_row('rudolph', subreddits={'Politics': (2, -5, 1, 1)})]
+    database.upsert_users(user_rows)
+    stored = {row['author']: row for row in database.get_user_rows(['santaKlaus', 'elf', 'rudolph', 'grinch'])}
+    assert set(stored) == {'santaKlaus', 'elf', 'rudolph'}
+    for user_row in user_rows:
+        assert_user_row_equal(stored[user_row['author']], user_row)
+    user_frame = database.load_user_frame(authors=['elf', 'rudolph'])
+    assert sorted(user_frame.author) == ['elf', 'rudolph']
+
+
+def test_stored_subreddits_are_replaced_as_a_whole(database):
+    database.upsert_users([get_user_row('santaKlaus')])
+    updated = get_user_row('santaKlaus', karma=5, subreddits={'news': (1, 1, 0, 0)})
+    database.upsert_users([updated])
+    stored = database.get_user_rows(['santaKlaus'])
+    assert len(stored) == 1
+    assert_user_row_equal(stored[0], updated)
+
+
+def test_users_are_keyed_by_history_cutoff(database):
+    cutoff = POST_CREATION_TIME.timestamp()
+    database.upsert_users([get_user_row('santaKlaus', karma=1),
+                           get_user_row('santaKlaus', cutoff, karma=2, subreddits={'news': (1, 1, 0, 0)}),
+                           get_user_row('elf', cutoff)])
+    assert database.get_stored_authors(['santaKlaus', 'elf']) == {'santaKlaus'}
+    assert database.get_stored_authors(['santaKlaus', 'elf'], cutoff) == {'santaKlaus', 'elf'}
+    assert database.get_stored_authors(['santaKlaus', 'elf'], cutoff + 1) == set()
+    whole_history = database.get_user_rows(['santaKlaus'])
+    assert [row['user_total_comment_karma'] for row in whole_history] == [1]
+    [up_to_cutoff] = database.get_user_rows(['santaKlaus'], cutoff)
+    assert_user_row_equal(up_to_cutoff, get_user_row('santaKlaus', cutoff, karma=2, subreddits={'news': (1, 1, 0, 0)}))
+    count = database.get_connection().execute('SELECT COUNT(*) FROM users WHERE history_before_utc = ?',
+                                              (NO_HISTORY_CUTOFF,)).fetchone()[0]
+    assert count == 1
+
+
+def test_post_user_frame_has_one_row_per_author(database):
+    cutoff = POST_CREATION_TIME.timestamp()
+    database.upsert_comments(get_comment_frame())
+    database.upsert_users([get_user_row('santaKlaus', karma=1), get_user_row('santaKlaus', cutoff, karma=2),
+                           get_user_row('elf', cutoff, subreddits={'news': (1, 1, 0, 0)})])
+    whole_history = database.load_user_frame(post_id='p')
+    assert whole_history.author.tolist() == ['santaKlaus']
+    assert whole_history.user_total_comment_karma.tolist() == [1]
+    up_to_cutoff = database.load_user_frame(post_id='p', history_before_utc=cutoff).set_index('author')
+    assert sorted(up_to_cutoff.index) == ['elf', 'santaKlaus']
+    assert up_to_cutoff.loc['santaKlaus', 'user_total_comment_karma'] == 2
+    assert up_to_cutoff.loc['elf', 'subreddit_post_count'] == {'news': 1}
+    assert database.load_user_frame(post_id='p', history_before_utc=cutoff + 1).empty
+
+
+def test_users_without_cutoff_are_migrated(tmp_path):
+    fname = str(tmp_path / 'creddit.sqlite3')
+    with sqlite3.connect(fname) as connection:
+        # The users as they were stored before they were keyed by history_before_utc
+        connection.executescript("""
+        CREATE TABLE users (author TEXT PRIMARY KEY, user_total_comment_karma INTEGER, user_total_post_karma INTEGER,
+            user_email_verified INTEGER, user_account_creation_utc REAL, user_total_post_count INTEGER,
+            user_total_comment_count INTEGER, fetched_utc REAL);
+        CREATE TABLE user_subreddit_aggregates (author TEXT, subreddit TEXT, post_count INTEGER, post_karma INTEGER,
+            comment_count INTEGER, comment_karma INTEGER, PRIMARY KEY (author, subreddit));
+        CREATE INDEX user_subreddit_aggregates_author ON user_subreddit_aggregates (author);
+        INSERT INTO users VALUES ('santaKlaus', 1, 2, 1, 1420113600, 3, 4, 1553288400);
+        INSERT INTO user_subreddit_aggregates VALUES ('santaKlaus', 'politics', 1, 10, 0, 0);
+        INSERT INTO user_subreddit_aggregates VALUES ('santaKlaus', 'news', 0, 0, 3, 7);
+        """)
+    database = Database(fname)
+    [stored] = database.get_user_rows(['santaKlaus'])
+    assert_user_row_equal(stored, get_user_row('santaKlaus'))
+    assert database.get_stored_authors(['santaKlaus'], POST_CREATION_TIME.timestamp()) == set()
+    database.upsert_users([get_user_row('santaKlaus', POST_CREATION_TIME.timestamp(), karma=2)])
+    assert len(Database(fname).load_user_frame(authors=['santaKlaus'])) == 1   # Migrated once
+
+
+def test_lookups_of_more_authors_than_bound_variables(database, monkeypatch):
+    monkeypatch.setattr(database_module, 'MAX_SQL_VARIABLES', 7)
+    authors = [f'u{index}' for index in range(30)]
+    database.upsert_users([get_user_row(author) for author in authors])
+    assert database.get_stored_authors(authors + ['missing']) == set(authors)
+    assert sorted(row['author'] for row in database.get_user_rows(authors[::2])) == sorted(authors[::2])
+    assert database.get_stored_authors([]) == set()
+
+
+def test_records_bind_python_scalars():
+    frame = pd.DataFrame({'a': [1, 2], 'b': [np.nan, 1.5], 'c': ['x', None]})
+    assert Database.to_records(frame) == [(1, None, 'x'), (2, 1.5, None)]
+    assert all(type(value) in (int, float, str, type(None)) for record in Database.to_records(frame)
+               for value in record)
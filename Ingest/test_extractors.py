@@ -0,0 +1,187 @@
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+prawcore_exceptions = pytest.importorskip('prawcore.exceptions')
+from Ingest import extractors
+from Ingest.extractors import CommentExtractor, UserExtractor
+from Ingest.instrumentation import reset_instrumentation
+
+POST_CREATION_UTC = 1553288400.0
+
+
+class FakeComment:
+
+    def __init__(self, comment_id: str, rng: np.random.RandomState):
+        self.id = comment_id
+        self.body = ['fine', '[removed]', '[deleted]', 'Deleted by the mods?'][rng.randint(4)]
+        self.edited = False if rng.rand() < 0.7 else POST_CREATION_UTC + rng.randint(3600)
+        self.gilded = int(rng.randint(3))
+        self.score = int(rng.randint(-20, 100))
+        self.score_hidden = bool(rng.rand() < 0.2)
+        self.parent_id = 't3_p' if rng.rand() < 0.3 else f't1_c{rng.randint(100)}'
+        self.created_utc = POST_CREATION_UTC + rng.randint(86400)
+
+
+class FakeListing:
+
+    def __init__(self, items: list):
+        self.items = items
+
+    def top(self, limit=None):
+        return iter(self.items)
+
+    def hot(self, limit=None):
+        return iter(self.items)
+
+
+def get_item(subreddit: str, score: int, created_utc: float, score_hidden: bool = False) -> SimpleNamespace:
+    return SimpleNamespace(subreddit=SimpleNamespace(display_name=subreddit), score=score, created_utc=created_utc,
+                           score_hidden=score_hidden)
+
+
+class FakeRedditor:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.comment_karma = 10
+        self.link_karma = 20
+        self.has_verified_email = True
+        self.created_utc = 1420113600.0
+        self.submissions = FakeListing([get_item('politics', 5, POST_CREATION_UTC - 10),
+                                        get_item('news', 7, POST_CREATION_UTC + 10)])
+        self.comments = FakeListing([get_item('politics', 1, POST_CREATION_UTC - 20),
+                                     get_item('politics', 3, POST_CREATION_UTC - 10, score_hidden=True),
+                                     get_item('aww', 2, POST_CREATION_UTC + 10)])
+
+
+class FakeReddit:
+    """
+    Answers info, comment and redditor lookups from memory. Redditors fail according to their name: deleted (404),
+    forbidden (403), suspended (is_suspended), flaky (500 for the first 2 lookups), down (always 500) and broken
+    (missing attribute).
+    """
+
+    def __init__(self, comments: dict = None, missing_from_info: set = None):
+        self.comments = comments if comments is not None else {}
+        self.missing_from_info = missing_from_info if missing_from_info is not None else set()
+        self.info_requests = []
+        self.comment_requests = []
+        self.redditor_requests = []
+
+    def info(self, fullnames: list):
+        self.info_requests.append(list(fullnames))
+        for fullname in fullnames:
+            comment_id = fullname.split('_', 1)[1]
+            if comment_id in self.comments and comment_id not in self.missing_from_info:
+                yield self.comments[comment_id]
+
+    def comment(self, comment_id: str):
+        self.comment_requests.append(comment_id)
+        if comment_id not in self.comments:
+            raise prawcore_exceptions.NotFound(SimpleNamespace(status_code=404))
+        return self.comments[comment_id]
+
+    def redditor(self, name: str):
+        self.redditor_requests.append(name)
+        if name == 'deleted':
+            raise prawcore_exceptions.NotFound(SimpleNamespace(status_code=404))
+        if name == 'forbidden':
+            raise prawcore_exceptions.Forbidden(SimpleNamespace(status_code=403))
+        if name == 'down' or (name == 'flaky' and self.redditor_requests.count(name) <= 2):
+            raise prawcore_exceptions.ServerError(SimpleNamespace(status_code=500))
+        if name == 'suspended':
+            return SimpleNamespace(name=name, is_suspended=True)
+        redditor = FakeRedditor(name)
+        if name == 'broken':
+            del redditor.has_verified_email
+        return redditor
+
+
+@pytest.fixture
+def reddit(monkeypatch, tmp_path) -> FakeReddit:
+    monkeypatch.chdir(tmp_path)     # The checkpoint logs are written to the working directory
+    monkeypatch.setattr(extractors.time, 'sleep', lambda seconds: None)
+    reddit = FakeReddit()
+    monkeypatch.setattr(extractors, 'get_reddit_instance', lambda **kwargs: reddit)
+    return reddit
+
+
+@pytest.fixture
+def instrumentation():
+    return reset_instrumentation()
+
+
+def get_pshift_comments(reddit: FakeReddit, num_comments: int, seed: int) -> list:
+    rng = np.random.RandomState(seed)
+    pshift_comments = []
+    for index in range(num_comments):
+        comment_id = f'c{index}'
+        reddit.comments[comment_id] = FakeComment(comment_id, rng)
+        pshift_comments.append({'id': comment_id, 'body': f'body of {comment_id}', 'author': f'u{rng.randint(10)}',
+                                'link_id': 't3_p'})
+    return pshift_comments
+
+
+def test_bulk_merge_matches_per_comment_merge(reddit, instrumentation):
+    pshift_comments = get_pshift_comments(reddit, 60, 0)
+    reddit.missing_from_info = {'c3', 'c17'}    # Bulk lookups can miss comments, they are looked up one by one
+    del reddit.comments['c40']                  # Not on reddit at all
+    extractor = CommentExtractor(database_fname=None)
+    rows = extractor.merge_with_praw_comments(pshift_comments)
+    assert len(reddit.info_requests) == 1
+    assert reddit.info_requests[0] == [f"t1_{pshift_comment['id']}" for pshift_comment in pshift_comments]
+    assert reddit.comment_requests == ['c3', 'c17', 'c40']
+    expected = [extractor.merge_with_praw_comment(pshift_comment) for pshift_comment in pshift_comments
+                if pshift_comment['id'] != 'c40']
+    pd.testing.assert_frame_equal(pd.DataFrame(rows).sort_values('comment_id').reset_index(drop=True),
+                                  pd.DataFrame(expected).sort_values('comment_id').reset_index(drop=True),
+                                  check_dtype=False)
+    assert instrumentation.counters['comment_extractor.praw_fallback_lookups'] == 3
+    assert instrumentation.counters['comment_extractor.missing_on_reddit'] == 1
+
+
+def test_comments_are_resolved_in_batches(reddit):
+    pshift_comments = get_pshift_comments(reddit, 250, 1)
+    pshift_comments[5]['body'] = '[removed]'    # Even PushShift doesn't have it
+    extractor = CommentExtractor(database_fname=None, no_caching=True)
+    frame = extractor.extract_comments(pshift_comments, SimpleNamespace(id='p', author='u1'))
+    assert [len(fullnames) for fullnames in reddit.info_requests] == [100, 100, 49]
+    assert len(frame) == 249 and 'c5' not in set(frame.comment_id)
+    assert (frame.is_submitter == (frame.author == 'u1')).all()
+    assert reddit.comment_requests == []
+
+
+def test_failures_are_classified(reddit, instrumentation):
+    extractor = UserExtractor(workers=3, max_retries=3, history_backend='listing', database_fname=None)
+    authors = ['ok', 'deleted', 'forbidden', 'suspended', 'flaky', 'down', 'broken', '', np.nan, 'ok']
+    frame = extractor.get_frame_for_authors(authors)
+    assert sorted(frame.author) == ['flaky', 'ok']
+    statuses = {failure['author']: failure['status'] for failure in extractor.failures}
+    assert statuses == {'deleted': 'deleted', 'forbidden': 'suspended', 'suspended': 'suspended',
+                        'down': 'transient', 'broken': 'error'}
+    assert 'has_verified_email' in next(failure['reason'] for failure in extractor.failures
+                                        if failure['author'] == 'broken')
+    assert reddit.redditor_requests.count('down') == 4
+    assert reddit.redditor_requests.count('flaky') == 3
+    assert instrumentation.counters['user_extractor.retries'] == 3 + 2
+    assert instrumentation.counters['user_extractor.failures.suspended'] == 2
+
+
+def test_permanent_failures_are_not_crawled_again(reddit):
+    authors = ['deleted', 'suspended', 'down']
+    UserExtractor(max_retries=0, history_backend='listing', database_fname=None).get_frame_for_authors(authors)
+    reddit.redditor_requests.clear()
+    resumed = UserExtractor(max_retries=0, history_backend='listing', database_fname=None)
+    resumed.get_frame_for_authors(authors)
+    assert reddit.redditor_requests == ['down']
+
+
+def test_listing_history_stops_at_the_cutoff(reddit):
+    extractor = UserExtractor(history_backend='listing', history_before_utc=POST_CREATION_UTC, database_fname=None)
+    [row] = extractor.get_frame_for_authors(['ok']).to_dict('records')
+    assert row['subreddit_post_count'] == {'politics': 1} and row['subreddit_post_karma'] == {'politics': 5}
+    assert row['subreddit_comment_count'] == {'politics': 2} and row['subreddit_comment_karma'] == {'politics': 1}
+    assert row['user_total_post_count'] == 1 and row['user_total_comment_count'] == 2
+    assert row['history_before_utc'] == POST_CREATION_UTC
+    assert row['user_account_creation_utc'] == pd.Timestamp('2015-01-01 12:00:00')
@@ -0,0 +1,125 @@
+import json
+import time
+import pickle
+import threading
+import pytest
+from Ingest.instrumentation import Instrumentation, ProgressReporter, SamplingProfiler, Timer
+
+
+def test_timer_summary():
+    timer = Timer()
+    for milliseconds in range(1, 101):
+        timer.add(milliseconds / 1000)
+    summary = timer.get_summary()
+    assert summary["count"] == 100
+    assert summary["total_seconds"] == pytest.approx(5.05)
+    assert summary["mean_seconds"] == pytest.approx(0.0505)
+    assert summary["p50_seconds"] == pytest.approx(0.051)
+    assert summary["p90_seconds"] == pytest.approx(0.091)
+    assert summary["p99_seconds"] == pytest.approx(0.1)
+    assert summary["max_seconds"] == pytest.approx(0.1)
+
+
+def test_empty_timer_summary():
+    assert Timer().get_summary() == {"count": 0, "total_seconds": 0.0, "mean_seconds": 0.0, "p50_seconds": 0.0,
+                                     "p90_seconds": 0.0, "p99_seconds": 0.0, "max_seconds": 0.0}
+
+
+def test_timer_reservoir_is_bounded():
+    timer = Timer()
+    for index in range(3 * Timer.RESERVOIR_SIZE):
+        timer.add(float(index))
+    assert timer.count == 3 * Timer.RESERVOIR_SIZE
+    assert len(timer.samples) == Timer.RESERVOIR_SIZE
+    assert timer.max_seconds == 3 * Timer.RESERVOIR_SIZE - 1
+    assert any(sample >= Timer.RESERVOIR_SIZE for sample in timer.samples)     # Later durations get in too
+
+
+def test_timer_and_counters():
+    instrumentation = Instrumentation()
+    with instrumentation.timer('features.text'):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with instrumentation.timer('features.text'):    # Failures are timed as well
+            raise ValueError()
+    instrumentation.count('api.pushshift.retries')
+    instrumentation.count('api.pushshift.skipped_comments', 99)
+    report = instrumentation.get_report()
+    assert report["timers"]["features.text"]["count"] == 2
+    assert report["timers"]["features.text"]["max_seconds"] >= 0.01
+    assert report["counters"] == {'api.pushshift.retries': 1, 'api.pushshift.skipped_comments': 99}
+
+
+def test_counts_from_threads_add_up():
+    instrumentation = Instrumentation()
+
+    def work():
+        for _ in range(1000):
+            instrumentation.count('requests')
+            instrumentation.add_duration('request', 0.001)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert instrumentation.counters['requests'] == 8000
+    assert instrumentation.timers['request'].count == 8000
+
+
+def test_merge_state_of_a_worker():
+    parent, worker = Instrumentation(), Instrumentation()
+    parent.add_duration('features.text', 1.0)
+    parent.count('features.comment_text.failures')
+    worker.add_duration('features.text', 3.0)
+    worker.add_duration('features.network', 2.0)
+    worker.count('features.comment_text.failures', 2)
+    parent.merge(pickle.loads(pickle.dumps(worker.get_state())))    # As sent back by a worker process
+    report = parent.get_report()
+    assert report["timers"]["features.text"]["count"] == 2
+    assert report["timers"]["features.text"]["total_seconds"] == pytest.approx(4.0)
+    assert report["timers"]["features.text"]["max_seconds"] == pytest.approx(3.0)
+    assert report["timers"]["features.network"]["count"] == 1
+    assert report["counters"] == {'features.comment_text.failures': 3}
+
+
+def test_write_report(tmp_path):
+    instrumentation = Instrumentation()
+    instrumentation.add_duration('api.reddit.info', 0.5)
+    fname = str(tmp_path / 'report.json')
+    instrumentation.write_report(fname)
+    with open(fname) as report_file:
+        report = json.load(report_file)
+    assert report["timers"]["api.reddit.info"]["p50_seconds"] == 0.5
+    assert set(report) == {"started_utc", "elapsed_seconds", "timers", "counters"}
+
+
+def test_progress_reports_at_interval_and_when_done(capsys):
+    progress = ProgressReporter('Crawling authors', 4, interval_seconds=3600)
+    for _ in range(3):
+        progress.update()
+    assert capsys.readouterr().out == ''
+    progress.update()
+    output = capsys.readouterr().out
+    assert output.startswith('Crawling authors: 100.0% (4/4)')
+    assert ProgressReporter('Empty', 0).format(time.monotonic()).startswith('Empty: 100.0% (0/0)')
+
+
+def busy_loop(stopped: threading.Event):
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+def test_profiler_samples_other_threads():
+    stopped = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stopped,))
+    thread.start()
+    profiler = SamplingProfiler(interval_seconds=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stopped.set()
+    thread.join()
+    summary = profiler.get_summary()
+    assert summary["samples"] > 0
+    assert any(entry["function"].endswith(':busy_loop') for entry in summary["total"])
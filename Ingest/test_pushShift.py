@@ -0,0 +1,175 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import pytest
+from Ingest import ratelimit
+from Ingest.instrumentation import reset_instrumentation
+from Ingest.pushShift import AsyncPushShift, PushShift
+from Ingest.ratelimit import RateBudget, RequestScheduler
+
+POST_ID = 'p'
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubPushShift:
+    """
+        Local PushShift answering the comment id and comment search requests of POST_ID after latency_seconds.
+
+        failures maps a comment id to the statuses returned, in order, by the requests of the chunk starting with it
+        before the chunk is answered. A status of 200 answers without a data field. The requests in flight at once are
+        tracked in max_in_flight.
+    """
+
+    def __init__(self, num_comments: int, latency_seconds: float = 0.0):
+        self.comments = {f'c{index}': {'id': f'c{index}', 'body': f'body {index}', 'author': f'u{index % 7}',
+                                       'link_id': f't3_{POST_ID}', 'created_utc': 1553288400 + index}
+                         for index in range(num_comments)}
+        self.latency_seconds = latency_seconds
+        self.failures = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingServer(('127.0.0.1', 0), self.get_handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def path(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/reddit'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, headers, content = stub.answer(self.path)
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def answer(self, url: str):
+        with self.lock:
+            self.requests.append(url)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency_seconds)
+            parsed = urlparse(url)
+            if parsed.path == f'/reddit/submission/comment_ids/{POST_ID}':
+                return 200, {}, json.dumps({'data': list(self.comments)}).encode('utf-8')
+            comment_ids = parse_qs(parsed.query)['ids'][0].split(',')
+            with self.lock:
+                statuses = self.failures.get(comment_ids[0], [])
+                status = statuses.pop(0) if len(statuses) > 0 else None
+            if status == 200:
+                return 200, {}, b'{"error": "no data"}'
+            if status is not None:
+                return status, {'Retry-After': '0'}, b'{}'
+            data = [self.comments[comment_id] for comment_id in comment_ids if comment_id in self.comments]
+            return 200, {}, json.dumps({'data': data}).encode('utf-8')
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def instrumentation():
+    return reset_instrumentation()
+
+
+@pytest.fixture
+def scheduler(monkeypatch) -> RequestScheduler:
+    scheduler = RequestScheduler({"pushshift": 1000.0}, burst=100)
+    monkeypatch.setattr(ratelimit, '_default_scheduler', scheduler)
+    return scheduler
+
+
+def get_async_pushshift(stub: StubPushShift, concurrency: int = 4, max_retries: int = 3) -> AsyncPushShift:
+    return AsyncPushShift(concurrency=concurrency, max_retries=max_retries, backoff_seconds=0.001, path=stub.path,
+                          budget=RateBudget(1000.0, burst=100))
+
+
+def test_chunks_are_fetched_concurrently(scheduler):
+    with StubPushShift(1000, latency_seconds=0.1) as stub, get_async_pushshift(stub, concurrency=4) as pushshift:
+        comments = asyncio.run(pushshift.get_comments_for_submission_id(POST_ID))
+    assert sorted(comment['id'] for comment in comments) == sorted(stub.comments)
+    assert len(stub.requests) == 1 + 11
+    assert stub.max_in_flight == 4
+
+
+def test_throttled_and_failed_requests_are_retried(scheduler, instrumentation):
+    with StubPushShift(500) as stub, get_async_pushshift(stub) as pushshift:
+        chunks = PushShift.get_comment_id_chunks(list(stub.comments))
+        stub.failures = {chunks[1][0]: [429, 429], chunks[2][0]: [503], chunks[4][0]: [500, 502, 504]}
+        comments = asyncio.run(pushshift.get_comments_for_submission_id(POST_ID))
+    assert sorted(comment['id'] for comment in comments) == sorted(stub.comments)
+    assert pushshift.skipped_chunks == []
+    assert len(stub.requests) == 1 + len(chunks) + 6
+    assert instrumentation.counters['api.pushshift.retries'] == 6
+    assert instrumentation.counters['api.pushshift.status_429'] == 2
+
+
+def test_chunks_that_fail_are_skipped(scheduler, instrumentation):
+    with StubPushShift(500) as stub, get_async_pushshift(stub, max_retries=2) as pushshift:
+        chunks = PushShift.get_comment_id_chunks(list(stub.comments))
+        stub.failures = {chunks[0][0]: [503] * 3, chunks[2][0]: [404], chunks[3][0]: [200]}
+        comments = asyncio.run(pushshift.get_comments_for_submission_id(POST_ID))
+    skipped_ids = {comment_id for index in [0, 2, 3] for comment_id in chunks[index]}
+    assert sorted(comment['id'] for comment in comments) == sorted(set(stub.comments) - skipped_ids)
+    assert sorted(chunk['comment_ids'][0] for chunk in pushshift.skipped_chunks) == \
+        sorted(chunks[index][0] for index in [0, 2, 3])
+    assert all(set(chunk['comment_ids']) <= skipped_ids for chunk in pushshift.skipped_chunks)
+    reasons = {chunk['comment_ids'][0]: chunk['reason'] for chunk in pushshift.skipped_chunks}
+    assert '503' in reasons[chunks[0][0]] and '404' in reasons[chunks[2][0]] and 'KeyError' in reasons[chunks[3][0]]
+    assert instrumentation.counters['api.pushshift.skipped_chunks'] == 3
+    assert instrumentation.counters['api.pushshift.skipped_comments'] == len(skipped_ids)
+    assert instrumentation.counters['api.pushshift.missed_comments'] == len(skipped_ids)
+
+
+def test_iter_yields_every_chunk(scheduler):
+    with StubPushShift(300) as stub, get_async_pushshift(stub) as pushshift:
+
+        async def collect():
+            return [chunk async for chunk in pushshift.iter_comments_for_comment_ids(list(stub.comments))]
+
+        chunks = asyncio.run(collect())
+    assert len(chunks) == 4
+    assert sorted(comment['id'] for chunk in chunks for comment in chunk) == sorted(stub.comments)
+
+
+def test_same_comments_as_the_sync_client(scheduler, monkeypatch):
+    with StubPushShift(1000) as stub:
+        monkeypatch.setattr(PushShift, 'PATH', stub.path)
+        chunks = PushShift.get_comment_id_chunks(list(stub.comments))
+        stub.failures = {chunks[3][0]: [429]}
+        sync_comments = PushShift.get_comments_for_submission_id(POST_ID)
+        stub.failures = {chunks[3][0]: [429]}
+        with get_async_pushshift(stub) as pushshift:
+            async_comments = asyncio.run(pushshift.get_comments_for_submission_id(POST_ID))
+    # The chunk that is retried finishes last, its comments still come in the order of the chunks
+    assert async_comments == sync_comments
+    assert len(sync_comments) == len(stub.comments)
@@ -0,0 +1,150 @@
+import time
+import pickle
+import threading
+import pytest
+from Ingest.ratelimit import Priority, RateBudget, RequestScheduler, get_request_priority, request_priority
+
+
+def run_waiters(budget: RateBudget, priorities: list, stagger_seconds: float = 0.02) -> list:
+    """
+    Starts a thread acquiring a token of budget for every priority, in order
+    :return: The indices of the threads in the order they got their token
+    """
+    served, lock = [], threading.Lock()
+
+    def acquire(index: int, priority: int):
+        budget.acquire(priority)
+        with lock:
+            served.append(index)
+
+    threads = [threading.Thread(target=acquire, args=(index, priority)) for index, priority in enumerate(priorities)]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger_seconds)
+    for thread in threads:
+        thread.join(timeout=10)
+    return served
+
+
+def test_acquire_keeps_to_the_rate():
+    budget = RateBudget(50.0)
+    start = time.monotonic()
+    for _ in range(11):
+        budget.acquire()
+    assert time.monotonic() - start >= 10 / 50 - 0.02
+
+
+def test_burst_is_available_at_once():
+    budget = RateBudget(1.0, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        budget.acquire()
+    assert time.monotonic() - start < 0.5
+    assert budget.get_state()["tokens"] < 1
+
+
+def test_shared_budget_limits_all_threads_together():
+    budget = RateBudget(100.0)
+    start = time.monotonic()
+    served = run_waiters(budget, [Priority.COMMENT_ENRICHMENT] * 21, stagger_seconds=0)
+    assert len(served) == 21
+    assert time.monotonic() - start >= 20 / 100 - 0.02
+
+
+def test_higher_priority_waiters_are_served_first():
+    budget = RateBudget(50.0)
+    budget.pause(0.3)   # Everybody queues up while paused
+    priorities = [Priority.USER_HISTORY] * 3 + [Priority.COMMENT_ENRICHMENT] * 3
+    served = run_waiters(budget, priorities)
+    assert served == [3, 4, 5, 0, 1, 2]     # First come first served within a priority
+
+
+def test_pause_holds_back_tokens():
+    budget = RateBudget(100.0, burst=5)
+    budget.pause(0.2)
+    assert budget.get_state()["paused_seconds"] > 0.1
+    start = time.monotonic()
+    budget.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_rate_adapts_to_headers():
+    budget = RateBudget(1.0, max_requests_per_second=5.0)
+    assert budget.update_from_headers({'x-ratelimit-remaining': '300', 'x-ratelimit-reset': '100'})
+    assert budget.requests_per_second == pytest.approx(3.0)
+    budget.update_from_headers({'x-ratelimit-remaining': '600', 'x-ratelimit-reset': '0'})     # Capped
+    assert budget.requests_per_second == pytest.approx(5.0)
+    assert not budget.update_from_headers({'x-ratelimit-remaining': '300'})
+    assert not budget.update_from_headers({'x-ratelimit-remaining': 'many', 'x-ratelimit-reset': '10'})
+    assert budget.requests_per_second == pytest.approx(5.0)
+
+
+def test_shared_budget_takes_its_share_of_the_headers():
+    budget = RateBudget(1.0, share=0.25)
+    budget.update_from_headers({'x-ratelimit-remaining': '400', 'x-ratelimit-reset': '100'})
+    assert budget.requests_per_second == pytest.approx(1.0)
+
+
+def test_exhausted_window_pauses():
+    budget = RateBudget(10.0)
+    assert budget.update_from_headers({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '30'})
+    assert budget.requests_per_second == 10.0
+    assert budget.get_state()["paused_seconds"] > 29
+
+
+def test_request_priority_is_per_thread():
+    priorities = []
+    assert get_request_priority() == Priority.COMMENT_ENRICHMENT
+    with request_priority(Priority.USER_HISTORY):
+        thread = threading.Thread(target=lambda: priorities.append(get_request_priority()))
+        thread.start()
+        thread.join()
+        priorities.append(get_request_priority())
+        with request_priority(Priority.COMMENT_ENRICHMENT):
+            priorities.append(get_request_priority())
+        priorities.append(get_request_priority())
+    assert priorities == [Priority.COMMENT_ENRICHMENT, Priority.USER_HISTORY, Priority.COMMENT_ENRICHMENT,
+                          Priority.USER_HISTORY]
+    assert get_request_priority() == Priority.COMMENT_ENRICHMENT
+
+
+def test_scheduler_budgets_and_shares():
+    scheduler = RequestScheduler({"reddit": 2.0, "pushshift": 4.0}, burst=3)
+    assert scheduler.get_budget('reddit') is scheduler.get_budget('reddit')
+    assert scheduler.get_budget('pushshift').requests_per_second == 4.0
+    assert scheduler.get_budget('other').requests_per_second == RequestScheduler.DEFAULT_REQUESTS_PER_SECOND
+    share = scheduler.get_share(4)
+    assert share.get_budget('pushshift').requests_per_second == pytest.approx(1.0)
+    assert share.get_budget('pushshift').share == pytest.approx(0.25)
+    assert share.get_budget('pushshift').burst == 3
+    assert set(scheduler.get_state()) == {'reddit', 'pushshift', 'other'}
+
+
+def test_pickled_scheduler_starts_over():
+    scheduler = RequestScheduler({"reddit": 2.0}, share=0.5)
+    scheduler.get_budget('reddit').pause(100)
+    unpickled = pickle.loads(pickle.dumps(scheduler))
+    assert unpickled.budgets == {}
+    assert unpickled.get_budget('reddit').requests_per_second == pytest.approx(1.0)
+    assert unpickled.get_budget('reddit').get_state()["paused_seconds"] == 0
+
+
+class Response:
+
+    def __init__(self, status_code: int, headers: dict):
+        self.status_code = status_code
+        self.headers = headers
+
+
+def test_reddit_requestor_adapts_the_budget():
+    from Ingest.Reddit import BudgetedRequestor
+    budget = RateBudget(1.0)
+    requestor = BudgetedRequestor('user agent', budget=budget)
+    response = Response(200, {'x-ratelimit-remaining': '120', 'x-ratelimit-used': '480', 'x-ratelimit-reset': '60'})
+    requestor.update_budget(response)
+    assert budget.requests_per_second == pytest.approx(2.0)
+    assert response.headers == {}   # prawcore doesn't sleep on them as well
+    requestor.update_budget(Response(429, {'retry-after': '20'}))
+    assert 19 < budget.get_state()["paused_seconds"] <= 20
+    assert BudgetedRequestor.get_request_type('https://oauth.reddit.com/user/spez/comments') == 'user_comments'
+    assert BudgetedRequestor.get_request_type('https://oauth.reddit.com/api/info/') == 'info'
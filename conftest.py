@@ -0,0 +1,6 @@
+"""
+    The tests live next to the code they test, e.g Analysis/test_Common.py. pytest puts the directory of this conftest
+    on sys.path, so they import `Analysis` and `Ingest` like the scripts do:
+
+        python -m pytest -q
+"""